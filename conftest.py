@@ -9,6 +9,8 @@ def pytest_addoption(parser):
                     help="dump binary file for each test" )
   parser.addoption( "--test-verilog", action="store", default='', nargs='?', const='zeros', choices=[ '', 'zeros', 'ones', 'rand' ],
                     help="run verilog translation, " )
+  parser.addoption( "--benchmark", action="store_true",
+                    help="run simulation performance benchmarks" )
 
 def pytest_funcarg__dump_vcd(request):
   """Dump VCD for each test."""
@@ -40,3 +42,5 @@ def pytest_runtest_setup(item):
   test_verilog = item.config.option.test_verilog
   if test_verilog and 'test_verilog' not in item.funcargnames:
     pytest.skip("ignoring non-Verilog tests")
+  if 'benchmark' in item.keywords and not item.config.option.benchmark:
+    pytest.skip("benchmarks only run with --benchmark")
@@ -0,0 +1,7 @@
+#=========================================================================
+# __init__
+#=========================================================================
+
+from benchmarks  import benchmarks
+from bench_utils import run_benchmark, run_benchmarks, compare
+from bench_utils import run_threads_benchmark
@@ -0,0 +1,14 @@
+#=========================================================================
+# __main__
+#=========================================================================
+# Command line entry point for the benchmark suite:
+#
+#   python -m pclib.bench run -o results.json
+#   python -m pclib.bench compare baseline.json results.json
+#   python -m pclib.bench threads --threads 1 2 4 8 --size 16
+
+import sys
+
+from bench_utils import main
+
+sys.exit( main() )
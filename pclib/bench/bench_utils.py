@@ -0,0 +1,324 @@
+#=========================================================================
+# bench_utils
+#=========================================================================
+# Helpers for measuring simulation performance, storing the results as
+# JSON, and comparing two result files to flag regressions.
+#
+# Each benchmark reports:
+#
+#  - elab_time:       seconds to construct and elaborate the model
+#  - sim_time:        seconds to construct the SimulationTool
+#  - cycles_per_sec:  simulated cycles per second (after reset/warmup)
+#  - allocs_per_cycle: net number of garbage collector tracked objects
+#                     allocated (allocations minus deallocations) per
+#                     cycle, measured with automatic collection disabled
+#  - peak_rss_kb:     peak resident set size of the process
+#
+# Peak RSS is per process, so the command line tool runs every benchmark
+# in a fresh interpreter. It also runs each benchmark twice, once in dev
+# mode and once under python -O, which selects the _perf_cycle and
+# _perf_eval implementations of SimulationTool.
+#
+# The threads command instead measures how a large translated design
+# scales with the number of threads Verilator evaluates it on.
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import random
+
+from pymtl      import SimulationTool, TranslationTool
+from benchmarks import benchmarks, mk_drive, Mesh, NSTIMULUS
+
+# Metrics compared by default, and whether larger values are better
+
+METRICS = {
+  'cycles_per_sec'   : True,
+  'elab_time'        : False,
+  'sim_time'         : False,
+  'allocs_per_cycle' : False,
+  'peak_rss_kb'      : False,
+}
+
+#-------------------------------------------------------------------------
+# peak_rss_kb
+#-------------------------------------------------------------------------
+
+def peak_rss_kb():
+  try:
+    import resource
+  except ImportError:
+    return None
+  rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+  return rss / 1024 if sys.platform == 'darwin' else rss
+
+#-------------------------------------------------------------------------
+# run_benchmark
+#-------------------------------------------------------------------------
+# Run the named benchmark in the current process and return a dictionary
+# of measurements.
+
+def run_benchmark( name, ncycles=10000, nalloc_cycles=1000 ):
+
+  timer = timeit.default_timer
+  bench = benchmarks[ name ]
+
+  # Elaboration
+
+  start = timer()
+  model, get_ports = bench( ncycles + nalloc_cycles )
+  model.elaborate()
+  elab_time = timer() - start
+
+  # Simulator construction
+
+  start = timer()
+  sim = SimulationTool( model )
+  sim_time = timer() - start
+
+  drive = mk_drive( get_ports( model ) ) if get_ports else None
+
+  sim.reset()
+
+  # Throughput
+
+  start = timer()
+  if drive:
+    for i in xrange( ncycles ):
+      drive( i )
+      sim.cycle()
+  else:
+    for i in xrange( ncycles ):
+      sim.cycle()
+  run_time = timer() - start
+
+  # Allocations per cycle
+
+  gc.collect()
+  gc.disable()
+  try:
+    count = gc.get_count()[0]
+    for i in xrange( ncycles, ncycles + nalloc_cycles ):
+      if drive:
+        drive( i )
+      sim.cycle()
+    allocs = gc.get_count()[0] - count
+  finally:
+    gc.enable()
+
+  return {
+    'name'             : name,
+    'mode'             : 'perf' if sys.flags.optimize else 'dev',
+    'ncycles'          : ncycles,
+    'elab_time'        : elab_time,
+    'sim_time'         : sim_time,
+    'cycles_per_sec'   : ncycles / run_time if run_time else float('inf'),
+    'allocs_per_cycle' : float( allocs ) / nalloc_cycles,
+    'peak_rss_kb'      : peak_rss_kb(),
+  }
+
+#-------------------------------------------------------------------------
+# run_benchmarks
+#-------------------------------------------------------------------------
+# Run each benchmark in a fresh interpreter, in dev and/or perf mode, and
+# return a dictionary of results suitable for dumping as JSON.
+
+def run_benchmarks( names=None, ncycles=10000, modes=( 'dev', 'perf' ),
+                    verbose=False ):
+
+  root = os.path.dirname( os.path.dirname( os.path.dirname(
+           os.path.abspath( __file__ ) ) ) )
+  env  = dict( os.environ )
+  env['PYTHONPATH'] = os.pathsep.join(
+    [ root ] + filter( None, [ env.get( 'PYTHONPATH' ) ] ) )
+
+  results = []
+  for mode in modes:
+    for name in names or benchmarks.keys():
+      cmd = [ sys.executable ] + ( [ '-O' ] if mode == 'perf' else [] ) + \
+            [ '-m', 'pclib.bench', 'worker', name, '--ncycles', str(ncycles) ]
+      result = json.loads( subprocess.check_output( cmd, env=env ) )
+      if verbose:
+        print( "{:30} {:4} {:12.1f} cycles/sec".format(
+               name, mode, result['cycles_per_sec'] ) )
+      results.append( result )
+
+  return {
+    'python'  : platform.python_version(),
+    'machine' : platform.machine(),
+    'results' : results,
+  }
+
+#-------------------------------------------------------------------------
+# run_threads_benchmark
+#-------------------------------------------------------------------------
+# Translate a size x size Mesh and measure its throughput when built for
+# each of the given thread counts. The model is driven with random
+# stimulus through BatchSimulationTool so that the time spent in Python
+# does not hide the speedup. Returns a dictionary of results suitable
+# for dumping as JSON, where the speedup is relative to the first thread
+# count.
+
+def run_threads_benchmark( threads=( 1, 2, 4, 8 ), size=16, ncycles=100000,
+                           profile='fast', verbose=False ):
+
+  from pymtl import BatchSimulationTool
+
+  timer = timeit.default_timer
+  rng   = random.Random( 0xdeadbeef )
+  rows  = [ [ rng.randint( 0, 2**32 - 1 ) for _ in range( 2*size ) ]
+            for _ in range( NSTIMULUS ) ]
+
+  results = []
+  for nthreads in threads:
+
+    # Build (or fetch from the build cache)
+
+    start = timer()
+    model = TranslationTool( Mesh( size ), profile=profile, threads=nthreads )
+    model.elaborate()
+    build_time = timer() - start
+
+    sim = BatchSimulationTool( model )
+    sim.reset()
+
+    # Throughput
+
+    start = timer()
+    for i in xrange( 0, ncycles, NSTIMULUS ):
+      sim.cycle_n( rows[ : min( NSTIMULUS, ncycles - i ) ] )
+    run_time = timer() - start
+
+    result = {
+      'name'           : 'Mesh{0}x{0}'.format( size ),
+      'threads'        : nthreads,
+      'ncycles'        : ncycles,
+      'build_time'     : build_time,
+      'cycles_per_sec' : ncycles / run_time if run_time else float('inf'),
+    }
+    result['speedup'] = result['cycles_per_sec'] / \
+                        ( results or [ result ] )[0]['cycles_per_sec']
+
+    if verbose:
+      print( "{:12} {:2} threads {:12.1f} cycles/sec {:6.2f}x".format(
+             result['name'], nthreads, result['cycles_per_sec'],
+             result['speedup'] ) )
+
+    results.append( result )
+
+  return {
+    'python'  : platform.python_version(),
+    'machine' : platform.machine(),
+    'ncpus'   : multiprocessing.cpu_count(),
+    'results' : results,
+  }
+
+#-------------------------------------------------------------------------
+# compare
+#-------------------------------------------------------------------------
+# Compare two result dictionaries and return a list of regressions, as
+# ( name, mode, metric, old, new, change ) tuples. A regression is a
+# relative change for the worse of more than threshold.
+
+def compare( old, new, threshold=0.10 ):
+
+  key = lambda r: ( r['name'], r['mode'] )
+  old_results = dict( ( key( r ), r ) for r in old['results'] )
+
+  regressions = []
+  for r in new['results']:
+    o = old_results.get( key( r ) )
+    if not o:
+      continue
+    for metric, higher_is_better in sorted( METRICS.items() ):
+      if not o.get( metric ) or r.get( metric ) is None:
+        continue
+      change = float( r[ metric ] - o[ metric ] ) / o[ metric ]
+      if higher_is_better:
+        change = -change
+      if change > threshold:
+        regressions.append( ( r['name'], r['mode'], metric,
+                              o[ metric ], r[ metric ], change ) )
+
+  return regressions
+
+#-------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------
+
+def main( argv=None ):
+
+  p = argparse.ArgumentParser( prog='python -m pclib.bench' )
+  subparsers = p.add_subparsers( dest='command' )
+
+  p_run = subparsers.add_parser( 'run', help='run benchmarks' )
+  p_run.add_argument( 'names', nargs='*', help='benchmarks (default: all)' )
+  p_run.add_argument( '--ncycles', type=int, default=10000 )
+  p_run.add_argument( '--mode', choices=[ 'dev', 'perf', 'both' ],
+                      default='both' )
+  p_run.add_argument( '-o', '--output', default='pymtl-bench.json' )
+
+  p_cmp = subparsers.add_parser( 'compare', help='compare two results' )
+  p_cmp.add_argument( 'old' )
+  p_cmp.add_argument( 'new' )
+  p_cmp.add_argument( '--threshold', type=float, default=0.10 )
+
+  p_list = subparsers.add_parser( 'list', help='list benchmarks' )
+
+  p_thr = subparsers.add_parser( 'threads',
+            help='measure multithreaded Verilator model scaling' )
+  p_thr.add_argument( '--threads', type=int, nargs='+',
+                      default=[ 1, 2, 4, 8 ] )
+  p_thr.add_argument( '--size', type=int, default=16 )
+  p_thr.add_argument( '--ncycles', type=int, default=100000 )
+  p_thr.add_argument( '--profile', default='fast' )
+  p_thr.add_argument( '-o', '--output', default='pymtl-bench-threads.json' )
+
+  p_work = subparsers.add_parser( 'worker', help=argparse.SUPPRESS )
+  p_work.add_argument( 'name' )
+  p_work.add_argument( '--ncycles', type=int, default=10000 )
+
+  opts = p.parse_args( argv )
+
+  if opts.command == 'list':
+    for name in benchmarks:
+      print( name )
+
+  elif opts.command == 'worker':
+    print( json.dumps( run_benchmark( opts.name, opts.ncycles ) ) )
+
+  elif opts.command == 'run':
+    modes   = ( 'dev', 'perf' ) if opts.mode == 'both' else ( opts.mode, )
+    results = run_benchmarks( opts.names, opts.ncycles, modes, verbose=True )
+    with open( opts.output, 'w' ) as f:
+      json.dump( results, f, indent=2, sort_keys=True )
+    print( "Results written to {}".format( opts.output ) )
+
+  elif opts.command == 'threads':
+    results = run_threads_benchmark( opts.threads, opts.size, opts.ncycles,
+                                     opts.profile, verbose=True )
+    with open( opts.output, 'w' ) as f:
+      json.dump( results, f, indent=2, sort_keys=True )
+    print( "Results written to {}".format( opts.output ) )
+
+  elif opts.command == 'compare':
+    old = json.load( open( opts.old ) )
+    new = json.load( open( opts.new ) )
+    regressions = compare( old, new, opts.threshold )
+    for name, mode, metric, o, n, change in regressions:
+      print( "REGRESSION {:30} {:4} {:16} {:12.4g} -> {:12.4g} ({:+.1%})"
+             .format( name, mode, metric, o, n, change ) )
+    if regressions:
+      return 1
+    print( "No regressions above {:.0%}".format( opts.threshold ) )
+
+  return 0
@@ -0,0 +1,218 @@
+#=========================================================================
+# benchmarks
+#=========================================================================
+# Simulation throughput benchmarks over pclib components. Each benchmark
+# is a function which takes the number of cycles to simulate and returns
+# an unelaborated model along with an optional function that returns the
+# list of input ports to drive with random stimulus. The ports are looked
+# up once the simulator has been constructed. Models driven by test
+# sources/sinks return None instead.
+#
+# Stimulus is generated up front from a fixed seed and reused cyclically
+# so that random number generation does not show up in the results.
+
+import collections
+import random
+
+from pymtl      import *
+from pclib.ifcs import MemMsg4B
+from pclib.rtl  import NormalQueue, SingleElementBypassQueue
+from pclib.rtl  import SingleElementPipelinedQueue, TwoElementBypassQueue
+from pclib.rtl  import RoundRobinArbiter, Crossbar, RegisterFile
+from pclib.test import TestSource, TestSink, TestMemory
+
+from pclib.rtl.SRAMs import SRAMBitsComb_rst_1rw, SRAMBitsSync_rst_1rw
+
+NSTIMULUS = 1024
+
+#-------------------------------------------------------------------------
+# SrcSinkHarness
+#-------------------------------------------------------------------------
+# Streams messages from a TestSource through the model under test into a
+# TestSink. The harness is sized so that it never runs out of messages
+# within the benchmarked number of cycles.
+
+class SrcSinkHarness( Model ):
+
+  def __init__( s, model, in_, out, dtype, msgs ):
+
+    s.src   = TestSource( dtype, msgs )
+    s.model = model
+    s.sink  = TestSink  ( dtype, msgs )
+
+    s.connect( s.src.out, getattr( s.model, in_  ) )
+    s.connect( s.sink.in_, getattr( s.model, out ) )
+
+  def done( s ):
+    return s.src.done and s.sink.done
+
+  def line_trace( s ):
+    return s.src.line_trace() + " > " + s.sink.line_trace()
+
+#-------------------------------------------------------------------------
+# mk_drive
+#-------------------------------------------------------------------------
+# Creates a drive function which writes a random value to each of the
+# given ports. The drive function is called with the cycle number before
+# every simulated cycle.
+
+def mk_drive( ports, seed=0xdeadbeef ):
+
+  rng  = random.Random( seed )
+  rows = [ [ rng.randint( 0, 2**port.nbits - 1 ) for port in ports ]
+           for _ in range( NSTIMULUS ) ]
+
+  def drive( cycle ):
+    for port, value in zip( ports, rows[ cycle % NSTIMULUS ] ):
+      port.value = value
+
+  return drive
+
+#-------------------------------------------------------------------------
+# Queue benchmarks
+#-------------------------------------------------------------------------
+
+def mk_queue_bench( mk_queue ):
+  def bench( ncycles ):
+    msgs = [ Bits( 32, i & 0xffffffff ) for i in range( ncycles + 16 ) ]
+    return SrcSinkHarness( mk_queue( Bits(32) ), 'enq', 'deq',
+                           Bits(32), msgs ), None
+  return bench
+
+#-------------------------------------------------------------------------
+# RoundRobinArbiter
+#-------------------------------------------------------------------------
+
+def bench_RoundRobinArbiter( ncycles ):
+  return RoundRobinArbiter( 8 ), lambda m: [ m.reqs ]
+
+#-------------------------------------------------------------------------
+# Crossbar
+#-------------------------------------------------------------------------
+
+def bench_Crossbar( ncycles ):
+  return Crossbar( 8, Bits(32) ), lambda m: m.in_ + m.sel
+
+#-------------------------------------------------------------------------
+# RegisterFile
+#-------------------------------------------------------------------------
+
+def bench_RegisterFile( ncycles ):
+  return ( RegisterFile( nregs=32, rd_ports=2 ),
+           lambda m: m.rd_addr + [ m.wr_addr, m.wr_data, m.wr_en ] )
+
+#-------------------------------------------------------------------------
+# SRAMs
+#-------------------------------------------------------------------------
+
+def mk_sram_bench( SRAM ):
+  def bench( ncycles ):
+    return SRAM( 256, 32 ), lambda m: [ m.wen, m.addr, m.wdata ]
+  return bench
+
+#-------------------------------------------------------------------------
+# TestMemory
+#-------------------------------------------------------------------------
+
+class TestMemoryHarness( Model ):
+
+  def __init__( s, ncycles ):
+
+    ifc  = MemMsg4B()
+    reqs, resps = [], []
+    for i in range( ncycles/2 + 16 ):
+      addr = 4*( i % 1024 )
+      data = i & 0xffffffff
+      reqs .append( ifc.req .mk_wr( i & 0xff, addr, 0, data ) )
+      resps.append( ifc.resp.mk_wr( i & 0xff, 0 ) )
+      reqs .append( ifc.req .mk_rd( i & 0xff, addr, 0 ) )
+      resps.append( ifc.resp.mk_rd( i & 0xff, 0, data ) )
+
+    s.src  = TestSource( ifc.req,  reqs  )
+    s.mem  = TestMemory( ifc, 1 )
+    s.sink = TestSink  ( ifc.resp, resps )
+
+    s.connect( s.src.out,  s.mem.reqs[0]  )
+    s.connect( s.sink.in_, s.mem.resps[0] )
+
+  def done( s ):
+    return s.src.done and s.sink.done
+
+  def line_trace( s ):
+    return s.mem.line_trace()
+
+def bench_TestMemory( ncycles ):
+  return TestMemoryHarness( ncycles ), None
+
+#-------------------------------------------------------------------------
+# Mesh
+#-------------------------------------------------------------------------
+# A size x size grid of accumulators, each combining the values of its
+# north and west neighbours. Inputs feed the top row and the left column,
+# and the bottom row drives the outputs. Only meant to be simulated
+# translated with Verilator, see run_threads_benchmark.
+
+class MeshNode( Model ):
+
+  def __init__( s, nbits ):
+
+    s.in_n = InPort ( nbits )
+    s.in_w = InPort ( nbits )
+    s.out  = OutPort( nbits )
+
+    s.acc  = Wire( nbits )
+
+    @s.posedge_clk
+    def seq():
+      if s.reset:
+        s.acc.next = 0
+      else:
+        s.acc.next = ( ( s.acc << 1 ) ^ s.in_n ) + ( s.in_w ^ s.acc )
+
+    @s.combinational
+    def comb():
+      s.out.value = s.acc
+
+class Mesh( Model ):
+
+  def __init__( s, size=16, nbits=32 ):
+
+    s.in_  = [ InPort ( nbits ) for _ in range( 2*size ) ]
+    s.out  = [ OutPort( nbits ) for _ in range( size ) ]
+
+    s.nodes = [ MeshNode( nbits ) for _ in range( size*size ) ]
+
+    for i in range( size ):
+      for j in range( size ):
+        node = s.nodes[ i*size + j ]
+
+        if i == 0: s.connect( node.in_n, s.in_[j] )
+        else:      s.connect( node.in_n, s.nodes[ (i-1)*size + j ].out )
+
+        if j == 0: s.connect( node.in_w, s.in_[ size + i ] )
+        else:      s.connect( node.in_w, s.nodes[ i*size + j-1 ].out )
+
+    for j in range( size ):
+      s.connect( s.out[j], s.nodes[ (size-1)*size + j ].out )
+
+#-------------------------------------------------------------------------
+# benchmarks
+#-------------------------------------------------------------------------
+# All benchmarks, in the order they are run.
+
+benchmarks = collections.OrderedDict([
+  ( 'NormalQueue',
+    mk_queue_bench( lambda dtype: NormalQueue( 4, dtype ) ) ),
+  ( 'SingleElementBypassQueue',
+    mk_queue_bench( SingleElementBypassQueue ) ),
+  ( 'SingleElementPipelinedQueue',
+    mk_queue_bench( SingleElementPipelinedQueue ) ),
+  ( 'TwoElementBypassQueue',
+    mk_queue_bench( TwoElementBypassQueue ) ),
+  ( 'RoundRobinArbiter',     bench_RoundRobinArbiter ),
+  ( 'Crossbar',              bench_Crossbar ),
+  ( 'RegisterFile',          bench_RegisterFile ),
+  ( 'SRAMBitsComb_rst_1rw',  mk_sram_bench( SRAMBitsComb_rst_1rw ) ),
+  ( 'SRAMBitsSync_rst_1rw',  mk_sram_bench( SRAMBitsSync_rst_1rw ) ),
+  ( 'TestMemory',            bench_TestMemory ),
+])
@@ -0,0 +1,66 @@
+#=========================================================================
+# benchmarks_test
+#=========================================================================
+# The benchmarks themselves only run with py.test --benchmark, in which
+# case each benchmark is run in-process for a small number of cycles.
+
+import pytest
+
+from pymtl       import requires_verilator
+from pclib.bench import benchmarks, run_benchmark, compare
+from pclib.bench import run_threads_benchmark
+
+#-------------------------------------------------------------------------
+# test_benchmark
+#-------------------------------------------------------------------------
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize( 'name', benchmarks.keys() )
+def test_benchmark( name ):
+  result = run_benchmark( name, ncycles=500, nalloc_cycles=100 )
+  assert result['name']           == name
+  assert result['cycles_per_sec'] >  0
+  assert result['elab_time']      >  0
+  assert result['sim_time']       >  0
+
+#-------------------------------------------------------------------------
+# test_threads_benchmark
+#-------------------------------------------------------------------------
+
+@pytest.mark.benchmark
+@requires_verilator
+def test_threads_benchmark():
+  results = run_threads_benchmark( threads=( 1, 2 ), size=4, ncycles=2000 )
+  assert [ r['threads'] for r in results['results'] ] == [ 1, 2 ]
+  assert results['results'][0]['speedup'] == 1.0
+  assert all( r['cycles_per_sec'] > 0 for r in results['results'] )
+
+#-------------------------------------------------------------------------
+# test_compare
+#-------------------------------------------------------------------------
+
+def mk_results( **metrics ):
+  result = { 'name' : 'Foo', 'mode' : 'dev' }
+  result.update( metrics )
+  return { 'results' : [ result ] }
+
+def test_compare():
+
+  old = mk_results( cycles_per_sec=1000.0, elab_time=1.0, peak_rss_kb=100 )
+
+  # Within threshold
+
+  new = mk_results( cycles_per_sec=950.0, elab_time=1.05, peak_rss_kb=90 )
+  assert compare( old, new, threshold=0.10 ) == []
+
+  # Slower simulation and elaboration are both regressions
+
+  new = mk_results( cycles_per_sec=800.0, elab_time=1.5, peak_rss_kb=100 )
+  regressions = compare( old, new, threshold=0.10 )
+  assert [ r[2] for r in regressions ] == [ 'cycles_per_sec', 'elab_time' ]
+  assert regressions[0][3:5] == ( 1000.0, 800.0 )
+
+  # Faster is never a regression
+
+  new = mk_results( cycles_per_sec=5000.0, elab_time=0.1, peak_rss_kb=10 )
+  assert compare( old, new, threshold=0.10 ) == []
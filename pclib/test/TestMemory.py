@@ -6,6 +6,10 @@
 # the one in pclib because we actually use the memory messages correctly
 # in the interface.
 
+import struct
+
+from binascii   import hexlify, unhexlify
+
 from pymtl      import *
 from pclib.ifcs import MemMsg, MemReqMsg, MemRespMsg, MemMsg4B
 from pclib.ifcs import InValRdyBundle, OutValRdyBundle
@@ -79,19 +83,20 @@ class TestMemory( Model ):
 
           # When len is zero, then we use all of the data
 
-          nbytes = memreq.len
-          if memreq.len == 0:
+          nbytes = memreq.len.uint()
+          if nbytes == 0:
             nbytes = s.data_nbits/8
 
+          addr = memreq.addr.uint()
+
           # Handle a read request
 
           if memreq.type_ == MemReqMsg.TYPE_READ:
 
             # Copy the bytes from the bytearray into read data bits
 
-            read_data = Bits( s.data_nbits )
-            for j in range( nbytes ):
-              read_data[j*8:j*8+8] = s.mem[ memreq.addr + j ]
+            read_data = Bits( s.data_nbits,
+                              read_int( s.mem, addr, nbytes ) )
 
             # Create and enqueue response message
 
@@ -103,9 +108,7 @@ class TestMemory( Model ):
 
             # Copy write data bits into bytearray
 
-            write_data = memreq.data
-            for j in range( nbytes ):
-              s.mem[ memreq.addr + j ] = write_data[j*8:j*8+8].uint()
+            write_int( s.mem, addr, nbytes, memreq.data.uint() )
 
             # Create and enqueu response message
 
@@ -123,9 +126,8 @@ class TestMemory( Model ):
 
             # Copy the bytes from the bytearray into read data bits
 
-            read_data = Bits( s.data_nbits )
-            for j in range( nbytes ):
-              read_data[j*8:j*8+8] = s.mem[ memreq.addr + j ]
+            read_data = Bits( s.data_nbits,
+                              read_int( s.mem, addr, nbytes ) )
 
             # compute the data to be written
 
@@ -133,8 +135,7 @@ class TestMemory( Model ):
 
             # Copy write data bits into bytearray
 
-            for j in range( nbytes ):
-              s.mem[ memreq.addr + j ] = write_data[j*8:j*8+8].uint()
+            write_int( s.mem, addr, nbytes, write_data.uint() )
 
             # Create and enqueue response message
 
@@ -191,3 +192,68 @@ AMO_FUNS = { MemReqMsg.TYPE_AMO_ADD  : lambda m,a : m+a,
              MemReqMsg.TYPE_AMO_MIN  : min,
            }
 
+
+#-------------------------------------------------------------------------
+# read_int / write_int
+#-------------------------------------------------------------------------
+# Read and write nbytes of a bytearray starting at addr as a single
+# little-endian integer. Accesses of 1, 2, 4 and 8 bytes, and line-sized
+# accesses which are a multiple of 8 bytes (e.g., with MemMsg16B), use
+# precompiled structs so that there is only one conversion per access.
+# Other sizes go through a hex string. Accesses past the end of the
+# memory raise IndexError, whatever their size.
+
+_formats = { 1 : 'B', 2 : 'H', 4 : 'I', 8 : 'Q' }
+
+def _mk_read( nbytes ):
+
+  if nbytes in _formats:
+    unpack_from = struct.Struct( '<' + _formats[ nbytes ] ).unpack_from
+    return lambda mem, addr: unpack_from( mem, addr )[0]
+
+  unpack_from = struct.Struct( '<{}Q'.format( nbytes/8 ) ).unpack_from
+  def read( mem, addr ):
+    value = 0
+    for word in reversed( unpack_from( mem, addr ) ):
+      value = ( value << 64 ) | word
+    return value
+  return read
+
+def _mk_write( nbytes ):
+
+  mask = ( 1 << 8*nbytes ) - 1
+
+  if nbytes in _formats:
+    pack_into = struct.Struct( '<' + _formats[ nbytes ] ).pack_into
+    return lambda mem, addr, value: pack_into( mem, addr, value & mask )
+
+  pack_into = struct.Struct( '<{}Q'.format( nbytes/8 ) ).pack_into
+  shifts    = range( 0, 8*nbytes, 64 )
+  def write( mem, addr, value ):
+    pack_into( mem, addr, *[ ( value >> x ) & 0xffffffffffffffff
+                             for x in shifts ] )
+  return write
+
+_reads  = dict( ( n, _mk_read ( n ) ) for n in [ 1, 2, 4, 8, 16, 32, 64 ] )
+_writes = dict( ( n, _mk_write( n ) ) for n in [ 1, 2, 4, 8, 16, 32, 64 ] )
+
+def read_int( mem, addr, nbytes ):
+
+  if addr + nbytes > len( mem ):
+    raise IndexError( "bytearray index out of range" )
+
+  if nbytes in _reads:
+    return _reads[ nbytes ]( mem, addr )
+
+  return int( hexlify( mem[ addr : addr + nbytes ][::-1] ) or '0', 16 )
+
+def write_int( mem, addr, nbytes, value ):
+
+  if addr + nbytes > len( mem ):
+    raise IndexError( "bytearray index out of range" )
+
+  if nbytes in _writes:
+    return _writes[ nbytes ]( mem, addr, value )
+
+  value &= ( 1 << 8*nbytes ) - 1
+  mem[ addr : addr + nbytes ] = unhexlify( '%0*x' % ( 2*nbytes, value ) )[::-1]
@@ -12,8 +12,8 @@ from pymtl      import *
 from pclib.test import mk_test_case_table, run_sim
 from pclib.test import TestSource, TestSink
 from pclib.ifcs import MemMsg, MemReqMsg, MemRespMsg
-from TestMemory import TestMemory
-from pclib.ifcs import MemMsg4B, MemReqMsg4B, MemRespMsg4B
+from TestMemory import TestMemory, read_int, write_int
+from pclib.ifcs import MemMsg4B, MemReqMsg4B, MemRespMsg4B, MemMsg16B
 
 #-------------------------------------------------------------------------
 # TestHarness
@@ -332,3 +332,80 @@ def test_read_write_mem( dump_vcd ):
 
   assert result == data
 
+
+#-------------------------------------------------------------------------
+# Test read_int/write_int
+#-------------------------------------------------------------------------
+
+def test_read_write_int():
+
+  rgen = random.Random()
+  rgen.seed(0x2b7e1516)
+
+  # Compare against accessing the memory one byte at a time, for every
+  # access size and alignment
+
+  mem = bytearray( rgen.getrandbits(8) for _ in range(256) )
+  for nbytes in range( 1, 65 ):
+    for addr in range( 8 ):
+
+      ref = 0
+      for j in range( nbytes ):
+        ref |= mem[ addr + j ] << 8*j
+      assert read_int( mem, addr, nbytes ) == ref
+
+      # Bits of the value beyond nbytes are ignored
+
+      value = rgen.getrandbits( 8*nbytes + 8 )
+      after = mem[ addr + nbytes ]
+      write_int( mem, addr, nbytes, value )
+      for j in range( nbytes ):
+        assert mem[ addr + j ] == ( value >> 8*j ) & 0xff
+      assert mem[ addr + nbytes ] == after
+
+  # Out of range accesses raise IndexError for every size
+
+  for nbytes in [ 1, 3, 4, 8, 12, 16, 64 ]:
+    with pytest.raises( IndexError ):
+      read_int( mem, 257 - nbytes, nbytes )
+    with pytest.raises( IndexError ):
+      write_int( mem, 257 - nbytes, nbytes, 0 )
+
+#-------------------------------------------------------------------------
+# Test 16B lines
+#-------------------------------------------------------------------------
+
+class LineTestHarness( Model ):
+
+  def __init__( s, src_msgs, sink_msgs ):
+
+    mem_msgs = MemMsg16B()
+
+    s.src  = TestSource( mem_msgs.req,  src_msgs  )
+    s.mem  = TestMemory( mem_msgs, 1 )
+    s.sink = TestSink  ( mem_msgs.resp, sink_msgs )
+
+    s.connect( s.src.out,  s.mem.reqs[0]  )
+    s.connect( s.sink.in_, s.mem.resps[0] )
+
+  def done( s ):
+    return s.src.done and s.sink.done
+
+  def line_trace( s ):
+    return s.mem.line_trace()
+
+def test_16B_lines( dump_vcd ):
+
+  ifc  = MemMsg16B()
+  line = 0x0123456789abcdeffedcba9876543210
+
+  msgs = [
+    ifc.req.mk_wr( 0, 0x1000, 0, line       ), ifc.resp.mk_wr( 0, 0 ),
+    ifc.req.mk_rd( 1, 0x1000, 0             ), ifc.resp.mk_rd( 1, 0, line ),
+    ifc.req.mk_rd( 2, 0x1004, 4             ), ifc.resp.mk_rd( 2, 4, 0xfedcba98 ),
+    ifc.req.mk_wr( 3, 0x1008, 8, 0x5a5a5a5a ), ifc.resp.mk_wr( 3, 0 ),
+    ifc.req.mk_rd( 4, 0x1000, 0             ),
+    ifc.resp.mk_rd( 4, 0, 0x000000005a5a5a5afedcba9876543210 ),
+  ]
+
+  run_sim( LineTestHarness( msgs[::2], msgs[1::2] ), dump_vcd )
@@ -20,13 +20,13 @@ class TestNetSink( Model ):
   #-----------------------------------------------------------------------
   # __init__
   #-----------------------------------------------------------------------
-  def __init__( s, dtype, msgs, max_random_delay = 0 ):
+  def __init__( s, dtype, msgs, max_random_delay = 0, order_by = None ):
 
     s.in_  = InValRdyBundle( dtype )
     s.done = OutPort       ( 1          )
 
     s.delay = TestRandomDelay  ( dtype, max_random_delay )
-    s.sink  = TestSimpleNetSink( dtype, msgs             )
+    s.sink  = TestSimpleNetSink( dtype, msgs, order_by   )
 
     s.connect( s.in_,       s.delay.in_ )
     s.connect( s.delay.out, s.sink.in_  )
@@ -2,7 +2,7 @@
 # TestSimpleNetSink.py
 #=========================================================================
 
-from copy       import deepcopy
+from collections import Counter, defaultdict, deque
 
 from pymtl      import *
 from pclib.ifcs import InValRdyBundle, OutValRdyBundle
@@ -14,18 +14,32 @@ from pclib.ifcs import InValRdyBundle, OutValRdyBundle
 # compare them to a predefined list of network messages. Each network
 # message has route information, unique sequence number and payload
 # information
+#
+# Messages may arrive in any order. The expected messages are kept in a
+# multiset keyed by their packed value, so that checking a message takes
+# constant time. If order_by names a message field (e.g., 'dest'), then
+# messages with the same value of that field must also arrive in the
+# order in which they are given in msgs.
 class TestSimpleNetSink( Model ):
 
-  def __init__( s, dtype, msgs ):
+  def __init__( s, dtype, msgs, order_by = None ):
 
     s.in_  = InValRdyBundle( dtype )
     s.done = OutPort       ( 1     )
 
-    s.msgs        = deepcopy( msgs )
-    s.recv        = []
+    s.expected    = Counter( int( x ) for x in msgs )
+    s.recv        = set()
     s.idx         = 0
     s.msgs_len    = len( msgs )
 
+    # Expected messages in order for each value of the order_by field
+
+    s.order_by    = order_by
+    s.order       = defaultdict( deque )
+    if order_by:
+      for x in msgs:
+        s.order[ int( getattr( x, order_by ) ) ].append( int( x ) )
+
     @s.tick
     def tick():
 
@@ -46,18 +60,28 @@ class TestSimpleNetSink( Model ):
 
       if in_go:
 
+        msg = int( s.in_.msg )
+
         # Check if the msg received was valid
-        if s.in_.msg not in s.msgs:
-          if s.in_.msg in s.recv:
+        if not s.expected[ msg ]:
+          if msg in s.recv:
             raise AssertionError( "Message {} arrived twice!"
                                   .format( s.in_.msg ) )
           else:
             raise AssertionError( "Message {} not found in Test Sink!"
                                   .format( s.in_.msg ) )
 
+        # Check if the msg arrived in order
+        if s.order_by:
+          queue = s.order[ int( getattr( s.in_.msg, s.order_by ) ) ]
+          if queue[0] != msg:
+            raise AssertionError( "Message {} arrived out of order!"
+                                  .format( s.in_.msg ) )
+          queue.popleft()
+
         # Update State
-        s.msgs.remove( s.in_.msg )
-        s.recv.append( s.in_.msg )
+        s.expected[ msg ] -= 1
+        s.recv.add( msg )
         s.idx = s.idx + 1
 
       # Set the ready and done signals.
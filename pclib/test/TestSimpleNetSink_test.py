@@ -17,10 +17,10 @@ from TestSimpleNetSink import TestSimpleNetSink
 #-------------------------------------------------------------------------
 class TestHarness( Model ):
 
-  def __init__( s, dtype, src_msgs, sink_msgs ):
+  def __init__( s, dtype, src_msgs, sink_msgs, order_by=None ):
 
     s.src  = TestSimpleSource ( dtype, src_msgs  )
-    s.sink = TestSimpleNetSink( dtype, sink_msgs )
+    s.sink = TestSimpleNetSink( dtype, sink_msgs, order_by )
 
     s.connect( s.src.out,  s.sink.in_  )
     s.connect( s.src.done, s.sink.done )
@@ -45,12 +45,12 @@ def mk_msg( src, dest, seqnum, payload ):
 #-------------------------------------------------------------------------
 # TestSimpleNetSink test runner
 #-------------------------------------------------------------------------
-def run_test( dump_vcd, src_msgs, sink_msgs ):
+def run_test( dump_vcd, src_msgs, sink_msgs, order_by=None ):
 
   # Instantiate and elaborate the model
 
   dtype = NetMsg( 4, 16, 32 )
-  model = TestHarness( dtype, src_msgs, sink_msgs )
+  model = TestHarness( dtype, src_msgs, sink_msgs, order_by )
   model.vcd_file = dump_vcd
   model.elaborate()
 
@@ -176,3 +176,28 @@ def test_redundant_msgs( dump_vcd ):
   with pytest.raises( AssertionError ):
     run_test( dump_vcd, src_msgs, sink_msgs )
 
+
+#-------------------------------------------------------------------------
+# TestSimpleNetSink unit test - Per Destination Order
+#-------------------------------------------------------------------------
+def test_order_by_dest( dump_vcd ):
+
+  sink_msgs = [
+            # src dest seqnum payload
+      mk_msg( 2,   3,   0,     0x00000230 ),
+      mk_msg( 1,   2,   0,     0x00000120 ),
+      mk_msg( 2,   3,   1,     0x00000231 ),
+      mk_msg( 0,   2,   0,     0x00000020 ),
+  ]
+
+  # Messages to different destinations can be reordered
+
+  src_msgs = [ sink_msgs[1], sink_msgs[0], sink_msgs[3], sink_msgs[2] ]
+  run_test( dump_vcd, src_msgs, sink_msgs, order_by='dest' )
+
+  # Messages to the same destination cannot
+
+  src_msgs = [ sink_msgs[2], sink_msgs[1], sink_msgs[0], sink_msgs[3] ]
+  run_test( dump_vcd, src_msgs, sink_msgs )
+  with pytest.raises( AssertionError ):
+    run_test( dump_vcd, src_msgs, sink_msgs, order_by='dest' )
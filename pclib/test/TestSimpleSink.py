@@ -2,27 +2,39 @@
 # TestSimpleSink
 #=======================================================================
 
-from copy       import deepcopy
-
 from pymtl      import *
 from pclib.ifcs import InValRdyBundle
 
 class TestSinkError( Exception ):
   pass
 
+# Marks the end of the messages
+_end = object()
+
 #-----------------------------------------------------------------------
 # TestSimpleSink
 #-----------------------------------------------------------------------
 
 class TestSimpleSink( Model ):
+  """Checks the messages received on a val/rdy interface against the
+  expected messages in ``msgs``.
+
+  ``msgs`` can be any iterable, including a generator which computes the
+  expected messages with a reference model. Messages are only taken from
+  it when they are needed, so the sink holds just the next expected
+  message. A received message is correct if ``check( msg, expected )``
+  returns true, by default if it is equal to the expected message.
+  """
 
-  def __init__( s, dtype, msgs ):
+  def __init__( s, dtype, msgs, check = None ):
 
     s.in_  = InValRdyBundle( dtype )
     s.done = OutPort       ( 1     )
 
-    s.msgs = deepcopy( msgs )
-    s.idx  = 0
+    s._msgs  = iter( msgs )
+    s._msg   = next( s._msgs, _end )
+    s._check = check or ( lambda msg, expected: msg == expected )
+    s.idx    = 0
 
     @s.tick
     def tick():
@@ -43,7 +55,7 @@ class TestSimpleSink( Model ):
       # expected. then increment the index.
 
       if in_go:
-        if s.in_.msg != s.msgs[s.idx]:
+        if not s._check( s.in_.msg, s._msg ):
 
           error_msg = """
  The test sink received an incorrect message!
@@ -56,15 +68,16 @@ class TestSimpleSink( Model ):
           raise TestSinkError( error_msg.format(
             sink_name    = s.name,
             msg_number   = s.idx,
-            expected_msg = s.msgs[s.idx],
+            expected_msg = s._msg,
             actual_msg   = s.in_.msg,
           ))
 
-        s.idx = s.idx + 1
+        s.idx  = s.idx + 1
+        s._msg = next( s._msgs, _end )
 
       # Set the ready and done signals.
 
-      if ( s.idx < len(s.msgs) ):
+      if s._msg is not _end:
         s.in_.rdy.next = True
         s.done   .next = False
       else:
@@ -4,22 +4,27 @@
 
 from __future__ import print_function
 
+import pytest
+
 from pymtl import *
 
 from TestSimpleSource import TestSimpleSource
-from TestSimpleSink   import TestSimpleSink
+from TestSimpleSink   import TestSimpleSink, TestSinkError
 
 #-------------------------------------------------------------------------
 # TestHarness
 #-------------------------------------------------------------------------
 class TestHarness( Model ):
 
-  def __init__( s, dtype, msgs ):
+  def __init__( s, dtype, msgs, sink_msgs = None, check = None ):
 
     # Instantiate models
 
+    if sink_msgs is None:
+      sink_msgs = msgs
+
     s.src  = TestSimpleSource ( dtype, msgs )
-    s.sink = TestSimpleSink   ( dtype, msgs )
+    s.sink = TestSimpleSink   ( dtype, sink_msgs, check )
 
     # Connect chain
 
@@ -76,3 +81,55 @@ def test_basics( dump_vcd ):
   sim.cycle()
   sim.cycle()
 
+
+#-------------------------------------------------------------------------
+# run
+#-------------------------------------------------------------------------
+def run( model ):
+  model.elaborate()
+  sim = SimulationTool( model )
+  sim.reset()
+  while not model.done() and sim.ncycles < 5000:
+    sim.cycle()
+  assert model.done()
+
+#-------------------------------------------------------------------------
+# test_generators
+#-------------------------------------------------------------------------
+def test_generators( tmpdir ):
+
+  # Messages are only taken from generators as they are sent, including
+  # when reading them from a file
+
+  msgs_file = tmpdir.join( 'msgs.txt' )
+  msgs_file.write( ''.join( '{:x}\n'.format( i*3 ) for i in range( 1000 ) ) )
+
+  taken = []
+  def expected():
+    for i in range( 1000 ):
+      taken.append( i )
+      yield i*3
+
+  with open( str( msgs_file ) ) as fp:
+    model = TestHarness( 16, ( int( x, 16 ) for x in fp ), expected() )
+    assert len( taken ) == 1
+    run( model )
+
+  assert model.sink.idx == 1000
+
+#-------------------------------------------------------------------------
+# test_check
+#-------------------------------------------------------------------------
+def test_check():
+
+  # Only the low byte of the messages is checked
+
+  def check( msg, expected ):
+    return msg[0:8] == expected
+
+  msgs = [ 0x1201, 0x3402, 0x5603 ]
+  run( TestHarness( 16, msgs, [ 0x01, 0x02, 0x03 ], check ) )
+
+  model = TestHarness( 16, msgs, [ 0x01, 0x03, 0x03 ], check )
+  with pytest.raises( TestSinkError ):
+    run( model )
@@ -2,24 +2,33 @@
 # TestSimpleSource
 #=======================================================================
 
-from copy       import deepcopy
-
 from pymtl      import *
 from pclib.ifcs import OutValRdyBundle
 
+# Marks the end of the messages
+_end = object()
+
 #-----------------------------------------------------------------------
 # TestSimpleSource
 #-----------------------------------------------------------------------
 class TestSimpleSource( Model ):
-  'Outputs data provided in ``msgs`` onto a val/rdy interface.'
+  """Outputs data provided in ``msgs`` onto a val/rdy interface.
+
+  ``msgs`` can be any iterable, including a generator or a file reader.
+  Messages are only taken from it when they are about to be sent, so
+  the source holds just the current message and the first one, no
+  matter how many messages there are.
+  """
 
   def __init__( s, dtype, msgs ):
 
     s.out  = OutValRdyBundle( dtype )
     s.done = OutPort        ( 1     )
 
-    s.msgs = deepcopy( msgs )
-    s.idx  = 0
+    s._msgs  = iter( msgs )
+    s._msg   = next( s._msgs, _end )
+    s._first = s._msg
+    s.idx    = 0
 
     @s.tick
     def tick():
@@ -27,17 +36,17 @@ class TestSimpleSource( Model ):
       # Handle reset
 
       if s.reset:
-        if s.msgs:
-          s.out.msg.next = s.msgs[0]
+        if s._first is not _end:
+          s.out.msg.next = s._first
         s.out.val  .next = False
         s.done     .next = False
         return
 
       # Check if we have more messages to send.
 
-      if ( s.idx == len(s.msgs) ):
-        if s.msgs:
-          s.out.msg.next = s.msgs[0]
+      if s._msg is _end:
+        if s._first is not _end:
+          s.out.msg.next = s._first
         s.out.val  .next = False
         s.done     .next = True
         return
@@ -47,20 +56,22 @@ class TestSimpleSource( Model ):
 
       out_go = s.out.val and s.out.rdy
 
-      # If the output transaction occured, then increment the index.
+      # If the output transaction occured, then increment the index and
+      # move on to the next message.
 
       if out_go:
-        s.idx = s.idx + 1
+        s.idx  = s.idx + 1
+        s._msg = next( s._msgs, _end )
 
-      # The output message is always the indexed message in the list, or if
-      # we are done then it is the first message again.
+      # The output message is always the current message, or if we are
+      # done then it is the first message again.
 
-      if ( s.idx < len(s.msgs) ):
-        s.out.msg.next = s.msgs[s.idx]
+      if s._msg is not _end:
+        s.out.msg.next = s._msg
         s.out.val.next = True
         s.done   .next = False
       else:
-        s.out.msg.next = s.msgs[0]
+        s.out.msg.next = s._first
         s.out.val.next = False
         s.done   .next = True
 
@@ -13,7 +13,7 @@ from TestSimpleSink import TestSimpleSink
 #-------------------------------------------------------------------------
 class TestSink( Model ):
 
-  def __init__( s, dtype, msgs, max_random_delay = 0 ):
+  def __init__( s, dtype, msgs, max_random_delay = 0, check = None ):
 
     s.in_  = InValRdyBundle( dtype )
     s.done = OutPort       ( 1     )
@@ -21,7 +21,7 @@ class TestSink( Model ):
     # Instantiate modules
 
     s.delay = TestRandomDelay( dtype, max_random_delay )
-    s.sink  = TestSimpleSink ( dtype, msgs )
+    s.sink  = TestSimpleSink ( dtype, msgs, check )
 
     # Connect the input ports -> random delay -> sink
 
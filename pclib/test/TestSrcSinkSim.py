@@ -8,6 +8,8 @@ from pymtl      import *
 from TestSource import TestSource
 from TestSink   import TestSink
 
+from pymtl.tools.simulation.ProgressReporter import start_progress_reporter
+
 #-------------------------------------------------------------------------
 # TestSrcSinkSim
 #-------------------------------------------------------------------------
@@ -17,36 +19,58 @@ class TestSrcSinkSim( object ):
   list of source messages to be fed into the simulation, and a list of
   exptected output messages. The simulator will handle driving the
   simulation to completion.
+
+  The messages can also be given as any iterables, such as generators,
+  which are only consumed as the simulation runs (see TestSimpleSource
+  and TestSimpleSink). sink_check optionally replaces the comparison of
+  received and expected messages.
   """
 
   #-----------------------------------------------------------------------
   # __init__
   #-----------------------------------------------------------------------
   def __init__( self, model_inst, src_msgs,  sink_msgs,
-                                  src_delay, sink_delay ):
+                                  src_delay, sink_delay, sink_check=None ):
 
     self.model = TestSrcSinkHarness( model_inst, src_msgs,  sink_msgs,
-                                                 src_delay, sink_delay )
+                                                 src_delay, sink_delay,
+                                                 sink_check )
     self.model.vcd_file = model_inst.vcd_file
 
   #-----------------------------------------------------------------------
   # run_test
   #-----------------------------------------------------------------------
-  def run_test( self ):
+  def run_test( self, progress=None ):
 
     # Create a simulator using the simulation tool
 
     self.model.elaborate()
     sim = SimulationTool( self.model )
 
+    # Report progress every progress seconds (or PYMTL_PROGRESS),
+    # including the number of messages received by the sink
+
+    sink     = self.model.sink.sink
+    reporter = start_progress_reporter( sim, progress,
+                                        { 'sink_msgs' : lambda: sink.idx } )
+
     # Run the simulation
 
     print()
 
     sim.reset()
-    while not self.model.done():
-      sim.print_line_trace()
-      sim.cycle()
+    try:
+      while not self.model.done():
+        sim.print_line_trace()
+        sim.cycle()
+
+    finally:
+
+      # Stop reporting even if the simulation failed, so that sim.cycle
+      # is restored and the progress file is closed
+
+      if reporter:
+        reporter.stop()
 
     # Add a couple extra ticks so that the VCD dump is nicer
 
@@ -65,7 +89,7 @@ class TestSrcSinkHarness( Model ):
   # __init__
   #-----------------------------------------------------------------------
   def __init__( s, model_inst, src_msgs,  sink_msgs,
-                               src_delay, sink_delay ):
+                               src_delay, sink_delay, sink_check=None ):
 
     # Source and sink take on the same input and output type as the
     # model under test
@@ -76,7 +100,7 @@ class TestSrcSinkHarness( Model ):
     # TODO: should model be a model instance, or a type + params?
     s.src   = TestSource( src_dtype,  src_msgs,  src_delay  )
     s.model = model_inst
-    s.sink  = TestSink  ( sink_dtype, sink_msgs, sink_delay )
+    s.sink  = TestSink  ( sink_dtype, sink_msgs, sink_delay, sink_check )
 
     s.connect( s.src  .out, s.model.in_ )
     s.connect( s.model.out, s.sink .in_ )
@@ -5,8 +5,11 @@
 
 from   pymtl       import *
 import collections
+import os
 import re
 
+from pymtl.tools.simulation.ProgressReporter import start_progress_reporter
+
 class RunTestVectorSimError( Exception ):
   pass
 
@@ -37,11 +40,44 @@ def mk_test_case_table( raw_test_case_table ):
     'argvalues' : test_cases,
   }
 
+#-------------------------------------------------------------------------
+# start_trace_ring
+#-------------------------------------------------------------------------
+# Compiled models with line tracing can record the line traces of the
+# last trace_ring cycles (or PYMTL_TRACE_RING) inside the model instead
+# of returning them to Python every cycle. The harnesses below then only
+# print these line traces when the test fails. Returns whether the model
+# records its line traces.
+
+def start_trace_ring( model, trace_ring=None ):
+
+  if trace_ring is None:
+    trace_ring = int( os.environ.get( 'PYMTL_TRACE_RING', 0 ) )
+  if not trace_ring or not hasattr( model, 'enable_trace_ring' ):
+    return False
+
+  model.enable_trace_ring( trace_ring )
+  return True
+
+#-------------------------------------------------------------------------
+# print_trace_ring
+#-------------------------------------------------------------------------
+# Prints the line traces recorded by the model followed by the line trace
+# of the current cycle.
+
+def print_trace_ring( sim ):
+
+  traces = sim.model.drain_trace_ring()
+  for i, trace in enumerate( traces ):
+    print "{:>3}: {}".format( sim.ncycles - len( traces ) + i, trace )
+  sim.print_line_trace()
+
 #-------------------------------------------------------------------------
 # run sim
 #-------------------------------------------------------------------------
 
-def run_sim( model, dump_vcd=None, test_verilog=False, max_cycles=5000 ):
+def run_sim( model, dump_vcd=None, test_verilog=False, max_cycles=5000,
+             progress=None, trace_ring=None ):
 
   # Setup the model
 
@@ -59,15 +95,39 @@ def run_sim( model, dump_vcd=None, test_verilog=False, max_cycles=5000 ):
   sim.reset()
   print()
 
+  # Report progress every progress seconds (or PYMTL_PROGRESS)
+
+  reporter = start_progress_reporter( sim, progress )
+
+  # Only print the line traces on failure if the model records them
+
+  trace_ring = start_trace_ring( model, trace_ring )
+
   # Run simulation
 
-  while not model.done() and sim.ncycles < max_cycles:
-    sim.print_line_trace()
-    sim.cycle()
+  try:
+
+    while not model.done() and sim.ncycles < max_cycles:
+      if not trace_ring:
+        sim.print_line_trace()
+      sim.cycle()
+
+    # Force a test failure if we timed out
+
+    assert sim.ncycles < max_cycles
+
+  except:
+    if trace_ring:
+      print_trace_ring( sim )
+    raise
+
+  finally:
 
-  # Force a test failure if we timed out
+    # Stop reporting even if the simulation failed, so that sim.cycle
+    # is restored and the progress file is closed
 
-  assert sim.ncycles < max_cycles
+    if reporter:
+      reporter.stop()
 
   # Extra ticks to make VCD easier to read
 
@@ -76,103 +136,226 @@ def run_sim( model, dump_vcd=None, test_verilog=False, max_cycles=5000 ):
   sim.cycle()
 
 #-------------------------------------------------------------------------
-# run_test_vector_sim
+# TestVectorPlan
 #-------------------------------------------------------------------------
+# A table of test vectors compiled for a model. The port names in the
+# first row of the table are parsed and resolved into ports once, so
+# that running the table only sets and compares values. Expected values
+# of '?' (or None, which is what masked entries of a NumPy masked array
+# turn into) are don't-cares. Rows can be given as a list of sequences or
+# as a 2D NumPy array. Rows shorter than the port names only cover the
+# leading ports: the remaining inputs keep their values from the
+# previous row, and the remaining outputs are not checked.
+#
+# The plan is created from the elaborated model before the simulator is
+# created, and run with either a SimulationTool (one cycle at a time,
+# optionally printing line traces) or a BatchSimulationTool created with
+# inports=plan.inports (a batch of rows per call into the compiled
+# model).
+
+class TestVectorPlan( object ):
+
+  def __init__( s, model, port_names ):
+
+    if isinstance( port_names, str ):
+      port_names = port_names.split()
+
+    s.port_names = port_names
+    s.inports    = []
+    s.outports   = []
+
+    s._in_cols   = []
+    s._out_cols  = []
+
+    for col, port_name in enumerate( port_names ):
+      if port_name[-1] == "*":
+        s.outports.append( _get_port( model, port_name[0:-1] ) )
+        s._out_cols.append( col )
+      else:
+        s.inports.append( _get_port( model, port_name ) )
+        s._in_cols.append( col )
 
-def run_test_vector_sim( model, test_vectors, dump_vcd=None, test_verilog=False ):
+  #-----------------------------------------------------------------------
+  # run
+  #-----------------------------------------------------------------------
+  # Simulate one cycle per row. Raises RunTestVectorSimError on the first
+  # incorrect output.
 
-  # First row in test vectors contains port names
+  def run( s, sim, rows, line_trace=True ):
 
-  if isinstance(test_vectors[0],str):
-    port_names = test_vectors[0].split()
-  else:
-    port_names = test_vectors[0]
+    # The simulator replaces the ports with the signals it simulates
 
-  # Remaining rows contain the actual test vectors
+    inputs  = zip( s._in_cols,  [ x._signalvalue for x in s.inports  ] )
+    outputs = zip( s._out_cols, [ x._signalvalue for x in s.outports ] )
+    ncols   = len( s.port_names )
 
-  test_vectors = test_vectors[1:]
+    for row_num, row in enumerate( _as_rows( rows ), 1 ):
 
-  # Setup the model
+      row_inputs, row_outputs = inputs, outputs
+      if len( row ) < ncols:
+        row_inputs  = [ x for x in inputs  if x[0] < len( row ) ]
+        row_outputs = [ x for x in outputs if x[0] < len( row ) ]
 
-  model.vcd_file = dump_vcd
-  if test_verilog:
-    model = TranslationTool( model )
-  model.elaborate()
+      for col, signal in row_inputs:
+        signal.value = row[col]
 
-  # Create a simulator
+      sim.eval_combinational()
 
-  sim = SimulationTool( model )
+      if line_trace:
+        sim.print_line_trace()
 
-  # Reset model
+      for col, signal in row_outputs:
+        ref_value = row[col]
+        if ref_value != '?' and ref_value is not None \
+           and signal != ref_value:
+          s._error( row_num, col, ref_value, signal )
 
-  sim.reset()
-  print ""
+      sim.cycle()
 
-  # Run the simulation
+  #-----------------------------------------------------------------------
+  # run_batch
+  #-----------------------------------------------------------------------
+  # Simulate the rows with the cycle_n method of a BatchSimulationTool,
+  # up to batch_size rows per call, then check the outputs of each batch.
 
-  row_num = 0
-  for row in test_vectors:
-    row_num += 1
+  def run_batch( s, sim, rows, batch_size=4096 ):
 
-    # Apply test inputs
+    index    = dict( ( id( x ), i ) for i, x in enumerate( sim.outports ) )
+    out_cols = zip( s._out_cols, [ index[ id( x ) ] for x in s.outports ] )
 
-    for port_name, in_value in zip( port_names, row ):
-      if port_name[-1] != "*":
+    ncols    = len( s.port_names )
 
-        # Special case for lists of ports
-        if '[' in port_name:
-          m = re.match( r'(\w+)\[(\d+)\]', port_name )
-          if not m:
-            raise Exception("Could not parse port name: {}".format(port_name))
-          getattr( model, m.group(1) )[int(m.group(2))].value = in_value
+    # Every row of a batch sets all of the inputs, so inputs missing from
+    # short rows are filled in with the values they held before
+
+    held = [ int( x._signalvalue ) for x in s.inports ]
+
+    rows = _as_rows( rows )
+    for start in xrange( 0, len( rows ), batch_size ):
+      batch  = rows[ start:start+batch_size ]
+      inputs = []
+      for row in batch:
+        if len( row ) < ncols:
+          held = [ row[col] if col < len( row ) else value
+                   for col, value in zip( s._in_cols, held ) ]
         else:
-          getattr( model, port_name ).value = in_value
+          held = [ row[col] for col in s._in_cols ]
+        inputs.append( held )
+      outputs = sim.cycle_n( inputs )
+
+      for row_num, row, out_row in zip( xrange( start+1, len( rows )+1 ),
+                                        batch, outputs ):
+        for col, i in out_cols:
+          if col >= len( row ):
+            continue
+          ref_value = row[col]
+          if ref_value != '?' and ref_value is not None \
+             and out_row[i] != ref_value:
+            s._error( row_num, col, ref_value, out_row[i] )
+
+  def _error( s, row_num, col, ref_value, out_value ):
+    raise RunTestVectorSimError( _error_msg.format(
+      row_number   = row_num,
+      port_name    = s.port_names[col],
+      expected_msg = ref_value,
+      actual_msg   = out_value
+    ))
+
+_error_msg = """
+ run_test_vector_sim received an incorrect value!
+  - row number     : {row_number}
+  - port name      : {port_name}
+  - expected value : {expected_msg}
+  - actual value   : {actual_msg}
+"""
 
-    # Evaluate combinational concurrent blocks
+# Ports are named as in the model, with lists of ports indexed as in
+# "in_[2]"
 
-    sim.eval_combinational()
+def _get_port( model, port_name ):
 
-    # Display line trace output
+  # Special case for lists of ports
+  if '[' in port_name:
+    m = re.match( r'(\w+)\[(\d+)\]$', port_name )
+    if not m:
+      raise Exception("Could not parse port name: {}".format(port_name))
+    return getattr( model, m.group(1) )[int(m.group(2))]
+  else:
+    return getattr( model, port_name )
 
-    sim.print_line_trace()
+# NumPy arrays are converted to lists of Python integers, which are much
+# faster to work with one element at a time
 
-    # Check test outputs
+def _as_rows( rows ):
+  return rows.tolist() if hasattr( rows, 'tolist' ) else rows
 
-    for port_name, ref_value in zip( port_names, row ):
-      if port_name[-1] == "*":
+#-------------------------------------------------------------------------
+# run_test_vector_sim
+#-------------------------------------------------------------------------
+# The test vectors are a table whose first row contains the port names,
+# with a * after the names of output ports to check, and whose remaining
+# rows contain the values of the ports for each cycle. The rows can also
+# be given as a single 2D NumPy array after the port names. With batch
+# set, models with a cycle_n method (see BatchSimulationTool) simulate the
+# table natively, without line traces.
 
-        # Special case for lists of ports
-        if '[' in port_name:
-          m = re.match( r'(\w+)\[(\d+)\]', port_name[0:-1] )
-          if not m:
-            raise Exception("Could not parse port name: {}".format(port_name))
-          out_value = getattr( model, m.group(1) )[int(m.group(2))]
-        else:
-          out_value = getattr( model, port_name[0:-1] )
+def run_test_vector_sim( model, test_vectors, dump_vcd=None, test_verilog=False,
+                         trace_ring=None, line_trace=True, batch=False ):
 
-        if ( ref_value != '?' ) and ( out_value != ref_value ):
+  # First row in test vectors contains port names
 
-          error_msg = """
- run_test_vector_sim received an incorrect value!
-  - row number     : {row_number}
-  - port name      : {port_name}
-  - expected value : {expected_msg}
-  - actual value   : {actual_msg}
-"""
-          raise RunTestVectorSimError( error_msg.format(
-            row_number   = row_num,
-            port_name    = port_name,
-            expected_msg = ref_value,
-            actual_msg   = out_value
-          ))
+  port_names = test_vectors[0]
+
+  # Remaining rows contain the actual test vectors
+
+  if len( test_vectors ) == 2 and hasattr( test_vectors[1], 'ndim' ) \
+     and test_vectors[1].ndim == 2:
+    test_vectors = test_vectors[1]
+  else:
+    test_vectors = test_vectors[1:]
+
+  # Setup the model
+
+  model.vcd_file = dump_vcd
+  if test_verilog:
+    model = TranslationTool( model )
+  model.elaborate()
 
-    # Tick the simulation
+  # Resolve the ports used by the test vectors
 
-    sim.cycle()
+  plan  = TestVectorPlan( model, port_names )
+  batch = batch and hasattr( model, 'cycle_n' )
+
+  # Create a simulator
+
+  if batch:
+    sim = BatchSimulationTool( model, inports=plan.inports )
+  else:
+    sim = SimulationTool( model )
+
+  # Reset model
+
+  sim.reset()
+  print ""
+
+  # Only print the line traces on failure if the model records them
+
+  trace_ring = start_trace_ring( model, trace_ring )
+
+  # Run the simulation
+
+  try:
+    if batch:
+      plan.run_batch( sim, test_vectors )
+    else:
+      plan.run( sim, test_vectors, line_trace and not trace_ring )
+  except RunTestVectorSimError:
+    if trace_ring:
+      print_trace_ring( sim )
+    raise
 
   # Extra ticks to make VCD easier to read
 
   sim.cycle()
   sim.cycle()
   sim.cycle()
-
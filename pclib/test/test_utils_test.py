@@ -0,0 +1,171 @@
+#=========================================================================
+# test_utils_test.py
+#=========================================================================
+
+import pytest
+
+from distutils.spawn import find_executable
+
+from pymtl      import *
+from test_utils import run_test_vector_sim, RunTestVectorSimError
+
+requires_gxx = pytest.mark.skipif( not find_executable( 'g++' ),
+                                   reason='requires g++' )
+
+#-------------------------------------------------------------------------
+# Test Models
+#-------------------------------------------------------------------------
+
+class AddReg( Model ):
+  def __init__( s ):
+    s.in_ = [ InPort( 8 ) for _ in range( 2 ) ]
+    s.sum = OutPort( 8 )
+    s.out = OutPort( 8 )
+
+    @s.combinational
+    def comb():
+      s.sum.value = s.in_[0] + s.in_[1]
+
+    @s.tick
+    def seq():
+      if s.reset: s.out.next = 0
+      else:       s.out.next = s.sum
+
+test_vectors = [
+  # in_[0] in_[1] sum*  out*
+  [ 'in_[0]', 'in_[1]', 'sum*', 'out*' ],
+  [    1,        2,       3,      0    ],
+  [    4,        5,       9,      3    ],
+  [  0xff,       1,       0,     '?'   ],
+  [    0,        0,     None,     0    ],
+]
+
+#-------------------------------------------------------------------------
+# test_run_test_vector_sim
+#-------------------------------------------------------------------------
+def test_run_test_vector_sim():
+  run_test_vector_sim( AddReg(), test_vectors )
+  run_test_vector_sim( AddReg(), test_vectors, line_trace=False )
+
+  # Port names can also be given as a single string
+
+  run_test_vector_sim( AddReg(), [ 'in_[0] in_[1] sum*' ] +
+                       [ row[0:3] for row in test_vectors[1:] ] )
+
+#-------------------------------------------------------------------------
+# test_incorrect_value
+#-------------------------------------------------------------------------
+@pytest.mark.parametrize( 'batch', [ False, True ] )
+def test_incorrect_value( batch ):
+
+  table = [ row[:] for row in test_vectors ]
+  table[2][3] = 4
+
+  with pytest.raises( RunTestVectorSimError ) as e:
+    run_test_vector_sim( AddReg(), table, batch=batch )
+
+  assert '- row number     : 2'    in str( e.value )
+  assert '- port name      : out*' in str( e.value )
+  assert '- expected value : 4'    in str( e.value )
+
+#-------------------------------------------------------------------------
+# test_short_rows
+#-------------------------------------------------------------------------
+@pytest.mark.parametrize( 'batch', [ False, True ] )
+def test_short_rows( batch ):
+
+  # Inputs missing from a row keep their values, missing outputs are not
+  # checked
+
+  table = [
+    test_vectors[0],
+    [ 1, 2, 3, 0 ],
+    [ 4, 5, 9    ],
+    [ 6          ],
+    [ 7, 5, 12, 11 ],
+  ]
+
+  run_test_vector_sim( AddReg(), table, batch=batch )
+
+#-------------------------------------------------------------------------
+# test_numpy
+#-------------------------------------------------------------------------
+def test_numpy():
+
+  numpy = pytest.importorskip( 'numpy' )
+
+  # Masked entries are don't-cares
+
+  table = numpy.ma.masked_values( [ [ 1, 2, 3,  0 ],
+                                    [ 4, 5, 9,  3 ],
+                                    [ 7, 1, 8, -1 ] ], -1 )
+
+  run_test_vector_sim( AddReg(), [ test_vectors[0], table ] )
+
+#-------------------------------------------------------------------------
+# test_batch
+#-------------------------------------------------------------------------
+@requires_gxx
+def test_batch( monkeypatch, tmpdir ):
+
+  from pymtl.tools.translation import get_cpp
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+
+  table = [ test_vectors[0] ]
+  for i in range( 1000 ):
+    table.append([ i % 256, 3, ( i + 3 ) % 256, ( i + 2 ) % 256 if i else 0 ])
+
+  run_test_vector_sim( get_cpp( AddReg() ), table, batch=True )
+  run_test_vector_sim( get_cpp( AddReg() ), table[0:1] + [ [ 1, 2, 3, 0 ],
+                       [ 4 ], [ 5, 3, 8, 6 ], [ 6, 3, 9, 8 ] ], batch=True )
+
+  # Failures are reported for the row they occur in
+
+  table[ 900 ][2] = '?'
+  table[ 901 ][3] = 0
+
+  with pytest.raises( RunTestVectorSimError ) as e:
+    run_test_vector_sim( get_cpp( AddReg() ), table, batch=True )
+
+  assert '- row number     : 901' in str( e.value )
+
+#-------------------------------------------------------------------------
+# test_run_sim_failure
+#-------------------------------------------------------------------------
+class Failing( Model ):
+  def __init__( s ):
+    s.count = 0
+    @s.tick
+    def seq():
+      s.count += 1
+      if s.count > 5:
+        raise ValueError( 'model failed' )
+
+  def done( s ):
+    return False
+
+  def line_trace( s ):
+    return str( s.count )
+
+def test_run_sim_failure( monkeypatch, capsys ):
+
+  import test_utils
+
+  reporters = []
+  def start_progress_reporter( sim, progress ):
+    reporters.append( real_start( sim, progress ) )
+    return reporters[-1]
+  real_start = test_utils.start_progress_reporter
+  monkeypatch.setattr( test_utils, 'start_progress_reporter',
+                       start_progress_reporter )
+
+  # The progress reporter is stopped (and so reports the last cycle)
+  # when the simulation fails
+
+  with pytest.raises( ValueError ):
+    test_utils.run_sim( Failing(), progress=100 )
+
+  assert not reporters[0].running
+  out, err = capsys.readouterr()
+  assert err.startswith( '[progress] cycle          5' )
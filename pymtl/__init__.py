@@ -28,11 +28,12 @@ from datatypes.SignalValue import CreateWrappedClass
 # tools
 #-----------------------------------------------------------------------
 
-from tools.simulation.SimulationTool import SimulationTool
-from tools.translation.verilator_sim import TranslationTool
-from tools.translation.cpp_sim       import get_cpp
-from tools.integration.verilog       import VerilogModel
-from tools.integration.systemc       import SystemCModel
+from tools.simulation.SimulationTool      import SimulationTool
+from tools.simulation.BatchSimulationTool import BatchSimulationTool
+from tools.translation.verilator_sim      import TranslationTool
+from tools.translation.cpp_sim            import get_cpp
+from tools.integration.verilog            import VerilogModel
+from tools.integration.systemc            import SystemCModel
 
 #-----------------------------------------------------------------------
 # py.test decorators
@@ -78,6 +79,7 @@ __all__ = [ # Model Construction
             'BitField',
             # Tools
             'SimulationTool',
+            'BatchSimulationTool',
             'TranslationTool',
             # TEMPORARY
             'get_cpp',
@@ -5,14 +5,21 @@
 import os
 import sys
 import shutil
-from subprocess import check_output, STDOUT, CalledProcessError
+from subprocess       import check_output, STDOUT, CalledProcessError
+from multiprocessing.pool import ThreadPool
+
+from ..translation.build_cache    import BuildCache, hash_key, get_build_jobs
+from ..translation.verilator_cffi import get_tool_versions
 
 class SystemCEnvError( Exception ): pass
 class SystemCCompileError   ( Exception ): pass
 
 # get_sc_dir is used for checking systemc including directory and 
 # library directory. It first check the environment variable.
-# If no match, it calls pkg-config.
+# If no match, it calls pkg-config. The pkg-config results are cached,
+# since every model build asks for them several times.
+
+_sc_dirs = {}
 
 def get_sc_dir( var_name, pkgconfig_name ):
   
@@ -20,7 +27,10 @@ def get_sc_dir( var_name, pkgconfig_name ):
   # The environment variable overrides pkg-config.
 
   ret = os.environ.get( var_name )
-  
+
+  if ret == None:
+    ret = _sc_dirs.get( pkgconfig_name )
+
   if ret == None:
     cmd = ["pkg-config", "--variable=" + pkgconfig_name, "systemc"]
     
@@ -55,25 +65,53 @@ Try running the following command on your own to debug the issue.
         command  = ' '.join( e.cmd ),
         error    = e.output,
       ))
+
+    _sc_dirs[ pkgconfig_name ] = ret
   
   return ret
 
+#-----------------------------------------------------------------------
+# get_folder_files
+#-----------------------------------------------------------------------
+# Returns ( path, contents ) of every C++ source and header file in the
+# given folders, sorted by path.
+
+source_exts = [ ".cc", ".cpp", ".c++", ".cxx" ]
+header_exts = [ ".h", ".hh", ".hpp", ".h++" ]
+
+def get_folder_files( folders ):
+
+  paths = set()
+  for folder in folders:
+    for filename in os.listdir( folder ):
+      if os.path.splitext( filename )[1] in source_exts + header_exts:
+        paths.add( os.path.join( folder, filename ) )
+
+  files = []
+  for path in sorted( paths ):
+    with open( path ) as f:
+      files.append( ( path, f.read() ) )
+
+  return files
+
 #-----------------------------------------------------------------------
 # compile_object
 #-----------------------------------------------------------------------
 # Compile {src_name} to {obj_name}.o
 
+object_flags = ( '-DSYSTEMC_SIM -fPIC -shared -O1 -fstrict-aliasing '
+                 '-Wall -Wno-long-long -Werror' )
+
 def compile_object( obj_name, src_name, include_dirs ):
   
   sc_include = get_sc_dir( "SYSTEMC_INCLUDE", "includedir" )
   
   # Generate the full include folder
-  include = " ".join( [ "-I. -I.. -I" + sc_include ] +
+  include = " ".join( [ "-I" + sc_include ] +
                       [ "-I" + x for x in include_dirs ] )
   
-  compile_cmd = ( 'g++ -o {obj_name}.o -DSYSTEMC_SIM '
-                  '-fPIC -shared -O1 -fstrict-aliasing '
-                  '-Wall -Wno-long-long -Werror '
+  flags       = object_flags
+  compile_cmd = ( 'g++ -o {obj_name}.o {flags} '
                   ' {include} -c {src_name} '  ).format( **vars() )
   try:
     result = check_output( compile_cmd, stderr=STDOUT, shell=True )
@@ -81,6 +119,48 @@ def compile_object( obj_name, src_name, include_dirs ):
     raise SystemCCompileError( "\n-\n-   " + 
                                   "\n-   ".join( e.output.splitlines() ) )
 
+#-----------------------------------------------------------------------
+# compile_objects
+#-----------------------------------------------------------------------
+# Compile each source file into an object in {obj_dir}, in parallel.
+# Objects are cached in the build cache under a hash of the source, the
+# files it may include (deps) and the compiler configuration, so only
+# changed sources are recompiled. Returns the object files in order.
+
+def compile_objects( sources, include_dirs, obj_dir, deps=() ):
+
+  cache = BuildCache()
+
+  # Look up the SystemC directory before starting any threads
+  sc_include = get_sc_dir( "SYSTEMC_INCLUDE", "includedir" )
+
+  def compile_one( source ):
+
+    with open( source ) as f:
+      key = hash_key( 'sc_object', f.read(), include_dirs, sc_include,
+                      get_tool_versions(), object_flags, *deps )
+
+    def build( build_dir ):
+      compile_object( os.path.join( build_dir, 'obj' ), source, include_dirs )
+
+    obj_file = os.path.join( obj_dir,
+                 os.path.splitext( os.path.basename( source ) )[0] + '.o' )
+
+    with cache.entry( key, build ) as entry_dir:
+      shutil.copyfile( os.path.join( entry_dir, 'obj.o' ), obj_file )
+
+    return obj_file
+
+  if not sources:
+    return []
+
+  pool = ThreadPool( min( get_build_jobs(), len( sources ) ) )
+  try:
+    return pool.map( compile_one, sources )
+  finally:
+    pool.close()
+    pool.join()
+
 #-----------------------------------------------------------------------
 # systemc_to_pymtl
 #-----------------------------------------------------------------------
@@ -281,9 +361,9 @@ def create_shared_lib( lib_file, c_wrapper_file, all_objs, include_dirs, obj_dir
   sc_include = get_sc_dir( "SYSTEMC_INCLUDE", "includedir" )
   sc_library = get_sc_dir( "SYSTEMC_LIBDIR", "libarchdir" )
   
-  include = " ".join( [ "-I. -I .. -I " + sc_include ] +
+  include = " ".join( [ "-I " + sc_include ] +
                       [ "-I" + x for x in include_dirs ] )
-  library = " ".join( [ "-L. -L .. -L " + sc_library ] +
+  library = " ".join( [ "-L " + sc_library ] +
                       [ "-L" + obj_dir ] )
   rpath   = sc_library
   objects = " ".join( all_objs )
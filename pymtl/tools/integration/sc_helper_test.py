@@ -0,0 +1,81 @@
+#=======================================================================
+# sc_helper_test.py
+#=======================================================================
+
+import os
+
+import sc_helper
+
+#-----------------------------------------------------------------------
+# test_get_sc_dir
+#-----------------------------------------------------------------------
+def test_get_sc_dir( monkeypatch ):
+
+  calls = []
+  def check_output( cmd, **kwargs ):
+    calls.append( cmd )
+    return '/opt/systemc/' + cmd[1].split( '=' )[1] + '\n'
+
+  monkeypatch.setattr( sc_helper, 'check_output', check_output )
+  monkeypatch.setattr( sc_helper, '_sc_dirs', {} )
+  monkeypatch.delenv( 'SYSTEMC_INCLUDE', raising=False )
+
+  # pkg-config is only called once per variable
+
+  for i in range( 3 ):
+    assert sc_helper.get_sc_dir( 'SYSTEMC_INCLUDE', 'includedir' ) == \
+           '/opt/systemc/includedir'
+  assert sc_helper.get_sc_dir( 'SYSTEMC_LIBDIR', 'libarchdir' ) == \
+         '/opt/systemc/libarchdir'
+  assert len( calls ) == 2
+
+  # The environment still overrides pkg-config
+
+  monkeypatch.setenv( 'SYSTEMC_INCLUDE', '/usr/include/systemc' )
+  assert sc_helper.get_sc_dir( 'SYSTEMC_INCLUDE', 'includedir' ) == \
+         '/usr/include/systemc'
+
+#-----------------------------------------------------------------------
+# test_compile_objects
+#-----------------------------------------------------------------------
+def test_compile_objects( monkeypatch, tmpdir ):
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR',  str( tmpdir.join( 'cache' ) ) )
+  monkeypatch.setenv( 'PYMTL_BUILD_JOBS', '2' )
+  monkeypatch.setenv( 'SYSTEMC_INCLUDE',  '/usr/include/systemc' )
+
+  compiled = []
+  def compile_object( obj_name, src_name, include_dirs ):
+    compiled.append( src_name )
+    with open( src_name ) as src, open( obj_name + '.o', 'w' ) as obj:
+      obj.write( src.read() )
+  monkeypatch.setattr( sc_helper, 'compile_object', compile_object )
+
+  src_dir = tmpdir.mkdir( 'src' )
+  sources = []
+  for i in range( 4 ):
+    src_dir.join( 'f{}.cc'.format( i ) ).write( 'int f{}();\n'.format( i ) )
+    sources.append( str( src_dir.join( 'f{}.cc'.format( i ) ) ) )
+
+  def build( deps=() ):
+    obj_dir = tmpdir.mkdir( 'obj{}'.format( len( tmpdir.listdir() ) ) )
+    objs    = sc_helper.compile_objects( sources, [ str( src_dir ) ],
+                                         str( obj_dir ), deps )
+    assert objs == [ str( obj_dir.join( 'f{}.o'.format( i ) ) )
+                     for i in range( 4 ) ]
+    assert all( os.path.exists( x ) for x in objs )
+    compiled_srcs = sorted( compiled )
+    del compiled[:]
+    return compiled_srcs
+
+  # First build compiles everything, an identical build nothing
+
+  assert build() == sources
+  assert build() == []
+
+  # Only changed sources are recompiled, and everything when a header
+  # changes
+
+  src_dir.join( 'f2.cc' ).write( 'int f2( int );\n' )
+  assert build() == [ sources[2] ]
+  assert build( deps=[ '#define X 1\n' ] ) == sources
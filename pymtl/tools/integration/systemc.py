@@ -7,16 +7,17 @@ from __future__ import print_function
 import re
 import os
 import sys
-import json
-import hashlib
+import imp
 import inspect
-import filecmp
 import collections
 from copy import deepcopy
-from os.path import exists, basename
-from shutil  import copyfile
+from os.path import exists
+from shutil  import rmtree
 from sc_helper import *
 
+from ..translation.build_cache    import BuildCache, hash_key
+from ..translation.verilator_cffi import get_tool_versions
+
 from ...model.metaclasses import MetaCollectArgs
 
 from pymtl import *
@@ -58,94 +59,25 @@ class SomeMeta( MetaCollectArgs ):
     c_wrapper_file  = model_name + '_sc.cpp'
     py_wrapper_file = model_name + '_sc.py'
     lib_file        = 'lib{}_sc.so'.format( model_name )
-    obj_dir         = 'obj_dir_' + model_name + os.sep
-    
-    if not exists( obj_dir ):
-      os.mkdir( obj_dir )
-    include_dirs     = deepcopy( inst.sourcefolder )
-    include_dirs.append( obj_dir )
+    include_dirs    = deepcopy( inst.sourcefolder )
     
-    # Copy all specified source file to obj folder for later compilation
-    # Also try to copy header files by inferring the file extension
-    # At the same time check caching status
-    #
-    # Check the combination of a path, a filename and a extension
-    # for both the header and the source. According to C++ 
-    # convention the header should have the same filename as the 
-    # source file for the compiler to match.
+    # Find the source file for every entry in s.sourcefile.
     #
-    # The reason why I split the source array and header array into 
-    # two groups is for performance -- to hopefully reduce the number
-    # of disk inode lookup and disk accesses by breaking the loop
-    # when a header/source is found.
+    # Check the combination of a path, a filename and a extension. The
+    # first folder in s.sourcefolder containing the file wins, header
+    # files are found by the compiler through the include path.
     
-    uncached = {}
-    src_ext  = {}
-    tmp_objs = []
-    
-    hashfile = obj_dir + "/.hashdict"
-    hashdict = {}
-    if exists( hashfile ):
-      with open( hashfile, "r" ) as f:
-        hashdict = json.load( f )
+    sources = []
+    matched = set()
     
     for path in inst.sourcefolder:
       for filename in inst.sourcefile:
-        file_prefix = path    + filename
-        temp_prefix = obj_dir + filename
-        
-        for group in [ [".h", ".hh", ".hpp", ".h++"  ],  # header group
-                       [".cc", ".cpp", ".c++", ".cxx"] ]:# source group
-          for ext in group: 
-            target_file = file_prefix + ext
-            temp_obj    = temp_prefix + ".o"
-            
-            if not exists( target_file ):
-              # OK this is not the correct extension.
-              continue
-            
-            tmp_objs.append( temp_obj )
-            
-            if ext.startswith(".c"):
-              src_ext[temp_prefix] = ext
-            
-            # July 11, 2016
-            # This piece of code copies all the files
-            # for caching/tracking purpose.
-            # Now I use SHA1 hash value to track the update of files,
-            # so I comment out these lines.
-            
-            # temp_file = temp_prefix + ext
-            
-            # 1. No .o file, then yeah it hasn't been cached.
-            # 2. No .c file, probably something unexpected happened.
-            # 3. See if the cached file is not up to date.
-            
-            # if not exists( temp_obj ) or \
-               # not exists( temp_file ) or \
-               # not filecmp.cmp( temp_file, target_file ):
-              
-              # if exists( temp_obj ):
-                # os.remove( temp_obj )
-              # copyfile( target_file, temp_file )
-              # uncached[temp_prefix] = target_file
-            
-            # 1. No .o file
-            # 2. Not in the hash value dictionary
-            # 3. Hash value match?
-            
-            def get_hash( filename ):
-              with open( filename, "r" ) as f:
-                return hashlib.sha1( f.read() ).hexdigest()
-                
-            h = get_hash( target_file )
-              
-            if not exists( temp_obj ) or \
-               target_file not in hashdict or \
-               h != hashdict[target_file]:
-              uncached[temp_prefix] = file_prefix
-              hashdict[target_file] = h
-            
+        if filename in matched:
+          continue
+        for ext in source_exts:
+          if exists( path + filename + ext ):
+            sources.append( path + filename + ext )
+            matched.add( filename )
             break
     
     # This part is used to handle the missing of source file. 
@@ -153,15 +85,8 @@ class SomeMeta( MetaCollectArgs ):
     # the above code is not able to find foo with every prefix in all
     # folders in s.sourcefolder, we have to terminate the compilation.
     
-    unmatched = []
-    for x in inst.sourcefile:
-      matched = False
-      for y in src_ext:
-        if basename(y) == x:
-          matched = True
-          break
-      if not matched:
-        unmatched.append( "\""+ x + "\"" )
+    unmatched = [ "\"" + x + "\"" for x in inst.sourcefile
+                  if x not in matched ]
     
     if unmatched:
       raise SystemCSourceFileError( '\n'
@@ -169,53 +94,57 @@ class SomeMeta( MetaCollectArgs ):
         '-   Please double check s.sourcefolder and s.sourcefile!'\
           .format(", ".join( unmatched )) )
     
-    # Remake only if there're uncached files
-
-    if not uncached:
-      # print( "All Cached!")
-      pass
-    else:
-      # print( "Not Cached", uncached )
-      
-      # Dump new hashdict
-      with open( hashfile, "w" ) as f:
-        json.dump( hashdict, f )
-      
-      # Compile all uncached modules to .o object file
-      for obj, src in uncached.items():
-        compile_object( obj, src + src_ext[obj], include_dirs )
+    # Any C++ file in the source folders may be included by the sources,
+    # so all of them are part of the cache key, together with the
+    # interface of the wrapper and the build configuration.
     
-    # Regenerate the shared library .so file if individual modules are 
-    # updated or the .so file is missing.
+    folder_files = get_folder_files( inst.sourcefolder )
     
-    if uncached or not exists( lib_file ):
-      
-      # Use list for tmp_objs and all_objs to keep dependecies 
-      # O(n^2) but maybe we could refine it later when we need to deal 
-      # with thousands of files ...
-      
-      all_objs = []
-      for o in tmp_objs:
-        if o not in all_objs:
-          all_objs.append(o)
-      
+    key = hash_key( 'systemc', model_name, sc_module_name, sources,
+                    folder_files, inst.sclinetrace,
+                    sorted( ( x, y.name, y.nbits )
+                            for x, y in inst._port_dict.items() ),
+                    [ ( x.name, x.nbits, type( x ).__name__ )
+                      for x in inst.get_ports() ],
+                    get_sc_dir( "SYSTEMC_INCLUDE", "includedir" ),
+                    get_sc_dir( "SYSTEMC_LIBDIR",  "libarchdir" ),
+                    object_flags, get_tool_versions(), _generator_source() )
+    
+    # Compile the sources into objects in parallel (each object is also
+    # cached on its own, so only changed sources are recompiled), then
+    # create the wrappers and link them into a shared library. Only the
+    # library and the wrappers are kept in the cache entry.
+    
+    def build( build_dir ):
+      path    = lambda x: os.path.join( build_dir, x )
+      obj_dir = path( 'obj_dir' )
+      os.mkdir( obj_dir )
+      objs    = compile_objects( sources, include_dirs, obj_dir,
+                                 deps=[ y for x, y in folder_files
+                                        if x.endswith( tuple( header_exts ) ) ] )
       systemc_to_pymtl( inst, # model instance
                         obj_dir, include_dirs, sc_module_name,
-                        all_objs, c_wrapper_file, lib_file, # c wrapper
-                        py_wrapper_file # py wrapper
+                        objs, path( c_wrapper_file ), path( lib_file ), # c wrapper
+                        path( py_wrapper_file ) # py wrapper
                       )
+      rmtree( obj_dir )
     
     # Follows are the same as Translation Tool
     
-    # Use some trickery to import the compiled version of the model
-    sys.path.append( os.getcwd() )
-    __import__( py_wrapper_file[:-3] )
-    imported_module = sys.modules[ py_wrapper_file[:-3] ]
-
-    # Get the model class from the module, instantiate and elaborate it
-    model_class = imported_module.__dict__[ model_name ]
-    
-    new_inst  = model_class()
+    with BuildCache().entry( key, build ) as build_dir:
+      
+      # Import the wrapper from the cache entry. The module name includes
+      # the key so that different builds of the same model can coexist.
+      
+      module_name = '{}_sc_{}'.format( model_name, key[:16] )
+      if module_name not in sys.modules:
+        imp.load_source( module_name, os.path.join( build_dir, py_wrapper_file ) )
+      imported_module = sys.modules[ module_name ]
+      
+      # Get the model class from the module, instantiate and elaborate it
+      model_class = imported_module.__dict__[ model_name ]
+      
+      new_inst  = model_class()
     new_inst.vcd_file = None
 
     new_inst.__class__.__name__  = inst.__class__.__name__
@@ -320,3 +249,25 @@ class SystemCModel( Model ):
     if not self._param_dict:
       self._param_dict = self._args
 
+#-----------------------------------------------------------------------
+# _generator_source
+#-----------------------------------------------------------------------
+# Source of the wrapper generator and its templates, so that cached
+# builds are invalidated when the generator itself changes.
+
+_generator_src = None
+
+def _generator_source():
+
+  global _generator_src
+
+  if _generator_src is None:
+    src_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    src     = []
+    for filename in [ 'sc_helper.py', 'systemc_wrapper.templ.cpp',
+                      'systemc_wrapper.templ.py' ]:
+      with open( os.path.join( src_dir, filename ) ) as fp:
+        src.append( fp.read() )
+    _generator_src = '\n'.join( src )
+
+  return _generator_src
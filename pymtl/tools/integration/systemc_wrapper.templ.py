@@ -22,11 +22,12 @@ class {class_name}( Model ):
     s.ffi = FFI()
     s.ffi.cdef('''{cdef}''')
 
-    # Import the shared library containing the model. We defer
-    # construction to the elaborate_logic function to allow the user to
-    # set the vcd_file.
+    # Import the shared library containing the model, which lives next
+    # to this wrapper. We defer construction to the elaborate_logic
+    # function to allow the user to set the vcd_file.
 
-    s._ffi = s.ffi.dlopen('./lib{class_name}_sc.so')
+    lib_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    s._ffi  = s.ffi.dlopen( os.path.join( lib_dir, 'lib{class_name}_sc.so' ) )
     s._m   = None
 
     # dummy class to emulate PortBundles
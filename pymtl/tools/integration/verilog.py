@@ -52,8 +52,14 @@ class SomeMeta( MetaCollectArgs ):
     # I think there is no way to turn on VCD dumping after the fact, so I
     # think we have no choice but to always turn on VCD dumping for now
     # if we are using Verilog import? -cbatten
+    #
+    # Tracing makes the Verilated model slower to build and simulate, so
+    # it can be turned off with vcd_trace = False (or by setting the
+    # PYMTL_VERILOG_IMPORT_VCD environment variable to 0) when the
+    # imported module never needs to be dumped.
 
-    inst.vcd_file = '__dummy__'
+    if inst.get_vcd_trace():
+      inst.vcd_file = '__dummy__'
 
     new_inst = TranslationTool( inst, lint=True )
 
@@ -73,6 +79,7 @@ class SomeMeta( MetaCollectArgs ):
     new_inst.modulename  = inst.modulename
     new_inst.sourcefile  = inst.sourcefile
     new_inst.vlinetrace  = inst.vlinetrace
+    new_inst.vcd_trace   = inst.vcd_trace
     new_inst._param_dict = inst._param_dict
     new_inst._port_dict  = inst._port_dict
 
@@ -107,6 +114,9 @@ class VerilogModel( Model ):
   Attributes:
     modulename  Name of the Verilog module to import.
     sourcefile  Location of the .v file containing the module.
+    vcd_trace   Build the module with VCD tracing so it can be dumped
+                along with the rest of the design (default:
+                $PYMTL_VERILOG_IMPORT_VCD, or True).
   """
   __metaclass__ = SomeMeta
 
@@ -114,6 +124,7 @@ class VerilogModel( Model ):
   sourcefile   = None
   vprefix      = None
   vlinetrace   = False
+  vcd_trace    = None
 
   _param_dict  = None
   _port_dict   = None
@@ -155,6 +166,17 @@ class VerilogModel( Model ):
 
     self._port_dict = collections.OrderedDict( sorted(port_dict.items()) )
 
+  #---------------------------------------------------------------------
+  # get_vcd_trace
+  #---------------------------------------------------------------------
+  def get_vcd_trace( self ):
+    """Returns whether the module is built with VCD tracing."""
+
+    if self.vcd_trace is None:
+      return os.environ.get( 'PYMTL_VERILOG_IMPORT_VCD', '1' ) != '0'
+
+    return self.vcd_trace
+
   #---------------------------------------------------------------------
   # _auto_init
   #---------------------------------------------------------------------
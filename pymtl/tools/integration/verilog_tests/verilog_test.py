@@ -173,6 +173,26 @@ def test_auto_Reg( nbits, all_verilog ):
     sim.print_line_trace()
     assert m.q == i
 
+#-----------------------------------------------------------------------
+# test_auto_Reg_vcd_trace
+#-----------------------------------------------------------------------
+@requires_verilator
+@pytest.mark.parametrize( "trace", [ True, False ] )
+def test_auto_Reg_vcd_trace( trace ):
+
+  class RegVRTL( VerilogModel ):
+    vcd_trace = trace
+    def __init__( s, p_nbits ):
+      s.d = InPort ( p_nbits )
+      s.q = OutPort( p_nbits )
+
+  m, sim = _sim_setup( RegVRTL(8), False )
+  assert m.vcd_trace == trace
+  for i in range( 10 ):
+    m.d.value = i
+    sim.cycle()
+    assert m.q == i
+
 #-----------------------------------------------------------------------
 # test_auto_EnResetReg
 #-----------------------------------------------------------------------
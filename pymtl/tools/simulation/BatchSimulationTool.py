@@ -0,0 +1,170 @@
+#=======================================================================
+# BatchSimulationTool.py
+#=======================================================================
+# Stimulus/response simulation of compiled models in batches of cycles.
+#
+# Driving a Verilated model from Python one cycle at a time crosses the
+# cffi boundary several times per cycle. Models generated by the
+# TranslationTool or get_cpp also provide a cycle_n method which
+# simulates many cycles natively, reading the inputs for every cycle
+# from a stimulus buffer and recording the outputs into a response
+# buffer.
+#
+# BatchSimulationTool is a SimulationTool which adds a cycle_n method to
+# run a table of input values through such a model and return the table
+# of output values. It can be freely mixed with the usual cycle, reset
+# and eval_combinational methods.
+#
+# Usage:
+#
+#   model = TranslationTool( MyModel() )
+#   model.elaborate()
+#   sim = BatchSimulationTool( model, inports=[ model.in0, model.in1 ] )
+#   sim.reset()
+#   outputs = sim.cycle_n([ ( 1, 2 ), ( 3, 4 ), ... ])
+#
+# Each row of outputs contains the value of every port in sim.outports
+# after the inputs for that cycle were applied and the combinational
+# logic was evaluated, but before the clock edge (i.e., the values that
+# would be checked by run_test_vector_sim).
+
+from array import array
+
+from SimulationTool import SimulationTool
+
+#-----------------------------------------------------------------------
+# BatchSimulationTool
+#-----------------------------------------------------------------------
+class BatchSimulationTool( SimulationTool ):
+
+  def __init__( self, model, inports = None, collect_metrics = False ):
+    """Create a batch simulator for a compiled model.
+
+    model:    an elaborated model with a cycle_n method
+    inports:  input ports given in each row of stimulus, in order. Other
+              input ports (except clk) hold their value during cycle_n.
+              Defaults to all input ports except clk.
+    """
+
+    if not hasattr( model, 'cycle_n' ):
+      raise TypeError( "{} does not support cycle_n, batch simulation "
+                       "requires a model generated by the TranslationTool "
+                       "or get_cpp"
+                       .format( model.class_name ) )
+
+    super( BatchSimulationTool, self ).__init__( model, collect_metrics )
+
+    # Ports may be given either as ports or as the SignalValue objects
+    # the simulator has replaced them with in the model
+
+    all_inports = model._cycle_n_inports
+    by_value    = dict( ( id( x._signalvalue ), x ) for x in all_inports )
+    port        = lambda x: by_value.get( id( x ), x )
+
+    self._all_inports = all_inports
+    self.outports     = model._cycle_n_outports
+    self.inports      = [ port( x ) for x in inports ] \
+                        if inports is not None else all_inports
+
+    # Position of each stimulus column in a row of the stimulus buffer
+
+    offsets = {}
+    offset  = 0
+    for port in self._all_inports:
+      offsets[ id( port ) ] = offset
+      offset += _nwords( port )
+    self._nin_words  = offset
+    self._nout_words = sum( _nwords( x ) for x in self.outports )
+
+    try:
+      self._columns  = [ ( offsets[ id( port ) ], _nwords( port ) )
+                         for port in self.inports ]
+    except KeyError:
+      raise ValueError( "inports must be input ports of the model" )
+
+  #---------------------------------------------------------------------
+  # cycle_n
+  #---------------------------------------------------------------------
+  def cycle_n( self, inputs ):
+    """Simulate one cycle per row of inputs. Each row provides a value
+    for every port in self.inports. Returns a list of rows with the
+    value of every port in self.outports for each cycle, as integers."""
+
+    n = len( inputs )
+    if not n:
+      return []
+
+    in_buf  = self._pack( inputs )
+    out_buf = array( 'I', [0] ) * ( n * self._nout_words )
+
+    self.model.cycle_n( n, in_buf, out_buf )
+    self.ncycles += n
+
+    # Leave the Python side of the simulation in the same state as if
+    # the cycles had been simulated one by one
+
+    for port, value in zip( self.inports, inputs[-1] ):
+      port._signalvalue.value = value
+    self.eval_combinational()
+
+    return self._unpack( out_buf, n )
+
+  #---------------------------------------------------------------------
+  # _pack
+  #---------------------------------------------------------------------
+  # Create the stimulus buffer from the rows of inputs. Input ports which
+  # are not stimulated repeat their current value in every row.
+  def _pack( self, inputs ):
+
+    template = []
+    for port in self._all_inports:
+      template.extend( _to_words( port._signalvalue.uint(),
+                                  _nwords( port ) ) )
+
+    buf = array( 'I' )
+    for row in inputs:
+      words = template[:]
+      for ( offset, nwords ), value in zip( self._columns, row ):
+        words[ offset:offset+nwords ] = _to_words( int( value ), nwords )
+      buf.extend( words )
+
+    return buf
+
+  #---------------------------------------------------------------------
+  # _unpack
+  #---------------------------------------------------------------------
+  # Split the response buffer into rows of integers.
+  def _unpack( self, buf, n ):
+
+    # Fast path if every output fits in a single word
+
+    stride = self._nout_words
+    if stride == len( self.outports ):
+      return [ tuple( buf[ i:i+stride ] ) for i in xrange( 0, n*stride, stride ) ]
+
+    rows = []
+    for i in xrange( 0, n*stride, stride ):
+      row = []
+      for port in self.outports:
+        nwords = _nwords( port )
+        row.append( _from_words( buf[ i:i+nwords ] ) )
+        i += nwords
+      rows.append( tuple( row ) )
+
+    return rows
+
+#-----------------------------------------------------------------------
+# Helpers
+#-----------------------------------------------------------------------
+
+def _nwords( port ):
+  return ( port.nbits - 1 ) / 32 + 1
+
+def _to_words( value, nwords ):
+  return [ ( value >> 32*i ) & 0xffffffff for i in range( nwords ) ]
+
+def _from_words( words ):
+  value = 0
+  for i, word in enumerate( words ):
+    value |= word << 32*i
+  return value
@@ -0,0 +1,155 @@
+#=======================================================================
+# BatchSimulationTool_test.py
+#=======================================================================
+
+import pytest
+import random
+
+from pymtl     import *
+from pclib.rtl import Reg, RegEn
+
+#-----------------------------------------------------------------------
+# Test Models
+#-----------------------------------------------------------------------
+
+class AccumWide( Model ):
+  def __init__( s ):
+    s.in_ = InPort ( 80 )
+    s.en  = InPort ( 1  )
+    s.out = OutPort( 80 )
+    s.sum = OutPort( 80 )
+    s.acc = Wire   ( 80 )
+    @s.tick
+    def seq():
+      if   s.reset: s.acc.next = 0
+      elif s.en:    s.acc.next = s.acc + s.in_
+    @s.combinational
+    def comb():
+      s.out.value = s.acc
+      s.sum.value = s.acc + s.in_
+
+# Pure Python model with the cycle_n interface of a translated model, so
+# the buffer handling can be tested without Verilator
+
+class PyReg( Model ):
+  def __init__( s, nbits ):
+    s.in_ = InPort ( nbits )
+    s.out = OutPort( nbits )
+    s.reg = 0
+    s._cycle_n_inports  = [ s.reset, s.in_ ]
+    s._cycle_n_outports = [ s.out ]
+    @s.tick
+    def seq():
+      s.reg = 0 if s.reset else int( s.in_ )
+    @s.combinational
+    def comb():
+      s.out.value = s.reg
+
+  def cycle_n( s, n, in_buf, out_buf ):
+    for i in range( n ):
+      reset, lo, hi = in_buf[ 3*i:3*i+3 ]
+      out_buf[ 2*i ], out_buf[ 2*i+1 ] = s.reg & 0xffffffff, s.reg >> 32
+      s.reg = 0 if reset else lo | hi << 32
+    s.out.value = s.reg
+
+#-----------------------------------------------------------------------
+# reference
+#-----------------------------------------------------------------------
+# Simulate the same model one cycle at a time with the SimulationTool
+
+def reference( model, inports, outports, inputs ):
+  model.elaborate()
+  sim = SimulationTool( model )
+  sim.reset()
+  outputs = []
+  for row in inputs:
+    for name, value in zip( inports, row ):
+      getattr( model, name ).value = value
+    sim.eval_combinational()
+    outputs.append( tuple( int( getattr( model, x ) ) for x in outports ) )
+    sim.cycle()
+  return outputs
+
+#-----------------------------------------------------------------------
+# test_requires_cycle_n
+#-----------------------------------------------------------------------
+def test_requires_cycle_n():
+  model = Reg( 8 )
+  model.elaborate()
+  with pytest.raises( TypeError ):
+    BatchSimulationTool( model )
+
+#-----------------------------------------------------------------------
+# test_buffers
+#-----------------------------------------------------------------------
+def test_buffers():
+  model = PyReg( 40 )
+  model.elaborate()
+  sim = BatchSimulationTool( model, inports=[ model.in_ ] )
+  sim.reset()
+
+  inputs = [ ( 2**39 + i, ) for i in range( 10 ) ]
+  assert sim.cycle_n( inputs ) == [ ( 0, ) ] + inputs[:-1]
+  assert sim.ncycles == 12
+  assert model.out == inputs[-1][0]
+  assert model.in_ == inputs[-1][0]
+
+  # Ports which are not stimulated hold their current value
+  model.reset.value = 1
+  assert sim.cycle_n( [ ( 1, ), ( 2, ) ] ) == [ ( 2**39 + 9, ), ( 0, ) ]
+
+#-----------------------------------------------------------------------
+# test_reg
+#-----------------------------------------------------------------------
+@requires_verilator
+def test_reg():
+  model = TranslationTool( Reg( 16 ) )
+  model.elaborate()
+  sim = BatchSimulationTool( model, inports=[ model.in_ ] )
+  sim.reset()
+
+  inputs  = [ ( i*7 & 0xffff, ) for i in range( 100 ) ]
+  outputs = sim.cycle_n( inputs )
+  assert outputs == reference( Reg( 16 ), [ 'in_' ], [ 'out' ], inputs )
+  assert sim.ncycles == 2 + 100
+
+  # Python side is up to date, and cycle/cycle_n can be mixed
+  assert model.out == inputs[-1][0]
+  model.in_.value = 5
+  sim.cycle()
+  assert sim.cycle_n( [ ( 6, ) ] ) == [ ( 5, ) ]
+  assert model.out == 6
+
+#-----------------------------------------------------------------------
+# test_held_inputs
+#-----------------------------------------------------------------------
+@requires_verilator
+def test_held_inputs():
+  model = TranslationTool( RegEn( 8 ) )
+  model.elaborate()
+  sim = BatchSimulationTool( model, inports=[ model.in_ ] )
+  sim.reset()
+
+  model.en.value = 0
+  assert sim.cycle_n( [ ( 1, ), ( 2, ) ] ) == [ ( 0, ), ( 0, ) ]
+  model.en.value = 1
+  assert sim.cycle_n( [ ( 1, ), ( 2, ) ] ) == [ ( 0, ), ( 1, ) ]
+
+#-----------------------------------------------------------------------
+# test_wide_ports
+#-----------------------------------------------------------------------
+@requires_verilator
+def test_wide_ports():
+  model = TranslationTool( AccumWide() )
+  model.elaborate()
+  sim = BatchSimulationTool( model )
+  sim.reset()
+
+  rng    = random.Random( 0xdeadbeef )
+  names  = [ x.name for x in sim.inports ]
+  inputs = [ [ rng.randint( 0, 2**x.nbits-1 ) if x.name != 'reset' else 0
+               for x in sim.inports ] for i in range( 100 ) ]
+
+  outputs = sim.cycle_n( inputs )
+  assert outputs == reference( AccumWide(), names,
+                               [ x.name for x in sim.outports ], inputs )
@@ -0,0 +1,240 @@
+#=======================================================================
+# GlitchAnalyzer.py
+#=======================================================================
+# Redundant evaluation (glitch) analysis for SimulationTool.
+#
+# SimulationMetrics can count how many combinational blocks were
+# evaluated more than once in a cycle, but not why. The GlitchAnalyzer
+# records, for every redundant evaluation, the net write which put the
+# block back on the event queue and the block which performed that
+# write. These are aggregated into glitch chains of the form:
+#
+#   writer block --( net )--> re-evaluated block
+#
+# which are reported along with suggestions for restructuring the
+# offending blocks.
+#
+# Usage:
+#
+#   sim      = SimulationTool( model )
+#   analyzer = GlitchAnalyzer( sim )
+#   analyzer.start()
+#   ...
+#   analyzer.stop()
+#   analyzer.print_report()
+
+from __future__ import print_function
+
+import collections
+
+#-----------------------------------------------------------------------
+# GlitchAnalyzer
+#-----------------------------------------------------------------------
+class GlitchAnalyzer( object ):
+
+  SEQ   = '<seq/input>'
+  SLICE = '<slice>'
+
+  def __init__( self, sim ):
+
+    self.sim        = sim
+    self.ncycles    = 0
+    self.nevals     = 0
+    self.nredundant = 0
+    self.running    = False
+
+    # ( writer, net, reader ) -> number of redundant evaluations
+
+    self.chains     = collections.Counter()
+
+    # Total number of evaluations per block
+
+    self.evals      = collections.Counter()
+
+    self._cause     = {}
+    self._last_run  = {}
+    self._names     = { None: self.SEQ }
+    self._net_names = {}
+
+    # Name each net after its shortest (i.e., highest level) signal name
+
+    for net in sim._nets:
+      names = [ _signal_name( x ) for x in net
+                if getattr( x, 'parent', None ) is not None ]
+      if names:
+        svalue = next( iter( net ) )._signalvalue
+        self._net_names[ id( svalue ) ] = min( names,
+                                               key=lambda x: ( len(x), x ) )
+
+  #---------------------------------------------------------------------
+  # start
+  #---------------------------------------------------------------------
+  # Replace the simulator's add_event and eval_combinational with
+  # versions which track event causes.
+  def start( self ):
+
+    if self.running:
+      return
+    self.running = True
+
+    sim = self.sim
+    self._start_cycle       = sim.ncycles
+    self._add_event         = sim.add_event
+    self._eval              = sim.eval_combinational
+    sim.add_event           = self._tracked_add_event
+    sim.eval_combinational  = self._tracked_eval
+
+  #---------------------------------------------------------------------
+  # stop
+  #---------------------------------------------------------------------
+  def stop( self ):
+
+    if not self.running:
+      return
+    self.running = False
+
+    sim = self.sim
+    self.ncycles           += sim.ncycles - self._start_cycle
+    sim.add_event           = self._add_event
+    sim.eval_combinational  = self._eval
+
+  #---------------------------------------------------------------------
+  # report
+  #---------------------------------------------------------------------
+  # Returns a list of ( writer, net, reader, count, per_cycle ) tuples
+  # sorted from most to least redundant evaluations.
+  def report( self ):
+    ncycles = max( self.ncycles, 1 )
+    rows    = [ key + ( count, float( count ) / ncycles )
+                for key, count in self.chains.items() ]
+    return sorted( rows, key=lambda x: ( -x[3], x[:3] ) )
+
+  #---------------------------------------------------------------------
+  # suggestions
+  #---------------------------------------------------------------------
+  # Returns a list of human readable suggestions for the top chains.
+  def suggestions( self, nchains = 10 ):
+
+    hints = []
+    for writer, net, reader, count, per_cycle in self.report()[:nchains]:
+
+      if writer == self.SEQ:
+        hints.append(
+          "{reader} is re-evaluated {n:.2f}x/cycle by register or input "
+          "changes on {net}; consider splitting {reader} so the logic "
+          "reading {net} is in its own block."
+          .format( reader=reader, net=net, n=per_cycle ) )
+
+      else:
+        hints.append(
+          "{reader} is evaluated before {writer} has settled {net} "
+          "({n:.2f}x/cycle); consider merging {writer} into {reader}, or "
+          "splitting the part of {reader} which reads {net} into a "
+          "separate block.".format( reader=reader, writer=writer, net=net,
+                                    n=per_cycle ) )
+
+    return hints
+
+  #---------------------------------------------------------------------
+  # print_report
+  #---------------------------------------------------------------------
+  def print_report( self, nchains = 10 ):
+    print( "-"*72 )
+    print( "Glitch Analysis" )
+    print( "-"*72 )
+    print()
+    print( "ncycles:         {:8}".format( self.ncycles    ) )
+    print( "evals:           {:8}".format( self.nevals     ) )
+    print( "redundant evals: {:8}".format( self.nredundant ) )
+    print()
+    print( " count   /cycle  chain" )
+    for writer, net, reader, count, per_cycle in self.report()[:nchains]:
+      print( "{:6}  {:7.2f}  {} --( {} )--> {}".format(
+             count, per_cycle, writer, net, reader ) )
+    print()
+    for hint in self.suggestions( nchains ):
+      print( "-", hint )
+    print( "-"*72 )
+
+  #---------------------------------------------------------------------
+  # _tracked_add_event
+  #---------------------------------------------------------------------
+  # Same as SimulationTool.add_event, but remember which net write (and
+  # which block performed it) first put each callback on the queue.
+  def _tracked_add_event( self, signal_value ):
+
+    sim     = self.sim
+    queue   = sim._event_queue
+    writer  = sim._current_func
+    metrics = sim.metrics
+
+    metrics.incr_add_events()
+
+    for func in signal_value._callbacks:
+      metrics.incr_add_callbk()
+      if func != writer:
+        if not queue.func_bv[ func.id ]:
+          self._cause[ func.id ] = ( writer, signal_value )
+        queue.enq( func.cb, func.id )
+
+  #---------------------------------------------------------------------
+  # _tracked_eval
+  #---------------------------------------------------------------------
+  # Same as SimulationTool._dev_eval, but attribute every evaluation of
+  # a block which already ran this cycle to the cause of its enqueue.
+  def _tracked_eval( self ):
+
+    sim      = self.sim
+    queue    = sim._event_queue
+    last_run = self._last_run
+
+    while queue.len():
+      sim._current_func = func = queue.deq()
+      sim.metrics.incr_comb_evals( func )
+
+      reader = self._block_name( func )
+      self.nevals += 1
+      self.evals[ reader ] += 1
+
+      cause = self._cause.pop( func.id, None )
+      if last_run.get( func ) == sim.ncycles:
+        self.nredundant += 1
+        writer, net = cause if cause else ( None, None )
+        self.chains[ ( self._block_name( writer ),
+                       self._net_names.get( id( net ), '?' ),
+                       reader ) ] += 1
+      else:
+        last_run[ func ] = sim.ncycles
+
+      func()
+      sim._current_func = None
+
+  #---------------------------------------------------------------------
+  # _block_name
+  #---------------------------------------------------------------------
+  def _block_name( self, func ):
+    try:
+      return self._names[ func ]
+    except KeyError:
+      if hasattr( func, '_model' ):
+        name = _model_name( func._model ) + '.' + func.__name__
+      else:
+        name = self.SLICE
+      self._names[ func ] = name
+      return name
+
+#-----------------------------------------------------------------------
+# _model_name
+#-----------------------------------------------------------------------
+def _model_name( model ):
+  names = []
+  while model is not None:
+    names.append( model.name )
+    model = model.parent
+  return '.'.join( reversed( names ) )
+
+#-----------------------------------------------------------------------
+# _signal_name
+#-----------------------------------------------------------------------
+def _signal_name( signal ):
+  return _model_name( signal.parent ) + '.' + signal.name
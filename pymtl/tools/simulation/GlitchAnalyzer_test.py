@@ -0,0 +1,58 @@
+#=======================================================================
+# GlitchAnalyzer_test.py
+#=======================================================================
+
+from pymtl import *
+
+from GlitchAnalyzer import GlitchAnalyzer
+
+#-----------------------------------------------------------------------
+# Glitchy
+#-----------------------------------------------------------------------
+# The sum block reads both in_ and the output of the incr block, which
+# is also driven by in_. Whenever sum is evaluated before incr, it has
+# to be evaluated a second time once incr has settled.
+class Glitchy( Model ):
+  def __init__( s ):
+    s.in_  = InPort ( 8 )
+    s.out  = OutPort( 8 )
+    s.tmp  = Wire( 8 )
+
+    @s.combinational
+    def sum():
+      s.out.value = s.in_ + s.tmp
+
+    @s.combinational
+    def incr():
+      s.tmp.value = s.in_ + 1
+
+#-----------------------------------------------------------------------
+# test_GlitchAnalyzer
+#-----------------------------------------------------------------------
+def test_GlitchAnalyzer():
+  model = Glitchy()
+  model.elaborate()
+  sim = SimulationTool( model )
+  sim.reset()
+
+  analyzer = GlitchAnalyzer( sim )
+  analyzer.start()
+  for i in range( 1, 11 ):
+    model.in_.value = i
+    sim.cycle()
+    assert model.out == 2*i + 1
+  analyzer.stop()
+
+  assert analyzer.ncycles    == 10
+  assert analyzer.nredundant == 10
+
+  report = analyzer.report()
+  assert len( report ) == 1
+  writer, net, reader, count, per_cycle = report[0]
+  assert writer    == 'top.incr'
+  assert net       == 'top.tmp'
+  assert reader    == 'top.sum'
+  assert count     == 10
+  assert per_cycle == 1.0
+
+  assert 'top.incr' in analyzer.suggestions()[0]
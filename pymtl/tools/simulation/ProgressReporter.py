@@ -0,0 +1,175 @@
+#=======================================================================
+# ProgressReporter.py
+#=======================================================================
+# Live progress reporting for long running simulations.
+#
+# The reporter wraps the cycle() method of a SimulationTool instance and
+# periodically (in wall-clock time) reports the simulated cycle count,
+# elapsed time, throughput and any user supplied counters. To keep the
+# overhead negligible, the wall clock is only checked every N cycles,
+# where N is adapted so that roughly ten checks happen per interval. The
+# simulator is left untouched when no reporter is attached.
+#
+# Usage:
+#
+#   sim      = SimulationTool( model )
+#   reporter = ProgressReporter( sim, interval=30,
+#                                counters={ 'msgs': lambda: sink.idx } )
+#   reporter.start()
+#   ...
+#   reporter.stop()
+#
+# Reports are written as text lines to stderr by default. If output is a
+# filename, one JSON object per report is written to that file instead.
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import timeit
+
+#-----------------------------------------------------------------------
+# ProgressReporter
+#-----------------------------------------------------------------------
+class ProgressReporter( object ):
+
+  def __init__( self, sim, interval = 10.0, output = None,
+                counters = None, fmt = None ):
+
+    self.sim       = sim
+    self.interval  = interval
+    self.counters  = counters or {}
+    self.running   = False
+    self.nreports  = 0
+
+    self._own_output = isinstance( output, str )
+    if fmt is None:
+      fmt = 'jsonl' if self._own_output else 'text'
+    if fmt not in ( 'jsonl', 'text' ):
+      raise ValueError( "unknown progress format: {}".format( fmt ) )
+
+    self._fmt    = fmt
+    self._output = output
+    self._timer  = timeit.default_timer
+
+  #---------------------------------------------------------------------
+  # start
+  #---------------------------------------------------------------------
+  def start( self ):
+
+    if self.running:
+      return
+    self.running = True
+
+    if self._own_output:
+      self._out = open( self._output, 'w' )
+    else:
+      self._out = self._output or sys.stderr
+
+    self._start_time   = self._last_time   = self._timer()
+    self._start_cycles = self._last_cycles = self.sim.ncycles
+    self._period       = 1
+    self._countdown    = 1
+
+    self._cycle        = self.sim.cycle
+    self.sim.cycle     = self._reporting_cycle
+
+  #---------------------------------------------------------------------
+  # stop
+  #---------------------------------------------------------------------
+  # Restore the simulator and emit a final report.
+  def stop( self ):
+
+    if not self.running:
+      return
+    self.running = False
+
+    self.sim.cycle = self._cycle
+    self.report()
+    if self._own_output:
+      self._out.close()
+
+  #---------------------------------------------------------------------
+  # report
+  #---------------------------------------------------------------------
+  # Emit a progress report now and return it as a dictionary.
+  def report( self ):
+
+    now     = self._timer()
+    ncycles = self.sim.ncycles
+    elapsed = now - self._start_time
+    delta   = now - self._last_time
+
+    record = {
+      'ncycles'            : ncycles,
+      'elapsed'            : elapsed,
+      'cycles_per_sec'     : ( ncycles - self._last_cycles ) / delta
+                             if delta else 0.0,
+      'avg_cycles_per_sec' : ( ncycles - self._start_cycles ) / elapsed
+                             if elapsed else 0.0,
+    }
+    for name, counter in self.counters.items():
+      record[ name ] = counter()
+
+    if self._fmt == 'jsonl':
+      self._out.write( json.dumps( record, sort_keys=True ) + '\n' )
+    else:
+      mins, secs = divmod( int( elapsed ), 60 )
+      hours, mins = divmod( mins, 60 )
+      fields = [ "cycle {:>10}".format( ncycles ),
+                 "elapsed {:d}:{:02d}:{:02d}".format( hours, mins, secs ),
+                 "{:10.1f} cycles/sec".format( record['cycles_per_sec'] ) ]
+      fields.extend( "{}={}".format( name, record[ name ] )
+                     for name in sorted( self.counters ) )
+      print( "[progress]", "  ".join( fields ), file=self._out )
+    self._out.flush()
+
+    self.nreports     += 1
+    self._last_time    = now
+    self._last_cycles  = ncycles
+    return record
+
+  #---------------------------------------------------------------------
+  # _reporting_cycle
+  #---------------------------------------------------------------------
+  # Replacement for sim.cycle. Only looks at the wall clock every
+  # _period cycles.
+  def _reporting_cycle( self ):
+
+    self._cycle()
+
+    self._countdown -= 1
+    if self._countdown:
+      return
+
+    now = self._timer()
+    if now - self._last_time >= self.interval:
+      self.report()
+
+    # Adapt the check period so we look at the clock ~10 times/interval
+
+    elapsed = now - self._start_time
+    if elapsed > 0:
+      rate = ( self.sim.ncycles - self._start_cycles ) / elapsed
+      self._period = max( 1, int( rate * self.interval / 10 ) )
+    self._countdown = self._period
+
+#-----------------------------------------------------------------------
+# start_progress_reporter
+#-----------------------------------------------------------------------
+# Convenience function for simulation drivers (e.g., run_sim). Starts
+# and returns a reporter printing to stderr every interval seconds. If
+# interval is None, the PYMTL_PROGRESS environment variable is used so
+# that progress can be enabled for an existing regression without
+# changing any tests. Returns None if progress reporting is disabled.
+def start_progress_reporter( sim, interval = None, counters = None ):
+
+  if interval is None:
+    interval = float( os.environ.get( 'PYMTL_PROGRESS', 0 ) )
+  if not interval:
+    return None
+
+  reporter = ProgressReporter( sim, interval, counters=counters )
+  reporter.start()
+  return reporter
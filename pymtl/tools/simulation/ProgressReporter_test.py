@@ -0,0 +1,96 @@
+#=======================================================================
+# ProgressReporter_test.py
+#=======================================================================
+
+import json
+import StringIO
+
+from pymtl import *
+
+from ProgressReporter import ProgressReporter, start_progress_reporter
+
+#-----------------------------------------------------------------------
+# Counter
+#-----------------------------------------------------------------------
+class Counter( Model ):
+  def __init__( s ):
+    s.out = OutPort( 16 )
+    @s.tick
+    def seq():
+      s.out.next = s.out + 1
+
+def setup_sim():
+  model = Counter()
+  model.elaborate()
+  sim = SimulationTool( model )
+  sim.reset()
+  return model, sim
+
+#-----------------------------------------------------------------------
+# FakeTimer
+#-----------------------------------------------------------------------
+# Every call advances the wall clock by one millisecond.
+class FakeTimer( object ):
+  def __init__( self ):
+    self.now = 0.0
+  def __call__( self ):
+    self.now += 0.001
+    return self.now
+
+#-----------------------------------------------------------------------
+# test_jsonl
+#-----------------------------------------------------------------------
+def test_jsonl( tmpdir ):
+  model, sim = setup_sim()
+  filename   = str( tmpdir.join( 'progress.jsonl' ) )
+
+  reporter = ProgressReporter( sim, interval=0.01, output=filename,
+                               counters={ 'count': lambda: model.out.uint() } )
+  reporter._timer = FakeTimer()
+  reporter.start()
+  for i in range( 100 ):
+    sim.cycle()
+  reporter.stop()
+
+  assert sim.cycle == sim._dev_cycle or sim.cycle == sim._perf_cycle
+
+  records = [ json.loads( line ) for line in open( filename ) ]
+  assert len( records ) == reporter.nreports
+  assert len( records ) >  2
+  assert records[-1]['ncycles'] == sim.ncycles
+  assert records[-1]['count']   == model.out
+  for r in records:
+    assert r['avg_cycles_per_sec'] > 0
+  assert [ r['ncycles'] for r in records ] == \
+         sorted( r['ncycles'] for r in records )
+
+#-----------------------------------------------------------------------
+# test_text
+#-----------------------------------------------------------------------
+def test_text():
+  model, sim = setup_sim()
+  output     = StringIO.StringIO()
+
+  reporter = ProgressReporter( sim, interval=3600, output=output )
+  reporter.start()
+  for i in range( 10 ):
+    sim.cycle()
+  reporter.stop()
+
+  lines = output.getvalue().splitlines()
+  assert len( lines ) == 1
+  assert lines[0].startswith( '[progress] cycle         12' )
+
+#-----------------------------------------------------------------------
+# test_disabled
+#-----------------------------------------------------------------------
+def test_disabled( monkeypatch, capsys ):
+  model, sim = setup_sim()
+  monkeypatch.delenv( 'PYMTL_PROGRESS', raising=False )
+  assert start_progress_reporter( sim ) is None
+  monkeypatch.setenv( 'PYMTL_PROGRESS', '5' )
+  reporter = start_progress_reporter( sim )
+  assert reporter.interval == 5.0
+  reporter.stop()
+  out, err = capsys.readouterr()
+  assert err.startswith( '[progress] cycle' )
@@ -5,6 +5,9 @@
 from __future__ import print_function
 
 import pickle
+import json
+
+from array import array
 
 #-------------------------------------------------------------------------
 # SimulationMetrics
@@ -67,7 +70,7 @@ class SimulationMetrics( object ):
   #-----------------------------------------------------------------------
   # Register an eval block in the design.
   def reg_eval( self, eval, is_slice = False ):
-    self.has_run [ eval ] = False
+    self.has_run [ eval ] = -1
     self.is_slice[ eval ] = is_slice
     if is_slice:
       self.num_slice_blocks += 1
@@ -76,7 +79,9 @@ class SimulationMetrics( object ):
   # incr_metrics_cycle
   #-----------------------------------------------------------------------
   # Should be called at the end of each simulation cycle. Initializes data
-  # structure storage to collect data for the next simulation cycle.
+  # structure storage to collect data for the next simulation cycle. Note
+  # that has_run stores the cycle an eval last ran in (a generation
+  # counter), so it does not need to be cleared here.
   def incr_metrics_cycle( self ):
     self._pre_tick                   = True
     self._ncycles                   += 1
@@ -88,8 +93,6 @@ class SimulationMetrics( object ):
     self.clock_comb_evals_per_cycle += [ 0 ]
     self.slice_comb_evals_per_cycle += [ 0 ]
     self.redun_comb_evals_per_cycle += [ 0 ]
-    for key in self.has_run:
-      self.has_run[ key ] = False
 
   #-----------------------------------------------------------------------
   # start_tick
@@ -130,12 +133,12 @@ class SimulationMetrics( object ):
     else:
       self.clock_comb_evals_per_cycle[ self._ncycles ] += 1
 
-    if   self.has_run[ eval ]:
+    if   self.has_run.get( eval ) == self._ncycles:
       self.redun_comb_evals_per_cycle[ self._ncycles ] += 1
     else:
-      self.has_run[ eval ] = True
+      self.has_run[ eval ] = self._ncycles
 
-    if   self.is_slice[ eval ]:
+    if   self.is_slice.get( eval, False ):
       self.slice_comb_evals_per_cycle[ self._ncycles ] += 1
 
   #-----------------------------------------------------------------------
@@ -183,6 +186,265 @@ class SimulationMetrics( object ):
     del self.has_run
     pickle.dump( self, open( filename, 'wb' ) )
 
+#-------------------------------------------------------------------------
+# StreamingMetrics
+#-------------------------------------------------------------------------
+# Bounded-memory alternative to SimulationMetrics for long simulations.
+# Instead of growing a list per counter every cycle, the counters for the
+# current cycle live in a small fixed list, the most recent cycles are
+# kept in fixed-size array ring buffers, and every window cycles the
+# counters are aggregated (sum and max) into a single record which can be
+# streamed to a CSV or JSON-lines sink. Memory use is independent of the
+# number of simulated cycles.
+#
+# Usage:
+#
+#   metrics = StreamingMetrics( window=10000, sink='metrics.jsonl' )
+#   sim     = SimulationTool( model, collect_metrics=metrics )
+#   ...
+#   metrics.close()
+#
+class StreamingMetrics( object ):
+
+  # Counter names, the order matches the column order of print_metrics.
+
+  counters = ( 'input_add_events', 'input_add_callbk', 'input_comb_evals',
+               'clock_add_events', 'clock_add_callbk', 'clock_comb_evals',
+               'slice_comb_evals', 'redun_comb_evals' )
+
+  _INPUT, _CLOCK, _SLICE, _REDUN = 0, 3, 6, 7
+
+  #-----------------------------------------------------------------------
+  # __init__
+  #-----------------------------------------------------------------------
+  # window:  number of cycles aggregated into each streamed record
+  # history: number of most recent cycles kept at per-cycle granularity
+  # sink:    None, a filename, or a file-like object
+  # fmt:     'jsonl' or 'csv', inferred from the filename if not given
+  def __init__( self, window = 10000, history = 1000, sink = None,
+                fmt = None ):
+
+    if window < 1 or history < 1:
+      raise ValueError( "window and history must be positive!" )
+
+    ncounters                     = len( self.counters )
+
+    self._ncycles                 = 0
+    self._phase                   = self._INPUT
+    self.window                   = window
+    self.history                  = history
+    self.num_modules              = 0
+    self.num_tick_blocks          = 0
+    self.num_posedge_clk_blocks   = 0
+    self.num_combinational_blocks = 0
+    self.num_slice_blocks         = 0
+    self.is_slice                 = dict()
+    self.has_run                  = dict()
+    self.last_window              = None
+
+    self._cur                     = [ 0 ] * ncounters
+    self._ring                    = [ array( 'L', [ 0 ] ) * history
+                                    for _ in range( ncounters ) ]
+    self._totals                  = [ 0 ] * ncounters
+    self._win_start               = 0
+    self._win_sum                 = [ 0 ] * ncounters
+    self._win_max                 = [ 0 ] * ncounters
+
+    # Select the output format and open the sink if given a filename
+
+    self._own_sink = isinstance( sink, str )
+    if fmt is None:
+      fmt = 'csv' if self._own_sink and sink.endswith( '.csv' ) else 'jsonl'
+    if fmt not in ( 'jsonl', 'csv' ):
+      raise ValueError( "unknown metrics sink format: {}".format( fmt ) )
+
+    self._fmt  = fmt
+    self._sink = open( sink, 'w' ) if self._own_sink else sink
+
+    if self._sink and fmt == 'csv':
+      self._sink.write( ','.join( self._fields() ) + '\n' )
+
+  #-----------------------------------------------------------------------
+  # reg_model
+  #-----------------------------------------------------------------------
+  def reg_model( self, model ):
+    self.num_modules              += 1
+    self.num_tick_blocks          += len( model.get_tick_blocks() )
+    self.num_posedge_clk_blocks   += len( model.get_posedge_clk_blocks() )
+    self.num_combinational_blocks += len( model.get_combinational_blocks() )
+
+  #-----------------------------------------------------------------------
+  # reg_eval
+  #-----------------------------------------------------------------------
+  def reg_eval( self, eval, is_slice = False ):
+    self.has_run [ eval ] = -1
+    self.is_slice[ eval ] = is_slice
+    if is_slice:
+      self.num_slice_blocks += 1
+
+  #-----------------------------------------------------------------------
+  # incr_metrics_cycle
+  #-----------------------------------------------------------------------
+  # Retire the counters of the current cycle into the ring buffers and the
+  # aggregation window. The cost is constant regardless of design size.
+  def incr_metrics_cycle( self ):
+
+    cur  = self._cur
+    idx  = self._ncycles % self.history
+    ring = self._ring
+    wsum = self._win_sum
+    wmax = self._win_max
+    tot  = self._totals
+
+    for i, count in enumerate( cur ):
+      ring[i][idx] = count
+      wsum[i]     += count
+      tot [i]     += count
+      if count > wmax[i]:
+        wmax[i] = count
+      cur[i] = 0
+
+    self._phase    = self._INPUT
+    self._ncycles += 1
+
+    if self._ncycles - self._win_start >= self.window:
+      self._emit_window()
+
+  #-----------------------------------------------------------------------
+  # start_tick
+  #-----------------------------------------------------------------------
+  def start_tick( self ):
+    self._phase = self._CLOCK
+
+  #-----------------------------------------------------------------------
+  # incr_add_events
+  #-----------------------------------------------------------------------
+  def incr_add_events( self ):
+    self._cur[ self._phase ] += 1
+
+  #-----------------------------------------------------------------------
+  # incr_add_callbk
+  #-----------------------------------------------------------------------
+  def incr_add_callbk( self ):
+    self._cur[ self._phase + 1 ] += 1
+
+  #-----------------------------------------------------------------------
+  # incr_comb_evals
+  #-----------------------------------------------------------------------
+  # The has_run dictionary stores the cycle each eval last ran in, so an
+  # eval is redundant if it already ran in the current generation.
+  def incr_comb_evals( self, eval ):
+    cur = self._cur
+    cur[ self._phase + 2 ] += 1
+
+    if self.has_run.get( eval ) == self._ncycles:
+      cur[ self._REDUN ] += 1
+    else:
+      self.has_run[ eval ] = self._ncycles
+
+    if self.is_slice.get( eval, False ):
+      cur[ self._SLICE ] += 1
+
+  #-----------------------------------------------------------------------
+  # totals
+  #-----------------------------------------------------------------------
+  # Return a dictionary of counter totals over all retired cycles.
+  @property
+  def totals( self ):
+    return dict( zip( self.counters, self._totals ) )
+
+  #-----------------------------------------------------------------------
+  # recent
+  #-----------------------------------------------------------------------
+  # Return the per-cycle values of the named counter for the most recent
+  # (at most history) cycles, oldest first.
+  def recent( self, name ):
+    ring  = self._ring[ self.counters.index( name ) ]
+    first = max( 0, self._ncycles - self.history )
+    return [ ring[ i % self.history ] for i in range( first, self._ncycles ) ]
+
+  #-----------------------------------------------------------------------
+  # flush
+  #-----------------------------------------------------------------------
+  # Emit the current (partial) aggregation window, if non-empty.
+  def flush( self ):
+    if self._ncycles > self._win_start:
+      self._emit_window()
+    if self._sink:
+      self._sink.flush()
+
+  #-----------------------------------------------------------------------
+  # close
+  #-----------------------------------------------------------------------
+  # Flush remaining metrics and close the sink if we opened it.
+  def close( self ):
+    self.flush()
+    if self._own_sink:
+      self._sink.close()
+    self._sink = None
+
+  #-----------------------------------------------------------------------
+  # _fields
+  #-----------------------------------------------------------------------
+  def _fields( self ):
+    return ( [ 'start', 'ncycles' ] + list( self.counters )
+             + [ name + '_max' for name in self.counters ] )
+
+  #-----------------------------------------------------------------------
+  # _emit_window
+  #-----------------------------------------------------------------------
+  # Aggregate the current window into a record, write it to the sink and
+  # reset the window accumulators.
+  def _emit_window( self ):
+
+    values = ( [ self._win_start, self._ncycles - self._win_start ]
+               + self._win_sum + self._win_max )
+    record = dict( zip( self._fields(), values ) )
+
+    if   self._sink and self._fmt == 'csv':
+      self._sink.write( ','.join( str( x ) for x in values ) + '\n' )
+    elif self._sink:
+      self._sink.write( json.dumps( record, sort_keys=True ) + '\n' )
+
+    self.last_window = record
+    self._win_start  = self._ncycles
+    self._win_sum    = [ 0 ] * len( self.counters )
+    self._win_max    = [ 0 ] * len( self.counters )
+
+  #-----------------------------------------------------------------------
+  # print_metrics
+  #-----------------------------------------------------------------------
+  # Print metrics to the commandline. Only the cycles still held in the
+  # ring buffers are printed in detailed mode.
+  def print_metrics( self, detailed = True ):
+    print("-"*72)
+    print("Simulation Metrics")
+    print("-"*72)
+    print()
+    print("ncycles:               {:4}".format(self._ncycles                ))
+    print("modules:               {:4}".format(self.num_modules             ))
+    print("@tick blocks:          {:4}".format(self.num_tick_blocks         ))
+    print("@posedge_clk blocks:   {:4}".format(self.num_posedge_clk_blocks  ))
+    print("@combinational blocks: {:4}".format(self.num_combinational_blocks))
+    print("slice blocks:          {:4}".format(self.num_slice_blocks        ))
+    print("-"*72)
+    print()
+    for name in self.counters:
+      print("{:22} {:10}".format( name+':', self.totals[ name ] ))
+    print("-"*72)
+    if not detailed:
+      return
+    print()
+    print("          pre-tick          post-tick         other       ")
+    print("cycle     adde  clbk  eval  adde  clbk  eval  slice  redun")
+    print("--------  ----  ----  ----  ----  ----  ----  -----  -----")
+    first   = max( 0, self._ncycles - self.history )
+    columns = [ self.recent( name ) for name in self.counters ]
+    for i, row in enumerate( zip( *columns ) ):
+      print("{:8}  {:4}  {:4}  {:4}  {:4}  {:4}  {:4}  {:5}  {:5}".format(
+                   first+i, *row ))
+    print("-"*72)
+
 #-------------------------------------------------------------------------
 # DummyMetrics
 #-------------------------------------------------------------------------
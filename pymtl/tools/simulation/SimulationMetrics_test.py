@@ -0,0 +1,116 @@
+#=======================================================================
+# SimulationMetrics_test.py
+#=======================================================================
+
+import json
+
+from pymtl import *
+
+from SimulationMetrics import SimulationMetrics, StreamingMetrics
+
+#-----------------------------------------------------------------------
+# Test Models
+#-----------------------------------------------------------------------
+
+class Incr( Model ):
+  def __init__( s ):
+    s.in_ = InPort ( 8 )
+    s.out = OutPort( 8 )
+    @s.combinational
+    def logic():
+      s.out.value = s.in_ + 1
+
+class IncrChain( Model ):
+  def __init__( s ):
+    s.in_   = InPort ( 8 )
+    s.out   = OutPort( 4 )
+    s.sum   = OutPort( 8 )
+    s.reg   = Wire( 8 )
+    s.incrs = [ Incr() for _ in range( 2 ) ]
+    s.connect( s.in_,          s.incrs[0].in_ )
+    s.connect( s.incrs[0].out, s.incrs[1].in_ )
+    s.connect( s.incrs[1].out[0:4], s.out )
+    @s.tick
+    def seq():
+      s.reg.next = s.incrs[1].out
+    # Reads both the input and the output of the chain, so it is
+    # evaluated redundantly whenever the input changes.
+    @s.combinational
+    def comb():
+      s.sum.value = s.reg + s.in_
+
+def run( metrics, ncycles ):
+  model = IncrChain()
+  model.elaborate()
+  sim = SimulationTool( model, collect_metrics=metrics )
+  sim.reset()
+  for i in range( ncycles ):
+    model.in_.value = i
+    sim.cycle()
+  return model, sim
+
+#-----------------------------------------------------------------------
+# test_SimulationMetrics
+#-----------------------------------------------------------------------
+def test_SimulationMetrics():
+  model, sim = run( True, 10 )
+  metrics    = sim.metrics
+  assert isinstance( metrics, SimulationMetrics )
+  assert metrics._ncycles                == 12
+  assert metrics.num_modules             == 3
+  assert metrics.num_combinational_blocks == 3
+  assert metrics.num_slice_blocks        == 1
+  assert sum( metrics.input_comb_evals_per_cycle ) > 0
+  assert sum( metrics.slice_comb_evals_per_cycle ) > 0
+
+#-----------------------------------------------------------------------
+# test_StreamingMetrics_matches
+#-----------------------------------------------------------------------
+# Streaming metrics should count exactly what SimulationMetrics counts.
+def test_StreamingMetrics_matches():
+  _, ref = run( True, 50 )
+  metrics = StreamingMetrics( window=16, history=8 )
+  run( metrics, 50 )
+
+  assert metrics._ncycles                 == ref.metrics._ncycles
+  assert metrics.num_modules              == ref.metrics.num_modules
+  assert metrics.num_slice_blocks         == ref.metrics.num_slice_blocks
+  for name in StreamingMetrics.counters:
+    expected = getattr( ref.metrics, name + '_per_cycle' )
+    assert metrics.totals[ name ]  == sum( expected )
+    assert metrics.recent( name )  == expected[ 52-8:52 ]
+  assert metrics.totals[ 'redun_comb_evals' ] > 0
+
+#-----------------------------------------------------------------------
+# test_StreamingMetrics_jsonl
+#-----------------------------------------------------------------------
+def test_StreamingMetrics_jsonl( tmpdir ):
+  filename = str( tmpdir.join( 'metrics.jsonl' ) )
+  metrics  = StreamingMetrics( window=10, sink=filename )
+  run( metrics, 23 )
+  metrics.close()
+
+  records = [ json.loads( line ) for line in open( filename ) ]
+  assert [ r['start']   for r in records ] == [ 0, 10, 20 ]
+  assert [ r['ncycles'] for r in records ] == [ 10, 10, 5 ]
+  for name in StreamingMetrics.counters:
+    assert sum( r[ name ] for r in records ) == metrics.totals[ name ]
+    for r in records:
+      assert r[ name+'_max' ] <= r[ name ]
+
+#-----------------------------------------------------------------------
+# test_StreamingMetrics_csv
+#-----------------------------------------------------------------------
+def test_StreamingMetrics_csv( tmpdir ):
+  filename = str( tmpdir.join( 'metrics.csv' ) )
+  metrics  = StreamingMetrics( window=4, sink=filename )
+  run( metrics, 6 )
+  metrics.close()
+
+  lines  = open( filename ).read().splitlines()
+  header = lines[0].split( ',' )
+  assert header[:2] == [ 'start', 'ncycles' ]
+  assert len( lines ) == 3
+  rows   = [ dict( zip( header, map( int, l.split( ',' ) ) ) )
+             for l in lines[1:] ]
+  assert sum( r['ncycles'] for r in rows ) == 8
@@ -0,0 +1,252 @@
+#=======================================================================
+# SimulationProfiler.py
+#=======================================================================
+# Low-overhead sampling profiler for SimulationTool.
+#
+# Rather than instrumenting every block execution, the profiler builds a
+# statistical profile of where simulation time is spent, broken down by
+# model instance and logic block. Two sampling modes are supported:
+#
+# - timer mode (interval_us): a SIGPROF interval timer interrupts the
+#   simulator every interval_us microseconds of CPU time and records the
+#   block which is currently executing. Nothing is added to the cycle
+#   loop, so the overhead is just the cost of the signal handler.
+#
+# - cycle mode (ncycles): one out of every ncycles cycles is executed
+#   with every sequential and combinational block individually timed.
+#
+# Usage:
+#
+#   sim      = SimulationTool( model )
+#   profiler = SamplingProfiler( sim, interval_us=1000 )
+#   profiler.start()
+#   ...
+#   profiler.stop()
+#   profiler.print_report()
+#
+# Timer mode relies on signal.setitimer and therefore only works on
+# POSIX systems and must be started from the main thread.
+
+from __future__ import print_function
+
+import collections
+import signal
+import timeit
+
+#-----------------------------------------------------------------------
+# SamplingProfiler
+#-----------------------------------------------------------------------
+class SamplingProfiler( object ):
+
+  OTHER = ( '<other>', '' )
+  SLICE = ( '<slices>', '' )
+
+  def __init__( self, sim, interval_us = None, ncycles = None ):
+
+    if interval_us and ncycles:
+      raise ValueError( "Cannot sample on both a timer and a cycle count!" )
+    if not ( interval_us or ncycles ):
+      interval_us = 1000
+
+    self.sim         = sim
+    self.interval_us = interval_us
+    self.ncycles     = ncycles
+    self.nsamples    = 0
+    self.running     = False
+
+    # Each entry maps ( model path, block name ) to [ samples, seconds ]
+
+    self.profile     = collections.defaultdict( lambda: [ 0, 0.0 ] )
+
+    self._func_keys  = {}
+    self._code_keys  = collections.defaultdict( list )
+    self._model_path = {}
+    self._seq_keys   = []
+
+    self._index_blocks( sim.model, sim.model.name )
+
+  #---------------------------------------------------------------------
+  # start
+  #---------------------------------------------------------------------
+  def start( self ):
+
+    if self.running:
+      return
+    self.running = True
+
+    if self.interval_us:
+      interval = self.interval_us * 1e-6
+      self._prev_handler = signal.signal( signal.SIGPROF, self._on_sample )
+      signal.setitimer( signal.ITIMER_PROF, interval, interval )
+    else:
+      self._cycle     = self.sim.cycle
+      self._countdown = self.ncycles
+      self.sim.cycle  = self._sampled_cycle
+
+  #---------------------------------------------------------------------
+  # stop
+  #---------------------------------------------------------------------
+  def stop( self ):
+
+    if not self.running:
+      return
+    self.running = False
+
+    if self.interval_us:
+      signal.setitimer( signal.ITIMER_PROF, 0 )
+      signal.signal( signal.SIGPROF, self._prev_handler )
+    else:
+      self.sim.cycle = self._cycle
+
+  #---------------------------------------------------------------------
+  # report
+  #---------------------------------------------------------------------
+  # Returns a list of ( model path, block name, samples, seconds )
+  # tuples sorted from most to least expensive. In timer mode seconds
+  # are estimated from the number of samples.
+  def report( self ):
+    rows = [ key + tuple( value ) for key, value in self.profile.items() ]
+    return sorted( rows, key=lambda x: ( -x[3], -x[2], x[0], x[1] ) )
+
+  #---------------------------------------------------------------------
+  # report_by_model
+  #---------------------------------------------------------------------
+  # Same as report, but aggregated over all blocks of a model instance.
+  def report_by_model( self ):
+    models = collections.defaultdict( lambda: [ 0, 0.0 ] )
+    for path, _, samples, seconds in self.report():
+      models[ path ][0] += samples
+      models[ path ][1] += seconds
+    rows = [ ( path, ) + tuple( value ) for path, value in models.items() ]
+    return sorted( rows, key=lambda x: ( -x[2], -x[1], x[0] ) )
+
+  #---------------------------------------------------------------------
+  # print_report
+  #---------------------------------------------------------------------
+  def print_report( self, nlines = 20 ):
+    rows  = self.report()
+    total = sum( x[3] for x in rows ) or 1.0
+    print( "-"*72 )
+    print( "Simulation Profile ({} samples)".format( self.nsamples ) )
+    print( "-"*72 )
+    print( " time%   samples  block" )
+    for path, block, samples, seconds in rows[:nlines]:
+      name = '.'.join( [ path, block ] ) if block else path
+      print( "{:6.2f}  {:8}  {}".format( 100*seconds/total, samples, name ) )
+    print( "-"*72 )
+
+  #---------------------------------------------------------------------
+  # _index_blocks
+  #---------------------------------------------------------------------
+  # Build the lookup tables used to turn functions and code objects into
+  # ( model path, block name ) keys. The sequential block keys are
+  # collected in the same order as sim_utils.register_seq_blocks.
+  def _index_blocks( self, model, path ):
+
+    self._model_path[ id( model ) ] = path
+
+    for func in model.get_tick_blocks() + model.get_posedge_clk_blocks():
+      self._seq_keys.append( self._add_block( func, model, path ) )
+
+    for func in model.get_combinational_blocks():
+      self._add_block( func, model, path )
+
+    for m in model.get_submodules():
+      self._index_blocks( m, path + '.' + m.name )
+
+  def _add_block( self, func, model, path ):
+    key = ( path, func.__name__ )
+    self._func_keys[ func ] = key
+    self._code_keys[ func.__code__ ].append( ( func, model, key ) )
+    return key
+
+  #---------------------------------------------------------------------
+  # _on_sample
+  #---------------------------------------------------------------------
+  # SIGPROF handler. Walk up the interrupted stack until we find the
+  # frame of a registered logic block.
+  def _on_sample( self, signum, frame ):
+
+    self.nsamples += 1
+    key = self._frame_key( frame )
+    entry = self.profile[ key ]
+    entry[0] += 1
+    entry[1] += self.interval_us * 1e-6
+
+  def _frame_key( self, frame ):
+
+    current = self.sim._current_func
+
+    while frame is not None:
+      blocks = self._code_keys.get( frame.f_code )
+      if blocks:
+        if len( blocks ) == 1:
+          return blocks[0][2]
+        # Several instances of the same model class share a code object,
+        # use the eval being executed or the closure's model to choose.
+        for func, model, key in blocks:
+          if func is current:
+            return key
+        f_locals = frame.f_locals
+        model    = f_locals.get( 's', f_locals.get( 'self' ) )
+        for func, m, key in blocks:
+          if m is model:
+            return key
+        return blocks[0][2]
+      frame = frame.f_back
+
+    if current is not None:
+      return self._func_keys.get( current, self.SLICE )
+    return self.OTHER
+
+  #---------------------------------------------------------------------
+  # _sampled_cycle
+  #---------------------------------------------------------------------
+  # Replacement for sim.cycle in cycle mode. Every ncycles cycles, one
+  # cycle is executed with timed sequential blocks and a timed eval.
+  def _sampled_cycle( self ):
+
+    self._countdown -= 1
+    if self._countdown:
+      return self._cycle()
+    self._countdown = self.ncycles
+
+    sim        = self.sim
+    seq_blocks = sim._sequential_blocks
+    comb_eval  = sim.eval_combinational
+
+    sim._sequential_blocks  = [ self._timed( func, key ) for func, key
+                                in zip( seq_blocks, self._seq_keys ) ]
+    sim.eval_combinational  = self._timed_eval
+    try:
+      self._cycle()
+    finally:
+      sim._sequential_blocks = seq_blocks
+      sim.eval_combinational = comb_eval
+
+    self.nsamples += 1
+
+  def _timed( self, func, key ):
+    def timed_func():
+      start = timeit.default_timer()
+      func()
+      self._record( key, timeit.default_timer() - start )
+    return timed_func
+
+  def _timed_eval( self ):
+    sim   = self.sim
+    queue = sim._event_queue
+    keys  = self._func_keys
+    timer = timeit.default_timer
+    while queue.len():
+      sim._current_func = func = queue.deq()
+      sim.metrics.incr_comb_evals( func )
+      start = timer()
+      func()
+      self._record( keys.get( func, self.SLICE ), timer() - start )
+      sim._current_func = None
+
+  def _record( self, key, seconds ):
+    entry = self.profile[ key ]
+    entry[0] += 1
+    entry[1] += seconds
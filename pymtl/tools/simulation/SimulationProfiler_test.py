@@ -0,0 +1,96 @@
+#=======================================================================
+# SimulationProfiler_test.py
+#=======================================================================
+
+import pytest
+import signal
+
+from pymtl import *
+
+from SimulationProfiler import SamplingProfiler
+
+#-----------------------------------------------------------------------
+# Test Models
+#-----------------------------------------------------------------------
+
+class Slow( Model ):
+  def __init__( s, nloops ):
+    s.in_ = InPort ( 8 )
+    s.out = OutPort( 8 )
+    @s.combinational
+    def logic():
+      x = 0
+      for i in range( nloops ):
+        x += i
+      s.out.value = s.in_ + 1
+
+class Pipe( Model ):
+  def __init__( s ):
+    s.in_   = InPort ( 8 )
+    s.out   = OutPort( 8 )
+    s.fast  = Slow( 1 )
+    s.slow  = Slow( 20000 )
+    s.reg   = Wire( 8 )
+    s.connect( s.in_,      s.fast.in_ )
+    s.connect( s.fast.out, s.slow.in_ )
+    @s.tick
+    def seq():
+      s.reg.next = s.slow.out
+    @s.combinational
+    def comb():
+      s.out.value = s.reg
+
+def setup_sim():
+  model = Pipe()
+  model.elaborate()
+  sim = SimulationTool( model )
+  sim.reset()
+  return model, sim
+
+#-----------------------------------------------------------------------
+# test_cycle_sampling
+#-----------------------------------------------------------------------
+def test_cycle_sampling():
+  model, sim = setup_sim()
+  profiler = SamplingProfiler( sim, ncycles=4 )
+  profiler.start()
+  for i in range( 20 ):
+    model.in_.value = i
+    sim.cycle()
+  profiler.stop()
+
+  assert profiler.nsamples == 5
+  assert sim.cycle == sim._dev_cycle or sim.cycle == sim._perf_cycle
+
+  report = profiler.report()
+  blocks = [ ( path, block ) for path, block, _, _ in report ]
+  assert blocks[0] == ( 'top.slow', 'logic' )
+  assert ( 'top.fast', 'logic' ) in blocks
+  assert ( 'top',      'seq'   ) in blocks
+  assert profiler.report_by_model()[0][0] == 'top.slow'
+
+  # Simulation results are not affected by profiling
+  sim.cycle()
+  assert model.out == 19 + 2
+
+#-----------------------------------------------------------------------
+# test_timer_sampling
+#-----------------------------------------------------------------------
+@pytest.mark.skipif( not hasattr( signal, 'setitimer' ),
+                     reason='requires signal.setitimer' )
+def test_timer_sampling():
+  model, sim = setup_sim()
+  profiler = SamplingProfiler( sim, interval_us=1000 )
+  profiler.start()
+  try:
+    i = 0
+    while profiler.nsamples < 20:
+      model.in_.value = i % 256
+      sim.cycle()
+      i += 1
+  finally:
+    profiler.stop()
+
+  report = profiler.report()
+  assert report[0][:2] == ( 'top.slow', 'logic' )
+  assert sum( x[2] for x in report ) == profiler.nsamples
@@ -30,7 +30,12 @@ class SimulationTool( object ):
   # __init__
   #---------------------------------------------------------------------
   # Construct a simulator based on the provided model.
-  def __init__( self, model, collect_metrics = False ):
+  #
+  # If offload is set, the hottest RTL subtrees of the model are
+  # translated and simulated natively once the simulation is running,
+  # see SubtreeOffloader.py. Passing a dict of options instead of True
+  # configures the SubtreeOffloader.
+  def __init__( self, model, collect_metrics = False, offload = False ):
 
     # Check that the model has been elaborated
     if not model.is_elaborated():
@@ -52,10 +57,13 @@ class SimulationTool( object ):
 
 
     # Only collect metrics if they are enabled, otherwise replace
-    # with a dummy collection class.
+    # with a dummy collection class. Passing a metrics object (e.g., a
+    # StreamingMetrics instance) instead of True uses it directly.
 
-    if collect_metrics:
+    if   collect_metrics is True:
       self.metrics            = SimulationMetrics()
+    elif collect_metrics:
+      self.metrics            = collect_metrics
     else:
       self.metrics            = DummyMetrics()
 
@@ -78,8 +86,9 @@ class SimulationTool( object ):
 
     sim.insert_signal_values( self, nets )
 
-    sim.register_comb_blocks  ( model, self._event_queue )
-    sim.create_slice_callbacks( slice_connections, self._event_queue )
+    sim.register_comb_blocks  ( model, self._event_queue, self.metrics )
+    sim.create_slice_callbacks( slice_connections, self._event_queue,
+                                self.metrics )
     sim.register_cffi_updates ( model )
 
     self._nets              = nets
@@ -91,6 +100,15 @@ class SimulationTool( object ):
       from vcd import VCDUtil
       VCDUtil( self, model.vcd_file )
 
+    # Setup offloading to compiled models if it's enabled
+
+    self.offloader = None
+
+    if offload:
+      from SubtreeOffloader import SubtreeOffloader
+      options        = offload if isinstance( offload, dict ) else {}
+      self.offloader = SubtreeOffloader( self, **options )
+
   #---------------------------------------------------------------------
   # reset
   #---------------------------------------------------------------------
@@ -0,0 +1,448 @@
+#=======================================================================
+# SubtreeOffloader.py
+#=======================================================================
+# Automatic offloading of hot RTL subtrees to compiled simulators.
+#
+# Speeding up part of a mixed CL/RTL design normally means wrapping the
+# RTL submodels in TranslationTool( ... ) by hand. The offloader does
+# this while the simulation is running: it profiles the first
+# profile_cycles cycles with a SamplingProfiler, translates the hottest
+# subtrees which only contain RTL logic (@s.combinational and
+# @s.posedge_clk blocks) and splices the compiled models into the
+# simulation in place of the Python submodels, reusing the nets the
+# submodels are connected to.
+#
+# Translation runs in a background thread while simulation continues in
+# Python. The compiled model starts out in its reset state, so the
+# inputs of every candidate subtree are recorded from the first cycle
+# and replayed through its cycle_n method before it is spliced in.
+#
+# Usage:
+#
+#   sim = SimulationTool( model, offload=True )
+#
+# or, to pass options,
+#
+#   sim = SimulationTool( model, offload={ 'profile_cycles' : 5000 } )
+#
+# The Python submodels stay in the model hierarchy and their ports keep
+# tracking the simulation, but signals inside offloaded subtrees (and
+# line traces relying on them) are no longer updated. Subtrees whose
+# internal signals are connected to or referenced by logic outside of
+# them are never offloaded.
+
+from __future__ import print_function
+
+import threading
+import warnings
+
+from array import array
+
+from ..ast_helpers       import get_method_ast
+from ...model.signals    import Constant
+from ast_visitor         import DetectLoadsAndStores
+from SimulationProfiler  import SamplingProfiler
+
+import sim_utils
+
+#-----------------------------------------------------------------------
+# SubtreeOffloader
+#-----------------------------------------------------------------------
+class SubtreeOffloader( object ):
+
+  def __init__( self, sim, profile_cycles = 1000, max_subtrees = 4,
+                min_fraction = 0.1, background = True, translate = None ):
+    """Offload the hottest RTL subtrees of a simulation.
+
+    sim:            a SimulationTool which has not simulated any cycles
+    profile_cycles: number of cycles to profile before choosing subtrees
+    max_subtrees:   maximum number of subtrees to offload
+    min_fraction:   minimum fraction of the profiled time a subtree has
+                    to take to be offloaded
+    background:     translate in a background thread while simulation
+                    continues, otherwise simulation blocks until the
+                    compiled models are ready
+    translate:      function turning an unelaborated model instance into
+                    a compiled model with a cycle_n method (defaults to
+                    the TranslationTool, get_cpp also works)
+    """
+
+    if sim.ncycles:
+      raise ValueError( "SubtreeOffloader must be attached before any "
+                        "cycles are simulated!" )
+
+    if translate is None:
+      from ..translation import TranslationTool as translate
+
+    self.sim            = sim
+    self.profile_cycles = profile_cycles
+    self.max_subtrees   = max_subtrees
+    self.min_fraction   = min_fraction
+    self.background     = background
+    self.translate      = translate
+
+    # Paths of the subtrees which can be offloaded, the ones chosen after
+    # profiling, the compiled models of the ones spliced in so far and
+    # the exceptions of the ones which could not be offloaded
+
+    self.candidates = []
+    self.selected   = []
+    self.offloaded  = {}
+    self.failed     = {}
+
+    self._models    = {}
+    self._recorders = {}
+    self._pending   = {}
+
+    self._find_candidates( sim.model, sim.model.name, [] )
+    for path in self.candidates:
+      self._recorders[ path ] = _InputRecorder( self._models[ path ] )
+
+    # Nothing to do if no subtree can be offloaded
+
+    if not self.candidates:
+      return
+
+    self._profiler = SamplingProfiler( sim, ncycles=1 )
+    self._profiler.start()
+    self._profiling = True
+
+    self._cycle     = sim.cycle
+    sim.cycle       = self._offload_cycle
+
+  #---------------------------------------------------------------------
+  # wait
+  #---------------------------------------------------------------------
+  # Block until all pending translations are done and splice them in.
+  def wait( self ):
+    for worker in self._pending.values():
+      worker.join()
+    self._poll()
+
+  #---------------------------------------------------------------------
+  # _offload_cycle
+  #---------------------------------------------------------------------
+  # Replacement for sim.cycle while profiling or translating. The inputs
+  # of each subtree are recorded as seen by the clock edge, i.e., after
+  # the combinational logic has settled.
+  def _offload_cycle( self ):
+
+    self.sim.eval_combinational()
+    for recorder in self._recorders.itervalues():
+      recorder.record()
+
+    self._cycle()
+
+    if self._profiling and self.sim.ncycles >= self.profile_cycles:
+      self._select()
+    if self._pending:
+      self._poll()
+
+    if not self._profiling and not self._pending:
+      self.sim.cycle = self._cycle
+
+  #---------------------------------------------------------------------
+  # _select
+  #---------------------------------------------------------------------
+  # Choose the subtrees to offload from the profile and start
+  # translating them.
+  def _select( self ):
+
+    self._profiling = False
+    self._profiler.stop()
+
+    # Stopping the profiler restored the original cycle method
+
+    self._cycle     = self.sim.cycle
+    self.sim.cycle  = self._offload_cycle
+
+    rows  = self._profiler.report_by_model()
+    total = sum( seconds for path, samples, seconds in rows ) or 1.0
+
+    def subtree_time( root ):
+      return sum( seconds for path, samples, seconds in rows
+                  if path == root or path.startswith( root + '.' ) )
+
+    times = [ ( subtree_time( x ), x ) for x in self.candidates ]
+    for seconds, path in sorted( times, reverse=True ):
+      if len( self.selected ) == self.max_subtrees:
+        break
+      if seconds / total < self.min_fraction:
+        break
+      self.selected.append( path )
+
+    # Only the chosen subtrees need their inputs recorded from now on
+
+    for path in self.candidates:
+      if path not in self.selected:
+        del self._recorders[ path ]
+
+    for path in self.selected:
+      worker = _TranslationWorker( self._models[ path ], self.translate )
+      self._pending[ path ] = worker
+      if self.background:
+        worker.start()
+      else:
+        worker.run()
+
+  #---------------------------------------------------------------------
+  # _poll
+  #---------------------------------------------------------------------
+  # Splice in the compiled models of all finished translations.
+  def _poll( self ):
+
+    for path, worker in self._pending.items():
+      if worker.is_alive() or not worker.done:
+        continue
+
+      del self._pending[ path ]
+      recorder = self._recorders.pop( path )
+
+      if worker.error:
+        self.failed[ path ] = worker.error
+        warnings.warn( "Could not offload {}, it is still simulated in "
+                       "Python: {}".format( path, worker.error ) )
+        continue
+
+      try:
+        self._splice( self._models[ path ], worker.model, recorder )
+      except Exception as e:
+        self.failed[ path ] = e
+        warnings.warn( "Could not offload {}, it is still simulated in "
+                       "Python: {}".format( path, e ) )
+        continue
+
+      self.offloaded[ path ] = worker.model
+
+  #---------------------------------------------------------------------
+  # _splice
+  #---------------------------------------------------------------------
+  # Replace a Python subtree with its compiled model. The ports of the
+  # compiled model take over the SignalValues of the subtree's ports,
+  # its logic blocks are registered with the simulator and the logic
+  # blocks of the subtree are unregistered. Finally, the recorded inputs
+  # are replayed to bring the compiled model to the current cycle.
+  def _splice( self, model, compiled, recorder ):
+
+    sim = self.sim
+
+    compiled.elaborate()
+    if not hasattr( compiled, 'cycle_n' ):
+      raise TypeError( "{} does not support cycle_n".format(
+                       compiled.class_name ) )
+
+    ports = dict( ( x.name, x._signalvalue ) for x in model.get_ports() )
+    for x in compiled.get_ports():
+      svalue = ports[ x.name ]
+      exec( "x.parent.{} = svalue".format( x.name ) ) in locals()
+      x._signalvalue = svalue
+
+    outputs = [ x._signalvalue for x in model.get_outports() ]
+    before  = [ int( x ) for x in outputs ]
+
+    # Unregister the logic of the subtree
+
+    subtree = _subtree_models( model )
+    blocks  = set()
+    for m in subtree:
+      blocks.update( m.get_tick_blocks() + m.get_posedge_clk_blocks()
+                     + m.get_combinational_blocks() )
+
+    sim._sequential_blocks = [ x for x in sim._sequential_blocks
+                               if x not in blocks ]
+    for m in subtree:
+      for x in m.get_ports() + m.get_wires():
+        svalue = x._signalvalue
+        if not isinstance( svalue, int ) and blocks.intersection( svalue._callbacks ):
+          svalue._callbacks = [ f for f in svalue._callbacks if f not in blocks ]
+
+    # Register the logic of the compiled model
+
+    sim._sequential_blocks.extend( sim_utils.register_seq_blocks( compiled ) )
+    sim_utils.register_comb_blocks ( compiled, sim._event_queue, sim.metrics )
+    sim_utils.register_cffi_updates( compiled )
+
+    # Catch up with the simulation
+
+    recorder.replay( compiled )
+    sim.eval_combinational()
+
+    if [ int( x ) for x in outputs ] != before:
+      warnings.warn( "Outputs of {} changed when it was offloaded, the "
+                     "compiled model does not match the Python model"
+                     .format( compiled.class_name ) )
+
+  #---------------------------------------------------------------------
+  # _find_candidates
+  #---------------------------------------------------------------------
+  # Collect the largest subtrees below model which can be offloaded.
+  # ancestors holds ( model, path ) of every model above model.
+  def _find_candidates( self, model, path, ancestors ):
+
+    ancestors = ancestors + [ ( model, path ) ]
+
+    for m in model.get_submodules():
+      subpath = path + '.' + m.name
+      if self._is_offloadable( m, ancestors ):
+        self.candidates.append( subpath )
+        self._models[ subpath ] = m
+      else:
+        self._find_candidates( m, subpath, ancestors )
+
+  #---------------------------------------------------------------------
+  # _is_offloadable
+  #---------------------------------------------------------------------
+  # A subtree can be offloaded if it only contains RTL logic, is not
+  # already compiled, and is only connected to and accessed by the rest
+  # of the design through the ports of its root.
+  def _is_offloadable( self, root, ancestors ):
+
+    subtree = _subtree_models( root )
+
+    for m in subtree:
+      if m.get_tick_blocks() or hasattr( m, '_cffi_update' ):
+        return False
+
+    inside     = set()
+    for m in subtree:
+      inside.update( m.get_ports() + m.get_wires() )
+    root_ports = set( root.get_ports() )
+
+    # Nets connecting the inside to the outside must go through a port
+    # of the root
+
+    for net in self.sim._nets:
+      if inside.isdisjoint( net ) or not root_ports.isdisjoint( net ):
+        continue
+      if any( x not in inside and not isinstance( x, Constant )
+              for x in net ):
+        return False
+
+    # Same for slice connections
+
+    for m, _ in ancestors:
+      for c in m.get_connections():
+        for a, b in [ ( c.src_node, c.dest_node ), ( c.dest_node, c.src_node ) ]:
+          if a in inside and a not in root_ports and b not in inside:
+            return False
+
+    # Logic blocks of the ancestors may only access ports of the root
+
+    port_names = set( _base_name( x.name ) for x in root.get_ports() )
+
+    for i, ( m, _ ) in enumerate( ancestors ):
+      rel = '.'.join( _list_name( a.name ) for a, _ in ancestors[i+1:] )
+      rel = ( rel + '.' if rel else '' ) + _list_name( root.name ) + '.'
+      for func in ( m.get_combinational_blocks() + m.get_tick_blocks()
+                    + m.get_posedge_clk_blocks() ):
+        tree, _       = get_method_ast( func )
+        loads, stores = DetectLoadsAndStores().enter( tree )
+        for name in loads + stores:
+          name = name.split( '.', 1 )[-1]
+          if name.startswith( rel ) and \
+             _base_name( name[len(rel):] ) not in port_names:
+            return False
+
+    return True
+
+#-----------------------------------------------------------------------
+# _InputRecorder
+#-----------------------------------------------------------------------
+# Records the inputs of a subtree every cycle in the cycle_n stimulus
+# buffer layout (all input ports except clk, (nbits-1)/32+1 words each),
+# and replays them through the cycle_n method of its compiled model.
+class _InputRecorder( object ):
+
+  def __init__( self, model ):
+
+    self.names   = [ x.name for x in model.get_inports() if x.name != 'clk' ]
+    self.nwords  = [ ( x.nbits - 1 ) / 32 + 1 for x in model.get_inports()
+                     if x.name != 'clk' ]
+    self.buf     = array( 'I' )
+    self.ncycles = 0
+
+    self._svalues = [ x._signalvalue for x in model.get_inports()
+                      if x.name != 'clk' ]
+    self._narrow  = all( x == 1 for x in self.nwords )
+
+  def record( self ):
+
+    if self._narrow:
+      self.buf.extend( [ x.uint() for x in self._svalues ] )
+    else:
+      for svalue, nwords in zip( self._svalues, self.nwords ):
+        value = svalue.uint()
+        for i in range( nwords ):
+          self.buf.append( ( value >> 32*i ) & 0xffffffff )
+
+    self.ncycles += 1
+
+  def replay( self, compiled ):
+
+    if not self.ncycles:
+      return
+
+    # The compiled model may order its ports differently
+
+    names = [ x.name for x in compiled._cycle_n_inports ]
+    buf   = self.buf
+
+    if names != self.names:
+      offsets, offset = {}, 0
+      for name, nwords in zip( self.names, self.nwords ):
+        offsets[ name ] = ( offset, nwords )
+        offset += nwords
+      stride  = offset
+      columns = [ offsets[ name ] for name in names ]
+      buf     = array( 'I' )
+      for i in xrange( 0, len( self.buf ), stride ):
+        for offset, nwords in columns:
+          buf.extend( self.buf[ i+offset:i+offset+nwords ] )
+
+    compiled.cycle_n( self.ncycles, buf, None )
+
+#-----------------------------------------------------------------------
+# _TranslationWorker
+#-----------------------------------------------------------------------
+# Translates a fresh instance of a model, constructed with the same
+# arguments, as the simulated instance cannot be elaborated again.
+class _TranslationWorker( threading.Thread ):
+
+  def __init__( self, model, translate ):
+    super( _TranslationWorker, self ).__init__()
+    self.daemon     = True
+    self.model      = None
+    self.error      = None
+    self.done       = False
+    self._source    = model
+    self._translate = translate
+
+  def run( self ):
+    try:
+      model      = self._source
+      self.model = self._translate( model.__class__( **model._args ) )
+    except Exception as e:
+      self.error = e
+    self.done = True
+
+#-----------------------------------------------------------------------
+# Helpers
+#-----------------------------------------------------------------------
+
+def _subtree_models( model ):
+  models = [ model ]
+  for m in model.get_submodules():
+    models.extend( _subtree_models( m ) )
+  return models
+
+# Name of the attribute holding a port, e.g., in_ for in_[2] or enq for
+# enq.msg
+
+def _base_name( name ):
+  return name.split( '.' )[0].split( '[' )[0]
+
+# Name as it appears in the loads and stores found in logic blocks,
+# where list indices are replaced with [?]
+
+def _list_name( name ):
+  return name.split( '[' )[0] + '[?]' if '[' in name else name
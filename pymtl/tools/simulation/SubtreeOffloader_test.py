@@ -0,0 +1,188 @@
+#=======================================================================
+# SubtreeOffloader_test.py
+#=======================================================================
+
+import pytest
+import random
+import warnings
+
+from distutils.spawn import find_executable
+
+from pymtl import *
+
+from SubtreeOffloader import SubtreeOffloader
+
+requires_gxx = pytest.mark.skipif( not find_executable( 'g++' ),
+                                   reason='requires g++' )
+
+#-----------------------------------------------------------------------
+# Test Models
+#-----------------------------------------------------------------------
+
+class Stage( Model ):
+  def __init__( s, incr ):
+    s.in_ = InPort ( 16 )
+    s.out = OutPort( 16 )
+    s.sum = Wire   ( 16 )
+    @s.combinational
+    def comb():
+      s.sum.value = s.in_ + incr
+    @s.posedge_clk
+    def seq():
+      if s.reset: s.out.next = 0
+      else:       s.out.next = s.sum
+
+# RTL pipeline of stages
+
+class Hot( Model ):
+  def __init__( s, nstages ):
+    s.in_    = InPort ( 16 )
+    s.out    = OutPort( 16 )
+    s.stages = [ Stage( i+1 ) for i in range( nstages ) ]
+    s.connect( s.in_, s.stages[0].in_ )
+    for i in range( 1, nstages ):
+      s.connect( s.stages[i-1].out, s.stages[i].in_ )
+    s.last   = Wire( 16 )
+    s.connect( s.stages[-1].out, s.last )
+    @s.combinational
+    def comb():
+      s.out.value = s.last ^ s.in_
+
+# Cycle-level model, which cannot be offloaded
+
+class Cold( Model ):
+  def __init__( s ):
+    s.in_   = InPort ( 16 )
+    s.out   = OutPort( 16 )
+    s.count = 0
+    @s.tick_cl
+    def tick():
+      s.count += 1
+      s.out.next = s.in_ + s.count
+
+class Top( Model ):
+  def __init__( s ):
+    s.in_  = InPort ( 16 )
+    s.out  = OutPort( 16 )
+    s.hot  = Hot( 8 )
+    s.cold = Cold()
+    s.connect( s.in_,     s.hot.in_  )
+    s.connect( s.hot.out, s.cold.in_ )
+    s.connect( s.cold.out, s.out     )
+
+# Connects into the middle of Hot, so only its stages can be offloaded
+
+class Tapped( Model ):
+  def __init__( s ):
+    s.in_ = InPort ( 16 )
+    s.out = OutPort( 16 )
+    s.tap = OutPort( 16 )
+    s.hot = Hot( 2 )
+    s.connect( s.in_,     s.hot.in_ )
+    s.connect( s.hot.out, s.out     )
+    @s.combinational
+    def comb():
+      s.tap.value = s.hot.stages[0].out
+
+#-----------------------------------------------------------------------
+# simulate
+#-----------------------------------------------------------------------
+# Simulate the design with and without offloading on the same random
+# inputs, checking the outputs every cycle. Calls hook( sim ) every
+# cycle of the offloaded simulation.
+
+def simulate( model_class, offload, ncycles = 100, hook = None ):
+
+  ref = model_class()
+  ref.elaborate()
+  ref_sim = SimulationTool( ref )
+
+  dut = model_class()
+  dut.elaborate()
+  dut_sim = SimulationTool( dut, offload=offload )
+
+  ref_sim.reset()
+  dut_sim.reset()
+
+  rng = random.Random( 0x5eed )
+  for i in range( ncycles ):
+    ref.in_.value = dut.in_.value = rng.getrandbits( 16 )
+    ref_sim.eval_combinational()
+    dut_sim.eval_combinational()
+    assert dut.out == ref.out
+    ref_sim.cycle()
+    dut_sim.cycle()
+    if hook:
+      hook( dut_sim )
+
+  return dut_sim
+
+#-----------------------------------------------------------------------
+# test_candidates
+#-----------------------------------------------------------------------
+def test_candidates():
+
+  model = Top()
+  model.elaborate()
+  sim = SimulationTool( model )
+  assert SubtreeOffloader( sim ).candidates == [ 'top.hot' ]
+
+  model = Tapped()
+  model.elaborate()
+  sim = SimulationTool( model )
+  assert SubtreeOffloader( sim ).candidates == [ 'top.hot.stages[0]',
+                                                 'top.hot.stages[1]' ]
+
+  # Offloading has to start with the simulation
+
+  sim.reset()
+  with pytest.raises( ValueError ):
+    SubtreeOffloader( sim )
+
+#-----------------------------------------------------------------------
+# test_translation_error
+#-----------------------------------------------------------------------
+def test_translation_error():
+
+  def translate( model ):
+    raise Exception( 'no compiler' )
+
+  with warnings.catch_warnings( record=True ):
+    warnings.simplefilter( 'always' )
+    sim = simulate( Top, { 'profile_cycles' : 10, 'translate' : translate,
+                           'background' : False } )
+
+  # The design keeps simulating in Python
+
+  assert sim.offloader.selected      == [ 'top.hot' ]
+  assert sim.offloader.failed.keys() == [ 'top.hot' ]
+  assert sim.offloader.offloaded     == {}
+  assert sim.cycle.__name__ != '_offload_cycle'
+
+#-----------------------------------------------------------------------
+# test_offload
+#-----------------------------------------------------------------------
+@requires_gxx
+@pytest.mark.parametrize( 'background', [ False, True ] )
+def test_offload( monkeypatch, tmpdir, background ):
+
+  from pymtl.tools.translation import get_cpp
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+
+  # Without a background thread the model is swapped right after
+  # profiling, otherwise the simulation waits for it at cycle 50
+
+  def hook( sim ):
+    if sim.ncycles == 50:
+      sim.offloader.wait()
+      assert sim.offloader.offloaded.keys() == [ 'top.hot' ]
+
+  sim = simulate( Top, { 'profile_cycles' : 20, 'translate' : get_cpp,
+                         'background' : background }, hook=hook )
+
+  # None of the logic of the Python subtree is simulated anymore
+
+  assert len( sim._sequential_blocks ) == 2
+  assert sim.offloader.failed == {}
+  assert sim.cycle.__name__ != '_offload_cycle'
@@ -205,7 +205,10 @@ def register_seq_blocks( model ):
 # Register all decorated @combinational functions with the simulator.
 # Combinational logic blocks are registered with SignalValue objects
 # and get added to the event queue when values are updated.
-def register_comb_blocks( model, event_queue ):
+def register_comb_blocks( model, event_queue, metrics = None ):
+
+  if metrics:
+    metrics.reg_model( model )
 
   # Get the sensitivity list of each event driven (combinational) block
   # TODO: do before or after we swap value nodes?
@@ -227,7 +230,8 @@ def register_comb_blocks( model, event_queue ):
   for func_ptr, sensitivity_list in model._newsenses.items():
     func_ptr.id = event_queue.get_id()
     func_ptr.cb = func_ptr
-    #self.metrics.reg_eval( func_ptr.cb )
+    if metrics:
+      metrics.reg_eval( func_ptr.cb )
     for signal_value in sensitivity_list:
 
       # Only add "notify_sim" funcs if @comb blocks are sensitive to us
@@ -243,7 +247,7 @@ def register_comb_blocks( model, event_queue ):
 
   # Recursively perform for submodules
   for m in model.get_submodules():
-    register_comb_blocks( m, event_queue )
+    register_comb_blocks( m, event_queue, metrics )
 
 #-----------------------------------------------------------------------
 # _add_senses
@@ -315,7 +319,7 @@ def _attr_name_to_object( model, name ):
 # All ConnectionEdges that contain bit slicing need to be turned into
 # combinational blocks.  This significantly simplifies the connection
 # graph update logic.
-def create_slice_callbacks( slice_connects, event_queue ):
+def create_slice_callbacks( slice_connects, event_queue, metrics = None ):
 
   for c in slice_connects:
     src = c.src_node._signalvalue
@@ -334,7 +338,8 @@ def create_slice_callbacks( slice_connects, event_queue ):
       func_ptr.id = event_queue.get_id()
       func_ptr.cb = func_ptr
       event_queue.enq( func_ptr.cb, func_ptr.id )
-      #self.metrics.reg_eval( func_ptr.cb, is_slice = True )
+      if metrics:
+        metrics.reg_eval( func_ptr.cb, is_slice = True )
       #self._DEBUG_signal_cbs[ signal_value ].append( func_ptr )
 
 #-----------------------------------------------------------------------
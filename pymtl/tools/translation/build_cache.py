@@ -0,0 +1,295 @@
+#=======================================================================
+# build_cache.py
+#=======================================================================
+# Content-addressed cache for compiled simulation artifacts.
+#
+# Each cache entry is a directory named after a hash of everything that
+# went into the build (source code, tool flags, tool versions). Entries
+# are built in a private temporary directory and renamed into place once
+# complete, so readers never see a partial build. A lock file per entry
+# makes sure only one process builds a given entry while any others wait
+# and then reuse the result. Once the total size of the cache exceeds a
+# limit, the least recently used entries are evicted.
+#
+# The cache directory defaults to ~/.cache/pymtl (or $XDG_CACHE_HOME)
+# and can be changed with the PYMTL_CACHE_DIR environment variable. The
+# size limit, in megabytes, can be changed with PYMTL_CACHE_SIZE.
+#
+# Usage:
+#
+#   def build( build_dir ):
+#     ... write all artifacts into build_dir ...
+#
+#   cache = BuildCache()
+#   with cache.entry( hash_key( src, flags ), build ) as entry_dir:
+#     ... use the artifacts in entry_dir ...
+
+import errno
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+# Default size limit in megabytes
+
+DEFAULT_CACHE_SIZE = 4096
+
+# Temporary build directories older than this (in seconds) are assumed
+# to belong to a build which was killed and are removed on eviction
+
+STALE_BUILD_AGE    = 24*60*60
+
+#-----------------------------------------------------------------------
+# get_cache_dir
+#-----------------------------------------------------------------------
+def get_cache_dir():
+
+  path = os.environ.get( 'PYMTL_CACHE_DIR' )
+  if not path:
+    base = os.environ.get( 'XDG_CACHE_HOME' ) or \
+           os.path.join( os.path.expanduser( '~' ), '.cache' )
+    path = os.path.join( base, 'pymtl' )
+
+  return os.path.abspath( path )
+
+#-----------------------------------------------------------------------
+# get_cache_size
+#-----------------------------------------------------------------------
+# Returns the cache size limit in bytes.
+def get_cache_size():
+  return int( os.environ.get( 'PYMTL_CACHE_SIZE', DEFAULT_CACHE_SIZE ) ) \
+         * 1024 * 1024
+
+#-----------------------------------------------------------------------
+# get_build_jobs
+#-----------------------------------------------------------------------
+# Maximum number of build jobs (compiles, translations) to run in
+# parallel, from PYMTL_BUILD_JOBS or one per core.
+def get_build_jobs():
+  jobs = int( os.environ.get( 'PYMTL_BUILD_JOBS', 0 ) )
+  return jobs if jobs > 0 else multiprocessing.cpu_count()
+
+#-----------------------------------------------------------------------
+# hash_key
+#-----------------------------------------------------------------------
+# Hashes all the given parts into a single cache key.
+def hash_key( *parts ):
+
+  h = hashlib.sha1()
+  for part in parts:
+    h.update( str( part ) )
+    h.update( '\0' )
+
+  return h.hexdigest()
+
+#-----------------------------------------------------------------------
+# file_lock
+#-----------------------------------------------------------------------
+# Holds an exclusive lock on the given lock file. If blocking is False
+# and the lock is held by someone else, yields False instead of waiting.
+# The holder of the lock may remove the lock file, in which case anyone
+# who was waiting for it locks the new file instead.
+@contextmanager
+def file_lock( path, blocking=True ):
+
+  while True:
+
+    fd = os.open( path, os.O_RDWR | os.O_CREAT, 0666 )
+    try:
+      fcntl.flock( fd, fcntl.LOCK_EX | ( 0 if blocking else fcntl.LOCK_NB ) )
+    except IOError as e:
+      os.close( fd )
+      if blocking or e.errno not in ( errno.EAGAIN, errno.EACCES ):
+        raise
+      yield False
+      return
+
+    try:
+      if os.fstat( fd ).st_ino == os.stat( path ).st_ino:
+        break
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        os.close( fd )
+        raise
+
+    os.close( fd )
+
+  try:
+    yield True
+  finally:
+    fcntl.flock( fd, fcntl.LOCK_UN )
+    os.close( fd )
+
+#-----------------------------------------------------------------------
+# write_file_atomic
+#-----------------------------------------------------------------------
+# Writes data to a temporary file next to filename and renames it into
+# place, so that concurrent readers see either the old or the new file.
+def write_file_atomic( filename, data ):
+
+  dirname = os.path.dirname( os.path.abspath( filename ) )
+  fd, temp_file = tempfile.mkstemp( dir=dirname,
+                                    prefix='.'+os.path.basename( filename ) )
+  try:
+    with os.fdopen( fd, 'w' ) as fp:
+      fp.write( data )
+    os.chmod( temp_file, 0644 )
+    os.rename( temp_file, filename )
+  except:
+    os.remove( temp_file )
+    raise
+
+#-----------------------------------------------------------------------
+# BuildCache
+#-----------------------------------------------------------------------
+class BuildCache( object ):
+
+  def __init__( self, path=None, max_size=None ):
+
+    self.path     = path     or get_cache_dir()
+    self.max_size = max_size if max_size is not None else get_cache_size()
+
+    try:
+      os.makedirs( self.path )
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+  #---------------------------------------------------------------------
+  # entry
+  #---------------------------------------------------------------------
+  # Yields the directory of the entry for key, calling build with a
+  # fresh directory to create it first if it is not cached. The entry is
+  # locked (and so will not be evicted) until the with block exits.
+  @contextmanager
+  def entry( self, key, build ):
+
+    with file_lock( self._lock_file( key ) ):
+
+      entry_dir = self.lookup( key )
+      built     = entry_dir is None
+      if built:
+        entry_dir = self._commit( key, build )
+
+      yield entry_dir
+
+    if built:
+      self.evict()
+
+  #---------------------------------------------------------------------
+  # lookup
+  #---------------------------------------------------------------------
+  # Returns the directory of the entry for key, or None if there is no
+  # such entry. Marks the entry as recently used.
+  def lookup( self, key ):
+
+    entry_dir = os.path.join( self.path, key )
+    if not os.path.isdir( entry_dir ):
+      return None
+
+    os.utime( entry_dir, None )
+    return entry_dir
+
+  #---------------------------------------------------------------------
+  # evict
+  #---------------------------------------------------------------------
+  # Removes least recently used entries until the cache is no larger
+  # than max_size. Entries which are locked are skipped, as are
+  # directories starting with an underscore, which hold nested caches
+  # (e.g., translated Verilog) that are evicted on their own. The lock
+  # files of evicted entries (and of failed builds) are removed too.
+  def evict( self ):
+
+    with file_lock( os.path.join( self.path, '.evict.lock' ) ):
+
+      now     = time.time()
+      entries = []
+      total   = 0
+
+      for name in os.listdir( self.path ):
+        path = os.path.join( self.path, name )
+        if not os.path.isdir( path ):
+          if name.endswith( '.lock' ) and name != '.evict.lock' and \
+             not os.path.isdir( os.path.join( self.path, name[1:-5] ) ):
+            self._remove_lock_file( name[1:-5] )
+          continue
+
+        if name.startswith( '.' ):
+          if now - os.path.getmtime( path ) > STALE_BUILD_AGE:
+            shutil.rmtree( path, ignore_errors=True )
+          continue
+
+        if name.startswith( '_' ):
+          continue
+
+        size   = _dir_size( path )
+        total += size
+        entries.append( ( os.path.getmtime( path ), name, size ) )
+
+      for mtime, name, size in sorted( entries ):
+        if total <= self.max_size:
+          break
+        with file_lock( self._lock_file( name ), blocking=False ) as locked:
+          if locked:
+            shutil.rmtree( os.path.join( self.path, name ),
+                           ignore_errors=True )
+            os.remove( self._lock_file( name ) )
+            total -= size
+
+  #---------------------------------------------------------------------
+  # clear
+  #---------------------------------------------------------------------
+  # Removes every entry from the cache.
+  def clear( self ):
+    max_size, self.max_size = self.max_size, -1
+    try:
+      self.evict()
+    finally:
+      self.max_size = max_size
+
+  #---------------------------------------------------------------------
+  # _commit
+  #---------------------------------------------------------------------
+  # Builds an entry in a temporary directory and renames it into place.
+  def _commit( self, key, build ):
+
+    entry_dir = os.path.join( self.path, key )
+    build_dir = tempfile.mkdtemp( dir=self.path, prefix='.'+key[:8]+'-' )
+
+    try:
+      build( build_dir )
+      os.chmod( build_dir, 0755 )
+      os.rename( build_dir, entry_dir )
+    except:
+      shutil.rmtree( build_dir, ignore_errors=True )
+      raise
+
+    return entry_dir
+
+  def _lock_file( self, key ):
+    return os.path.join( self.path, '.' + key + '.lock' )
+
+  # Removes the lock file of key unless someone holds the lock
+
+  def _remove_lock_file( self, key ):
+    with file_lock( self._lock_file( key ), blocking=False ) as locked:
+      if locked and not os.path.isdir( os.path.join( self.path, key ) ):
+        os.remove( self._lock_file( key ) )
+
+#-----------------------------------------------------------------------
+# _dir_size
+#-----------------------------------------------------------------------
+def _dir_size( path ):
+  size = 0
+  for dirpath, dirnames, filenames in os.walk( path ):
+    for filename in filenames:
+      try:
+        size += os.lstat( os.path.join( dirpath, filename ) ).st_size
+      except OSError:
+        pass
+  return size
@@ -0,0 +1,184 @@
+#=======================================================================
+# build_cache_test.py
+#=======================================================================
+
+import os
+import time
+import pytest
+import multiprocessing
+
+from build_cache import BuildCache, hash_key, file_lock, get_cache_dir
+from build_cache import write_file_atomic
+
+#-----------------------------------------------------------------------
+# Helpers
+#-----------------------------------------------------------------------
+
+def mk_build( log, data='x' ):
+  def build( build_dir ):
+    log.append( build_dir )
+    with open( os.path.join( build_dir, 'out' ), 'w' ) as fp:
+      fp.write( data )
+  return build
+
+def read_entry( cache, key, build ):
+  with cache.entry( key, build ) as entry_dir:
+    with open( os.path.join( entry_dir, 'out' ) ) as fp:
+      return fp.read()
+
+#-----------------------------------------------------------------------
+# test_hash_key
+#-----------------------------------------------------------------------
+def test_hash_key():
+  assert hash_key( 'a', 1, True ) == hash_key( 'a', 1, True )
+  assert hash_key( 'a', 1, True ) != hash_key( 'a', 1, False )
+  assert hash_key( 'ab', 'c' )    != hash_key( 'a', 'bc' )
+
+#-----------------------------------------------------------------------
+# test_cache_dir
+#-----------------------------------------------------------------------
+def test_cache_dir( monkeypatch, tmpdir ):
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+  assert get_cache_dir() == str( tmpdir )
+  monkeypatch.delenv( 'PYMTL_CACHE_DIR' )
+  monkeypatch.setenv( 'XDG_CACHE_HOME', str( tmpdir ) )
+  assert get_cache_dir() == str( tmpdir.join( 'pymtl' ) )
+
+#-----------------------------------------------------------------------
+# test_build_once
+#-----------------------------------------------------------------------
+def test_build_once( tmpdir ):
+  cache = BuildCache( str( tmpdir ) )
+  log   = []
+  key   = hash_key( 'model' )
+
+  assert cache.lookup( key ) is None
+  assert read_entry( cache, key, mk_build( log ) ) == 'x'
+  assert read_entry( cache, key, mk_build( log ) ) == 'x'
+  assert len( log ) == 1
+  assert cache.lookup( key ) == str( tmpdir.join( key ) )
+
+  # A new cache object (e.g., in another process) reuses the entry
+  assert read_entry( BuildCache( str( tmpdir ) ), key, mk_build( log ) ) == 'x'
+  assert len( log ) == 1
+
+#-----------------------------------------------------------------------
+# test_failed_build
+#-----------------------------------------------------------------------
+def test_failed_build( tmpdir ):
+  cache = BuildCache( str( tmpdir ) )
+  key   = hash_key( 'model' )
+
+  def build( build_dir ):
+    open( os.path.join( build_dir, 'partial' ), 'w' ).close()
+    raise ValueError( 'compile error' )
+
+  with pytest.raises( ValueError ):
+    with cache.entry( key, build ):
+      pass
+
+  assert cache.lookup( key ) is None
+  assert [ x for x in os.listdir( str( tmpdir ) )
+           if os.path.isdir( str( tmpdir.join( x ) ) ) ] == []
+
+  # The lock file left behind is removed on eviction
+  cache.evict()
+  assert not tmpdir.join( '.' + key + '.lock' ).check()
+
+#-----------------------------------------------------------------------
+# test_lru_eviction
+#-----------------------------------------------------------------------
+def test_lru_eviction( tmpdir ):
+  cache = BuildCache( str( tmpdir ), max_size=2500 )
+  log   = []
+
+  for i, key in enumerate( 'abc' ):
+    read_entry( cache, key, mk_build( log, 'x'*1000 ) )
+    os.utime( cache.lookup( key ), ( i, i ) )
+
+  # Adding the third entry went over the limit so 'a' was evicted, along
+  # with its lock file
+  assert cache.lookup( 'a' ) is None
+  assert not tmpdir.join( '.a.lock' ).check()
+
+  # Use 'b' so that 'c' is the least recently used
+  os.utime( cache.lookup( 'b' ), None )
+  read_entry( cache, 'd', mk_build( log, 'x'*1000 ) )
+  assert cache.lookup( 'c' ) is None
+  assert cache.lookup( 'b' ) and cache.lookup( 'd' )
+
+  # Locked entries are never evicted
+  with cache.entry( 'b', mk_build( log ) ):
+    cache.clear()
+    assert cache.lookup( 'b' )
+    assert cache.lookup( 'd' ) is None
+    assert tmpdir.join( '.b.lock' ).check()
+    assert not tmpdir.join( '.d.lock' ).check()
+
+#-----------------------------------------------------------------------
+# test_concurrent_build
+#-----------------------------------------------------------------------
+def build_in_process( path ):
+  def build( build_dir ):
+    with open( os.path.join( path, 'log' ), 'a' ) as fp:
+      fp.write( 'built\n' )
+    time.sleep( 0.1 )
+    with open( os.path.join( build_dir, 'out' ), 'w' ) as fp:
+      fp.write( 'x' )
+  return read_entry( BuildCache( path ), 'key', build )
+
+def test_concurrent_build( tmpdir ):
+  pool    = multiprocessing.Pool( 4 )
+  results = pool.map( build_in_process, [ str( tmpdir ) ]*4 )
+  pool.close()
+  pool.join()
+  assert results == [ 'x' ]*4
+  assert tmpdir.join( 'log' ).read() == 'built\n'
+
+#-----------------------------------------------------------------------
+# test_file_lock
+#-----------------------------------------------------------------------
+def test_file_lock( tmpdir ):
+  lock = str( tmpdir.join( 'lock' ) )
+  with file_lock( lock ) as locked:
+    assert locked
+    # flock locks belong to the open file, so a second open conflicts
+    with file_lock( lock, blocking=False ) as locked:
+      assert not locked
+  with file_lock( lock, blocking=False ) as locked:
+    assert locked
+
+  # Waiting for a lock file which its holder removes locks the new file
+
+  import threading
+
+  held = threading.Event()
+  done = threading.Event()
+  def wait_for_lock():
+    with file_lock( lock ):
+      held.set()
+      done.wait()
+
+  with file_lock( lock ):
+    thread = threading.Thread( target=wait_for_lock )
+    thread.start()
+    time.sleep( 0.1 )
+    os.remove( lock )
+
+  try:
+    held.wait( 10 )
+    with file_lock( lock, blocking=False ) as locked:
+      assert not locked
+  finally:
+    done.set()
+    thread.join()
+
+#-----------------------------------------------------------------------
+# test_write_file_atomic
+#-----------------------------------------------------------------------
+def test_write_file_atomic( tmpdir ):
+  filename = str( tmpdir.join( 'Foo.v' ) )
+  write_file_atomic( filename, 'module Foo;' )
+  write_file_atomic( filename, 'module Bar;' )
+  assert tmpdir.join( 'Foo.v' ).read() == 'module Bar;'
+  assert os.listdir( str( tmpdir ) ) == [ 'Foo.v' ]
@@ -7,11 +7,15 @@ from pymtl                   import *
 from cpp_helpers             import gen_cheader, gen_cdef, gen_pywrapper
 from ..ast_helpers           import get_method_ast, print_simple_ast, print_ast
 from ...datatypes.SignalValue import SignalValueWrapper
+from ...model.signals        import Constant
 from ..simulation            import sim_utils
+from ..simulation.ast_visitor import DetectLoadsAndStores
 
 import sys
 import ast, _ast
 import collections
+import heapq
+import operator
 import StringIO
 import re
 
@@ -20,28 +24,39 @@ compiler = "g++ -O3 -fPIC -shared -o {libname} {csource}"
 #-----------------------------------------------------------------------
 # CLogicTransl
 #-----------------------------------------------------------------------
+# Translates the whole design into a native simulator. Every net becomes
+# a C variable, @tick/@posedge_clk blocks become functions writing
+# double-buffered _next variables, and @combinational blocks and slice
+# connections are evaluated once per eval_comb() call in a static
+# topological order computed from their load/store sets.
+#
 # TODO: same as Verilog, reduce code dup
 def CLogicTransl( model, o=sys.stdout ):
 
     c_functions = StringIO.StringIO()
     c_variables = StringIO.StringIO()
 
-    signals    = sim_utils.collect_signals( model )
-    nets, _    = sim_utils.signals_to_nets( signals )
-    seq_blocks = sim_utils.register_seq_blocks( model )
+    signals     = sim_utils.collect_signals( model )
+    nets, slice_connects = sim_utils.signals_to_nets( signals )
+    # Number the nets in a stable order, so that the same design always
+    # generates the same code (which is what get_cpp caches builds by)
+    nets        = sorted( nets, key=lambda n: sorted( map( net_member_name, n ) ) )
+    seq_blocks  = sim_utils.register_seq_blocks( model )
+    comb_blocks = collect_comb_blocks( model )
     # TODO: update translation so that this is unneeded?
     sim_utils.insert_signal_values( None, nets )
 
-    # Visit tick functions, save register information
+    # Visit tick and combinational functions, save register information
     ast_next  = []
     localvars = {}
-    for func in seq_blocks:
+    for func in seq_blocks + comb_blocks:
       r, l = translate_func( func, c_functions )
       ast_next.extend( r )
       localvars.update( l )
 
     # Print signal declarations, use reg information
-    top_ports, all_ports, shadows = declare_signals(nets, ast_next, c_variables)
+    top_ports, all_ports, shadows = declare_signals(nets, ast_next, c_variables,
+                                                    model.get_ports())
 
     inport_names   = ['top_'+mangle_name(x.name) for x in model.get_inports() ]
     outport_names  = ['top_'+mangle_name(x.name) for x in model.get_outports()]
@@ -61,11 +76,16 @@ def CLogicTransl( model, o=sys.stdout ):
       #else:
       #    raise Exception("Unknown port detected!")
 
+    # Order the combinational logic
+    net_ids  = dict( ( id( list( n )[0]._signalvalue ), i )
+                     for i, n in enumerate( nets ) )
+    schedule = schedule_comb_blocks( comb_blocks, slice_connects, net_ids )
+
     # print locals
     print >> c_variables
     print >> c_variables, '/* LOCALS ' + '-'*60 + '*/'
-    for var, obj in localvars.items():
-      rvar = var.replace('.','_')
+    for var, obj in sorted( localvars.items() ):
+      rvar = c_var( var )
       if rvar not in all_ports:
         if   isinstance( obj, int ):
           var_type = get_type( obj, o )
@@ -75,7 +95,7 @@ def CLogicTransl( model, o=sys.stdout ):
           var_type = get_type( obj[0], o )
           split = var.split('.')
           pfx = '_'.join( split[0:2] )
-          sfx = '_'+'_'.join( split[2:]  ) if split[2:] else ''
+          sfx = c_var( '.'+'.'.join( split[2:] ) ) if split[2:] else ''
           vx = [ '&{}_IDX{:03}{}'.format(pfx,i,sfx) for i in range(len(obj)) ]
           # Declare the variables if they don't exist yet
           for x in vx:
@@ -97,6 +117,7 @@ def CLogicTransl( model, o=sys.stdout ):
 
     # Create the C header
     print >> o, '#include <stdio.h>'
+    print >> o, '#include <stdint.h>'
     print >> o, '#include <assert.h>'
     print >> o, '#include <queue>'
     print >> o, '#define  True  true'
@@ -109,74 +130,471 @@ def CLogicTransl( model, o=sys.stdout ):
 
     print   >> o, 'unsigned int ncycles;\n\n'
 
-    # Create the cycle function
-    print   >> o, '/* cycle */'
-    print   >> o, 'void cycle({}) {{'.format( '\n'+params+'\n' )
-
-    # Set input ports from params
+    # Create the function evaluating all combinational logic
+    print   >> o, '/* eval_comb */'
+    print   >> o, 'void eval_comb() {'
+    for kind, x in schedule:
+      if kind != 'loop':
+        print >> o, '  {}'.format( comb_stmt( kind, x, net_ids ) )
+        continue
+      # Blocks on a combinational loop are evaluated until they settle
+      members, nets = x
+      nets = [ 'net_{:05}'.format( i ) for i in nets ]
+      print   >> o, '  while ( true ) {'
+      print   >> o, '    unsigned long long prev[] = {{ {} }};'.format( ', '.join( nets ) )
+      for kind, y in members:
+        print >> o, '    {}'.format( comb_stmt( kind, y, net_ids ) )
+      print   >> o, '    if ( {} ) break;'.format( ' && '.join(
+                      '{} == prev[{}]'.format( n, i ) for i, n in enumerate( nets ) ) )
+      print   >> o, '  }'
+    print   >> o, '}'
     print   >> o
-    print   >> o, '  /* Set inports */'
+
+    # Create the function copying the inputs into the design
+    print   >> o, '/* set_inports */'
+    print   >> o, 'void set_inports({}) {{'.format( '\n'+params+'\n' )
     print   >> o, '  top_clk   = _top_clk;'
     print   >> o, '  top_reset = _top_reset;'
     for name, _, _ in top_inports[2:]:
       print >> o, '  {} = top->{};'.format( name, name[4:] )
+    print   >> o, '}'
+    print   >> o
+
+    # Create the function copying the outputs out of the design
+    print   >> o, '/* set_outports */'
+    print   >> o, 'void set_outports( iface_t * top ) {'
+    for name, _, _ in top_outports:
+      print >> o, '  top->{} = {};'.format( name[4:], name )
+    print   >> o, '}'
+    print   >> o
+
+    # Create the eval function, which only settles the combinational
+    # logic for the current inputs
+    print   >> o, '/* eval */'
+    print   >> o, 'void eval({}) {{'.format( '\n'+params+'\n' )
+    print   >> o, '  set_inports( _top_clk, _top_reset, top );'
+    print   >> o, '  eval_comb();'
+    print   >> o, '  set_outports( top );'
+    print   >> o, '}'
+    print   >> o
+
+    # Create the function for a clock edge
+    print   >> o, '/* tick */'
+    print   >> o, 'void tick() {'
 
     # Execute all ticks
     print   >> o
     print   >> o, '  /* Execute all ticks */'
     for x in seq_blocks:
-      print >> o, '  {}_{}();'.format( mangle_idxs(x._model.name), x.func_name)
+      print >> o, '  {}_{}();'.format( model_cname( x._model ), x.func_name )
     print   >> o, '  ncycles++;'
 
     # Update all registers
     print   >> o
     print   >> o, '  /* Update all registers */'
     for s in shadows:
-      print >> o, '  {0} = {0}_next;'.format( s )
+      print >> o, '  {0} = {0}__next;'.format( s )
+
+    print   >> o
+    print   >> o, '  eval_comb();'
+    print   >> o, '}'
+    print   >> o
+
+    # Create the cycle function
+    print   >> o, '/* cycle */'
+    print   >> o, 'void cycle({}) {{'.format( '\n'+params+'\n' )
+
+    # Set input ports from params
+    print   >> o
+    print   >> o, '  /* Set inports */'
+    print   >> o, '  set_inports( _top_clk, _top_reset, top );'
+    print   >> o, '  eval_comb();'
+    print   >> o
+    print   >> o, '  tick();'
 
     # Update params from output ports
     print   >> o
     print   >> o, '  /* Assign all outputs */'
-    for name, _, _ in top_outports:
-      print >> o, '  top->{} = {};'.format( name[4:], name )
+    print   >> o, '  set_outports( top );'
 
     print   >> o, '}'
     print   >> o
 
+    # Create the function simulating many cycles without returning to
+    # Python. Each cycle, the inputs are read from the stimulus buffer,
+    # the combinational logic is evaluated, the outputs are written to
+    # the response buffer and then the clock edge is simulated. Every
+    # port takes (nbits-1)/32+1 consecutive 32-bit words in the buffers,
+    # in the order of get_cycle_n_ports. Without a stimulus buffer the
+    # inputs in top are used for every cycle.
+    cycle_n_inports, cycle_n_outports = get_cycle_n_ports( model )
+    nin_words  = sum( num_words( x ) for x in cycle_n_inports  )
+    nout_words = sum( num_words( x ) for x in cycle_n_outports )
+
+    print   >> o, '/* cycle_n */'
+    print   >> o, 'void cycle_n( unsigned int n, const uint32_t * in, uint32_t * out,'
+    print   >> o, '              iface_t * top ) {'
+    print   >> o
+    print   >> o, '  if ( !in )'
+    print   >> o, '    set_inports( top_clk, top_reset, top );'
+    print   >> o
+    print   >> o, '  for ( unsigned int i = 0; i < n; i++ ) {'
+    print   >> o, '    if ( in ) {'
+    for stmt in buffer_copy_stmts( cycle_n_inports, 'in' ):
+      print >> o, '      ' + stmt
+    print   >> o, '      in += {};'.format( nin_words )
+    print   >> o, '    }'
+    print   >> o, '    eval_comb();'
+    print   >> o, '    if ( out ) {'
+    for stmt in buffer_copy_stmts( cycle_n_outports, 'out' ):
+      print >> o, '      ' + stmt
+    print   >> o, '      out += {};'.format( nout_words )
+    print   >> o, '    }'
+    print   >> o, '    tick();'
+    print   >> o, '  }'
+    print   >> o
+    print   >> o, '  set_outports( top );'
+    print   >> o, '}'
+    print   >> o
+
     # Create the cdef and Python wrapper
     cdef        = gen_cdef( params, top_ports[2:] )
-    CSimWrapper = gen_pywrapper( top_inports, top_outports )
+    CSimWrapper = gen_pywrapper( top_inports, top_outports,
+                                 [ x.name for x in cycle_n_inports  ],
+                                 [ x.name for x in cycle_n_outports ] )
 
     return cdef, CSimWrapper
 
+#-----------------------------------------------------------------------
+# get_cycle_n_ports
+#-----------------------------------------------------------------------
+# Returns the input and output ports of the model in the order they are
+# laid out in the cycle_n stimulus and response buffers (the same as for
+# Verilated models, so both work with BatchSimulationTool).
+def get_cycle_n_ports( model ):
+  inports = [ x for x in model.get_inports() if x.name != 'clk' ]
+  return inports, model.get_outports()
+
+#-----------------------------------------------------------------------
+# num_words
+#-----------------------------------------------------------------------
+# Number of 32-bit words a port takes in the cycle_n buffers.
+def num_words( port ):
+  return ( port.nbits - 1 ) / 32 + 1
+
+#-----------------------------------------------------------------------
+# buffer_copy_stmts
+#-----------------------------------------------------------------------
+# C statements copying ports from (direction 'in') or to (direction
+# 'out') a cycle_n buffer.
+def buffer_copy_stmts( ports, direction ):
+
+  stmts = []
+  idx   = 0
+
+  for port in ports:
+    name = signal_cname( port )
+
+    if direction == 'in':
+      if num_words( port ) == 1:
+        stmts.append( '{} = in[{}];'.format( name, idx ) )
+      else:
+        stmts.append( '{} = in[{}] | ( (uint64_t) in[{}] << 32 );'
+                      .format( name, idx, idx+1 ) )
+    else:
+      stmts.append( 'out[{}] = (uint32_t) {};'.format( idx, name ) )
+      if num_words( port ) == 2:
+        stmts.append( 'out[{}] = (uint32_t) ( {} >> 32 );'
+                      .format( idx+1, name ) )
+
+    idx += num_words( port )
+
+  return stmts
+
+#-----------------------------------------------------------------------
+# collect_comb_blocks
+#-----------------------------------------------------------------------
+# Return the @combinational blocks of the model and all its submodels.
+def collect_comb_blocks( model ):
+  blocks = list( model.get_combinational_blocks() )
+  for m in model.get_submodules():
+    blocks.extend( collect_comb_blocks( m ) )
+  return blocks
+
+#-----------------------------------------------------------------------
+# schedule_comb_blocks
+#-----------------------------------------------------------------------
+# Statically order the combinational blocks and slice connections so
+# that each one comes after everything writing the nets it reads, which
+# lets a single pass settle all the combinational logic. Returns a list
+# of ('block', func) and ('slice', connection) tuples. Blocks reading
+# each other's outputs (this also happens without a real combinational
+# loop, since dependencies are tracked per net and not per bit) are
+# grouped into a ('loop', (members, nets)) tuple, to be evaluated until
+# the nets they write stop changing. Ties are broken by the original
+# order to keep the generated code deterministic.
+def schedule_comb_blocks( comb_blocks, slice_connects, net_ids ):
+
+  nodes  = []
+  loads  = []
+  stores = []
+
+  for func in comb_blocks:
+    tree, _ = get_method_ast( func )
+    l, s    = DetectLoadsAndStores().enter( tree )
+    nodes .append( ( 'block', func ) )
+    loads .append( signal_nets( func._model, l, net_ids ) )
+    stores.append( signal_nets( func._model, s, net_ids ) )
+
+  for c in sorted( slice_connects, key=lambda c: ( signal_cname( c.dest_node ),
+                                                   str( c.dest_slice ) ) ):
+    src = c.src_node._signalvalue
+    nodes .append( ( 'slice', c ) )
+    loads .append( set() if isinstance( src, int ) else
+                   set([ net_ids[ id( src ) ] ]) )
+    stores.append( set([ net_ids[ id( c.dest_node._signalvalue ) ] ]) )
+
+  writers = collections.defaultdict( list )
+  for i, nets in enumerate( stores ):
+    for net in nets:
+      writers[ net ].append( i )
+
+  succs = [ set() for _ in nodes ]
+  for j, nets in enumerate( loads ):
+    for net in nets:
+      for i in writers[ net ]:
+        if i != j:
+          succs[ i ].add( j )
+
+  # Order the groups of blocks on loops, each represented by its first
+  # block
+
+  sccs, comp = strongly_connected( succs )
+
+  csuccs = [ set() for _ in sccs ]
+  npreds = [ 0 ] * len( sccs )
+  for i, js in enumerate( succs ):
+    for j in js:
+      if comp[ i ] != comp[ j ] and comp[ j ] not in csuccs[ comp[ i ] ]:
+        csuccs[ comp[ i ] ].add( comp[ j ] )
+        npreds[ comp[ j ] ] += 1
+
+  ready = [ ( min( x ), c ) for c, x in enumerate( sccs ) if not npreds[ c ] ]
+  heapq.heapify( ready )
+
+  schedule = []
+  while ready:
+    _, c = heapq.heappop( ready )
+    members = sorted( sccs[ c ] )
+    if len( members ) == 1:
+      schedule.append( nodes[ members[0] ] )
+    else:
+      nets = sorted( set.union( *[ stores[ i ] for i in members ] ) )
+      schedule.append( ( 'loop', ( [ nodes[ i ] for i in members ], nets ) ) )
+    for d in csuccs[ c ]:
+      npreds[ d ] -= 1
+      if not npreds[ d ]:
+        heapq.heappush( ready, ( min( sccs[ d ] ), d ) )
+
+  return schedule
+
+#-----------------------------------------------------------------------
+# strongly_connected
+#-----------------------------------------------------------------------
+# Kosaraju's algorithm (iterative, since designs can have long chains of
+# blocks). Returns the list of strongly connected components and the
+# index of the component of each node.
+def strongly_connected( succs ):
+
+  # Order the nodes by finishing time of a depth-first search
+
+  order = []
+  seen  = [ False ] * len( succs )
+  for root in range( len( succs ) ):
+    if seen[ root ]:
+      continue
+    seen[ root ] = True
+    stack = [ ( root, iter( sorted( succs[ root ] ) ) ) ]
+    while stack:
+      node, children = stack[-1]
+      for child in children:
+        if not seen[ child ]:
+          seen[ child ] = True
+          stack.append( ( child, iter( sorted( succs[ child ] ) ) ) )
+          break
+      else:
+        stack.pop()
+        order.append( node )
+
+  # Collect the components by searching the reversed graph
+
+  preds = [ [] for _ in succs ]
+  for i, js in enumerate( succs ):
+    for j in js:
+      preds[ j ].append( i )
+
+  sccs = []
+  comp = [ None ] * len( succs )
+  for root in reversed( order ):
+    if comp[ root ] is not None:
+      continue
+    comp[ root ] = len( sccs )
+    members      = [ root ]
+    stack        = [ root ]
+    while stack:
+      for j in preds[ stack.pop() ]:
+        if comp[ j ] is None:
+          comp[ j ] = comp[ root ]
+          members.append( j )
+          stack.append( j )
+    sccs.append( members )
+
+  return sccs, comp
+
+#-----------------------------------------------------------------------
+# comb_stmt
+#-----------------------------------------------------------------------
+# Generate the statement evaluating a block or slice connection.
+def comb_stmt( kind, x, net_ids ):
+  if kind == 'block':
+    return '{}_{}();'.format( model_cname( x._model ), x.func_name )
+  return slice_assign( x, net_ids )
+
+#-----------------------------------------------------------------------
+# signal_nets
+#-----------------------------------------------------------------------
+# Map the names of signals accessed in a block (as collected by
+# DetectLoadsAndStores) to the indices of their nets.
+def signal_nets( model, names, net_ids ):
+
+  nets = set()
+
+  def add( name ):
+    obj = sim_utils._attr_name_to_object( model, name )
+    # Lists inside of for loops, add every item
+    if   isinstance( obj, tuple ):
+      obj_list, list_name, attr = obj
+      for i in range( len( obj_list ) ):
+        add( "{}[{}]{}".format( list_name, i, attr ) )
+    elif obj is not None and id( obj._target_bits ) in net_ids:
+      nets.add( net_ids[ id( obj._target_bits ) ] )
+
+  for name in names:
+    add( name )
+
+  return nets
+
+#-----------------------------------------------------------------------
+# slice_assign
+#-----------------------------------------------------------------------
+# Generate the statement implementing a connection involving slices.
+def slice_assign( c, net_ids ):
+
+  dest     = 'net_{:05}'.format( net_ids[ id( c.dest_node._signalvalue ) ] )
+  lo, nbits = slice_bounds( c.dest_slice, c.dest_node.nbits )
+
+  src = c.src_node._signalvalue
+  if isinstance( src, int ):
+    value = '{}ULL'.format( src )
+  else:
+    src_lo, _ = slice_bounds( c.src_slice, c.src_node.nbits )
+    value = '( net_{:05} >> {} )'.format( net_ids[ id( src ) ], src_lo )
+
+  return '{0} = ( {0} & ~( {1} << {2} ) ) | ( ( {3} & {1} ) << {2} );' \
+         .format( dest, c_mask( nbits ), lo, value )
+
+#-----------------------------------------------------------------------
+# slice_bounds
+#-----------------------------------------------------------------------
+# Return the lowest bit and the width of a slice given to a connection.
+def slice_bounds( addr, nbits ):
+  if   addr is None:
+    return 0, nbits
+  elif isinstance( addr, slice ):
+    lo = addr.start if addr.start is not None else 0
+    hi = addr.stop  if addr.stop  is not None else nbits
+    return lo, hi - lo
+  else:
+    return addr, 1
+
+#-----------------------------------------------------------------------
+# c_mask
+#-----------------------------------------------------------------------
+def c_mask( nbits ):
+  return '0x{:x}ULL'.format( ( 1 << nbits ) - 1 )
+
+#-----------------------------------------------------------------------
+# model_cname
+#-----------------------------------------------------------------------
+# Prefix for the C names of everything inside a model, built from the
+# instance names of the whole hierarchy so that submodels with the same
+# instance name in different parents don't clash. Levels are separated
+# by a double underscore so that the signal top.x.a_b and the signal
+# top.x.a.b get different names.
+def model_cname( model ):
+  name = mangle_name( model.name )
+  if model.parent is not None:
+    name = model_cname( model.parent ) + '__' + name
+  return name
+
+#-----------------------------------------------------------------------
+# net_member_name
+#-----------------------------------------------------------------------
+def net_member_name( signal ):
+  if isinstance( signal, Constant ):
+    return signal.name
+  return signal_cname( signal )
+
+#-----------------------------------------------------------------------
+# c_var
+#-----------------------------------------------------------------------
+# C name of a variable accessed in a block. The next value of a register
+# gets a double underscore so it can't clash with a signal named *_next.
+def c_var( name ):
+  if name.endswith('.next'):
+    return name[:-5].replace('.','_') + '__next'
+  return name.replace('.','_')
+
+#-----------------------------------------------------------------------
+# signal_cname
+#-----------------------------------------------------------------------
+def signal_cname( signal ):
+  return model_cname( signal.parent ) + '_' + mangle_name( signal.name )
 
 #-----------------------------------------------------------------------
 # declare_signals
 #-----------------------------------------------------------------------
-def declare_signals( nets, ast_next, o ):
+def declare_signals( nets, ast_next, o, ports ):
 
   clk_port     = None
   reset_port   = None
   top_ports    = []
-  all_ports    = []
+  all_ports    = set()
+  port_ids     = set( id( x ) for x in ports )
 
   shadows = []
   for id_, n in enumerate( nets ):
 
     # each net is a set, convert it to a list
-    net   = list( n )
+    net   = sorted( n, key=net_member_name )
 
     # returns the type, if it is an object/class generate the C def
     type_ = get_type( net[0].dtype(), o ) # TODO: add obj decl to extern
 
-    # declare the net
+    # declare the net, nets connected to constants start with their value
     cname = 'net_{:05}'.format( id_ )
-    print   >>o, '{}  {} = 0;'.format( type_, cname);
+    value = net[0]._signalvalue.uint()
+    print   >>o, '{}  {} = {};'.format( type_, cname, value );
 
     # create references for each signal connected to the net
     for signal in net:
 
-      name = mangle_name( signal.fullname )
+      if isinstance( signal, Constant ):
+        continue
+
+      name = signal_cname( signal )
+      if name in all_ports:
+        continue
       print >>o, '{} &{}      =  {};'      .format( type_, name, cname );
 
       # only create "next" if this signal was written to in @tick
@@ -184,15 +602,15 @@ def declare_signals( nets, ast_next, o ):
       #       attached to the net write next; this is okay because that is
       #       invalid code!
       sig = re.sub('\[[0-9]*\]', '', signal.name)
-      mod = mangle_idxs( signal.parent.name )
+      mod = model_cname( signal.parent )
       fullname = mod + '.' + sig
       if fullname in ast_next:
-        print >>o, '{}  {}_next = 0;'      .format( type_, cname );
-        print >>o, '{} &{}_next = {}_next;'.format( type_, name, cname );
+        print >>o, '{}  {}_next = {};'     .format( type_, cname, value );
+        print >>o, '{} &{}__next = {}_next;'.format( type_, name, cname );
         shadows.append( name )
 
-        all_ports.append( name+'_next' )
-      all_ports.append( name )
+        all_ports.add( name+'__next' )
+      all_ports.add( name )
 
       # ports attached to top will be exposed in the CSim wrapper
       # special case clock/reset, since they won't be exposed, want them
@@ -201,7 +619,7 @@ def declare_signals( nets, ast_next, o ):
         clk_port   = (name, cname, type_)
       elif name == 'top_reset':
         reset_port = (name, cname, type_)
-      elif name.startswith('top'):
+      elif id( signal ) in port_ids:
         print >>o, '{} *   _{}      = &{};'.format( type_, name[4:], cname );
         top_ports.append( (name, cname, type_) );
 
@@ -220,7 +638,11 @@ def get_type( signal, o=None ):
     return 'unsigned int'
   elif isinstance( signal, Bits ):
     assert not isinstance( signal, BitStruct )
-    return 'unsigned int'    # TODO: make a setbitwidth object
+    if signal.nbits <= 32:
+      return 'unsigned int'
+    if signal.nbits <= 64:
+      return 'unsigned long long'
+    raise Exception( "Cannot translate signals wider than 64 bits!" )
   elif isinstance( signal, SignalValueWrapper ):
     if not o:
       raise Exception( "NESTED TYPES NOT ALLOWED" )
@@ -333,6 +755,16 @@ opmap = {
     ast.Or       : '||',
 }
 
+constops = {
+    ast.Add      : operator.add,
+    ast.Sub      : operator.sub,
+    ast.Mult     : operator.mul,
+    ast.FloorDiv : operator.floordiv,
+    ast.Div      : operator.floordiv,
+    ast.LShift   : operator.lshift,
+    ast.RShift   : operator.rshift,
+}
+
 #-----------------------------------------------------------------------
 # TranslateLogic
 #-----------------------------------------------------------------------
@@ -351,6 +783,7 @@ class TranslateLogic( ast.NodeVisitor ):
     self.localvars = {}
     self.arrays    = []
     self.funcs     = set()
+    self.closure   = get_closure_dict( func )
 
     self.assign = '='
 
@@ -380,10 +813,21 @@ class TranslateLogic( ast.NodeVisitor ):
     print >> self.o, '  // logic for {}_{}()'.format( self.model.name, node.name )
     print >> self.o, '  {} {}_{}( {} ) {{'.format(
         rtype,
-        mangle_idxs(self.model.name),
+        model_cname(self.model),
         node.name,
         ', '.join(args)
         )
+
+    # Declare local temporaries up front so they are visible in all the
+    # nested scopes they get used in
+    params   = set( x.id for x in node.args.args )
+    loopvars = set( x.target.id for x in ast.walk( node )
+                    if isinstance( x, _ast.For ) )
+    temps    = set( x.id for x in ast.walk( node )
+                    if isinstance( x, _ast.Name )
+                    and isinstance( x.ctx, _ast.Store ) )
+    for temp in sorted( temps - params - loopvars ):
+      print >> self.o, '    unsigned long long {} = 0;'.format( temp )
     #print >> self.o, '    printf("EXECUTING {}_{}\\n");'.format(
     #                             self.model.name, node.name )
     # Visit each line in the function, translate one at a time.
@@ -399,25 +843,95 @@ class TranslateLogic( ast.NodeVisitor ):
   def visit_Assign(self, node):
     # TODO: implement multiple left hand targets?
     assert len(node.targets) == 1
-    #if debug:
-    print >> self.o, (self.ident+2)*" ",
-    self.visit( node.targets[0] )
-    print >> self.o, "{}".format( self.assign ),
-    self.visit( node.value )
-    print >> self.o, ';'
+    self.store( node.targets[0], node.value )
 
   #---------------------------------------------------------------------
   # visit_AugAssign
   #---------------------------------------------------------------------
   def visit_AugAssign(self, node):
-    # TODO: implement multiple left hand targets?
-    print >> self.o, (self.ident+2)*" ",
-    self.visit( node.target )
-    print >> self.o, self.assign,
-    self.visit( node.target )
-    print >> self.o, opmap[type(node.op)],
-    self.visit(node.value)
-    print >> self.o, ';'
+    value = _ast.BinOp( left=node.target, op=node.op, right=node.value )
+    self.store( node.target, value )
+
+  #---------------------------------------------------------------------
+  # store
+  #---------------------------------------------------------------------
+  # All signals are kept in 32 or 64-bit variables, so values written to
+  # narrower signals are truncated to their bitwidth, and writes to bit
+  # slices of a signal only replace the sliced bits.
+  def store( self, target, value ):
+
+    indent = (self.ident+2)*" "
+
+    if isinstance( target, _ast.Subscript ) and \
+       not isinstance( target.value._object, list ):
+      nbits     = target.value._object.nbits
+      lo, width = self.slice_bounds( target.slice, nbits )
+      print >> self.o, indent + \
+        '{0} = ( {0} & ~( {1} << ( {2} ) ) ) | ( ( ( {3} ) & {1} ) << ( {2} ) );' \
+        .format( self.to_str( target.value ), c_mask( width ), lo,
+                 self.to_str( value ) )
+      return
+
+    nbits = getattr( getattr( target, '_object', None ), 'nbits', 64 )
+    if nbits < 64:
+      print >> self.o, indent + '{} {} ( {} ) & {};'.format(
+        self.to_str( target ), self.assign, self.to_str( value ),
+        c_mask( nbits ) )
+    else:
+      print >> self.o, indent + '{} {} {};'.format(
+        self.to_str( target ), self.assign, self.to_str( value ) )
+
+  #---------------------------------------------------------------------
+  # to_str
+  #---------------------------------------------------------------------
+  # Translate an expression into a string instead of the output.
+  def to_str( self, node ):
+    stash  = self.o
+    self.o = StringIO.StringIO()
+    self.visit( node )
+    value  = self.o.getvalue()
+    self.o = stash
+    return ' '.join( value.split() )
+
+  #---------------------------------------------------------------------
+  # slice_bounds
+  #---------------------------------------------------------------------
+  # Return the translated lowest bit and the width of a bit index or
+  # slice. Widths must be constant: either both bounds are numbers or
+  # the slice looks like x[i:i+N].
+  def slice_bounds( self, node, nbits ):
+    if isinstance( node, _ast.Index ):
+      return self.to_str( node.value ), 1
+
+    lower = node.lower if node.lower else _ast.Num( 0 )
+    upper = node.upper if node.upper else _ast.Num( nbits )
+    lo, hi = self.constant( lower ), self.constant( upper )
+    if lo is not None and hi is not None:
+      return str( lo ), hi - lo
+    if isinstance( upper, _ast.BinOp ) and isinstance( upper.op, _ast.Add ) \
+       and isinstance( upper.right, _ast.Num ) \
+       and ast.dump( upper.left ) == ast.dump( lower ):
+      return self.to_str( lower ), upper.right.n
+
+    raise Exception( "Cannot translate slices with a variable width!" )
+
+  #---------------------------------------------------------------------
+  # constant
+  #---------------------------------------------------------------------
+  # Return the value of an expression only built from numbers and
+  # integers from the enclosing scope, or None.
+  def constant( self, node ):
+    if   isinstance( node, _ast.Num ):
+      return node.n
+    elif isinstance( node, _ast.Name ):
+      value = self.closure.get( node.id )
+      if isinstance( value, (int, long) ) and not isinstance( value, Bits ):
+        return int( value )
+    elif isinstance( node, _ast.BinOp ) and type( node.op ) in constops:
+      left, right = self.constant( node.left ), self.constant( node.right )
+      if left is not None and right is not None:
+        return constops[ type( node.op ) ]( left, right )
+    return None
 
   #---------------------------------------------------------------------
   # visit_BinOp
@@ -496,12 +1010,19 @@ class TranslateLogic( ast.NodeVisitor ):
       #TypeAST( self.model, self.func ).visit( node )
       self.localvars[name] = node._object
 
-    print >> self.o, name.replace('.','_'),
+    print >> self.o, c_var( name ),
 
   #---------------------------------------------------------------------
   # visit_Name
   #---------------------------------------------------------------------
   def visit_Name( self, node ):
+
+    # Integer constants from the enclosing scope
+    value = self.closure.get( node.id )
+    if isinstance( value, (int, long) ) and not isinstance( value, Bits ):
+      print >> self.o, int( value ),
+      return
+
     name = VariableName( self ).visit( node ).replace('.', '_')
 
     print >> self.o, name,
@@ -510,11 +1031,22 @@ class TranslateLogic( ast.NodeVisitor ):
   # visit_Subscript
   #---------------------------------------------------------------------
   def visit_Subscript( self, node ):
-    print >> self.o, '(*',
+
+    # Indexing a list of signals
+    if isinstance( node.value._object, list ):
+      print >> self.o, '(*',
+      self.visit( node.value )
+      print >> self.o, '[',
+      self.visit( node.slice )
+      print >> self.o, '])',
+      return
+
+    # Bit indexing and slicing
+    nbits     = node.value._object.nbits
+    lo, width = self.slice_bounds( node.slice, nbits )
+    print >> self.o, '( (',
     self.visit( node.value )
-    print >> self.o, '[',
-    self.visit( node.slice )
-    print >> self.o, '])',
+    print >> self.o, '>> ( {} ) ) & {} )'.format( lo, c_mask( width ) ),
 
 ##  #---------------------------------------------------------------------
 ##  # visit_ArrayIndex
@@ -718,7 +1250,7 @@ class TranslateLogic( ast.NodeVisitor ):
   def visit_Assert(self, node):
     print >> self.o, self.ident*' ' + '  assert(',
     self.visit( node.test )
-    print >> self.o, ')',
+    print >> self.o, ');'
 
   #---------------------------------------------------------------------
   # visit_Return
@@ -738,6 +1270,14 @@ class TranslateLogic( ast.NodeVisitor ):
     if   isinstance( node.func, _ast.Name ):
       if   node.func.id == 'zext':
         self.visit( node.args[0] )
+      elif node.func.id == 'sext':
+        # flip and subtract the sign bit to extend it to 64 bits
+        sign = '( 1ULL << {} )'.format( node.args[0]._object.nbits - 1 )
+        print >> self.o, '( ( (',
+        self.visit( node.args[0] )
+        print >> self.o, ') ^ {0} ) - {0} )'.format( sign ),
+      elif node.func.id == 'Bits':
+        self.visit( node.args[1] if len( node.args ) > 1 else _ast.Num( 0 ) )
       elif node.func.id == 'hex':
         self.visit( node.args[0] )
       elif node.func.id == 'len':
@@ -753,7 +1293,7 @@ class TranslateLogic( ast.NodeVisitor ):
       if hasattr( self.model, node.func.attr ):
         self.funcs.add( getattr( self.model, node.func.attr ) )
         fname = node.func.attr
-        print >> self.o, "{}_{}(".format( mangle_idxs(self.model.name),
+        print >> self.o, "{}_{}(".format( model_cname(self.model),
                                           fname ),
         for i, arg in enumerate( node.args ):
           if i != 0: print >> self.o, ",",
@@ -820,6 +1360,8 @@ class VariableName( ast.NodeVisitor ):
     self.model  = self.parent.model
 
   def visit_Attribute( self, node ):
+    if isinstance( getattr( node, '_object', None ), Model ):
+      return model_cname( node._object )
     return self.visit( node.value ) + '.' + node.attr
 
   def visit_Subscript( self, node ):
@@ -832,11 +1374,11 @@ class VariableName( ast.NodeVisitor ):
     return val
 
   def visit_Self( self, node ):
-    return self.model.name
+    return model_cname( self.model )
 
   def visit_Name( self, node ):
     if node.id in ['s', 'self']:
-      return self.model.name
+      return model_cname( self.model )
     else:
       return node.id
 
@@ -4,6 +4,8 @@
 
 from __future__ import print_function
 
+import os
+
 from pymtl                import *
 from ...model.signal_lists import PortList
 from cffi                 import FFI
@@ -34,9 +36,11 @@ def gen_cdef( cycle_params, top_ports ):
     str_ += '  {} {};  // {}\n'.format( type_, name[4:], net )
   str_   += '} iface_t;\n\n'
 
+  str_   += 'void eval({});\n\n'.format('\n'+cycle_params+'\n')
   str_   += 'void cycle({});\n\n'.format('\n'+cycle_params+'\n')
+  str_   += 'void cycle_n( unsigned int, const uint32_t *, uint32_t *, iface_t * );\n\n'
 
-  str_   += 'unsigned int  ncycles;\n'
+  str_   += 'extern unsigned int ncycles;\n'
   return str_
 
 #-----------------------------------------------------------------------
@@ -53,7 +57,10 @@ def gen_cheader( cycle_params, top_ports ):
     str_ += '    {} {};  // {}\n'.format( type_, name[4:], net )
   str_   += '  } iface_t;\n\n'
 
+  str_   += '  extern void eval({}  );\n'.format('\n'+cycle_params+'\n')
   str_   += '  extern void cycle({}  );\n'.format('\n'+cycle_params+'\n')
+  str_   += '  extern void cycle_n( unsigned int, const uint32_t *, uint32_t *,\n'
+  str_   += '                       iface_t * );\n'
   str_   += '  extern unsigned int ncycles;\n'
 
   str_   += '};\n'
@@ -63,7 +70,8 @@ def gen_cheader( cycle_params, top_ports ):
 # gen_pywrapper
 #-----------------------------------------------------------------------
 # Create the header for the simulator
-def gen_pywrapper( top_inports, top_outports ):
+def gen_pywrapper( top_inports, top_outports, cycle_n_inports=[],
+                   cycle_n_outports=[] ):
 
   def name_splitter( name ):
     sig, idx = name.split('_IDX')
@@ -82,12 +90,25 @@ def gen_pywrapper( top_inports, top_outports ):
   # TODO: better way?
   class CSimWrapper( object ):
 
+    # ports in the order of the cycle_n stimulus and response buffers
+    inports  = cycle_n_inports
+    outports = cycle_n_outports
+
     def __init__( self, cmodule, ffi ):
       #self._model    = model
       self._cmodule  = cmodule
       self._ffi      = ffi
       self._top      = ffi.new("iface_t *")
 
+      # Buffer-protocol view of the port interface struct for bulk port
+      # reads and writes (e.g., through numpy.frombuffer), and the
+      # offset and size in bytes of each port in it
+      self.iface        = ffi.buffer( self._top )
+      self.iface_layout = dict(
+        ( fullname[4:], ( ffi.offsetof( 'iface_t', fullname[4:] ),
+                          ffi.sizeof( type_ ) ) )
+        for fullname, net, type_ in top_inports[2:] + top_outports )
+
       #-----------------------------------------------------------------
       # CSimWrapper
       #-----------------------------------------------------------------
@@ -109,14 +130,14 @@ def gen_pywrapper( top_inports, top_outports ):
       #-----------------------------------------------------------------
       # Utilty method for creating fget
       def create_fget( top, name ):
-        return lambda self: getattr( top[0], name )
+        return lambda self: getattr( top, name )
 
       #-----------------------------------------------------------------
       # create_fset
       #-----------------------------------------------------------------
       # Utilty method for creating fset
       def create_fset( top, name ):
-        return lambda self, value : setattr( top[0], name, value )
+        return lambda self, value : setattr( top, name, value )
 
       # Add properties for all cffi exposed toplevel ports
       for fullname, net, type_ in top_inports[2:] + top_outports:
@@ -143,9 +164,22 @@ def gen_pywrapper( top_inports, top_outports ):
       self.cycle( reset=1 )
       self.cycle( reset=1 )
 
+    def eval( self, clk=0, reset=0 ):
+      self._cmodule.eval( clk, reset, self._top )
+
     def cycle( self, clk=0, reset=0 ):
       self._cmodule.cycle( clk, reset, self._top )
 
+    def cycle_n( self, n, inputs=None, outputs=None ):
+      """Simulate n cycles natively. inputs and outputs are buffers of
+      32-bit words (e.g., array('I') or NumPy uint32 arrays) with one row
+      per cycle, holding the ports in inports/outports order with
+      (nbits-1)/32+1 words each. Without inputs the current input port
+      values are used every cycle, outputs may be None as well."""
+      as_ptr = lambda x: self._ffi.NULL if x is None else \
+                         self._ffi.cast( 'uint32_t *', self._ffi.from_buffer( x ) )
+      self._cmodule.cycle_n( n, as_ptr( inputs ), as_ptr( outputs ), self._top )
+
     @property
     def ncycles( self ):
       return self._cmodule.ncycles
@@ -166,8 +200,10 @@ def create_cpp_py_wrapper( model, cdef, lib_file, wrapper_filename ):
   # create    pymtl_wrap w  pymtl_cppnames
 
   port_defs   = []
+  input_cbs   = []
   set_inputs  = []
-  set_outputs = []
+  set_comb    = []
+  set_next    = []
 
   for x in model.get_ports( preserve_hierarchy=True ):
     recurse_port_hierarchy( x, port_defs )
@@ -177,15 +213,22 @@ def create_cpp_py_wrapper( model, cdef, lib_file, wrapper_filename ):
     decl    = "lambda: setattr( s._top, '{}', s.{}.uint() )" \
               .format( x.cpp_name[4:], x.name )
     call    = "s._cffi_update[ s.{} ] = {}".format( x.name, decl )
-    set_inputs.append( call )
+    input_cbs.append( call )
+    set_inputs.append( "s._top.{} = int( s.{} )"
+                       .format( x.cpp_name[4:], x.name ) )
+
+  cycle_n_inports = [ x for x in model.get_inports() if x.name != 'clk' ]
 
   for x in model.get_outports():
-    decl = "s.{}.value = s._top.{}".format( x.name, x.cpp_name[4:] )
-    set_outputs.append( decl )
+    set_comb.append( "s.{}.value = s._top.{}"
+                     .format( x.name, x.cpp_name[4:] ) )
+    set_next.append( "s.{}.next  = s._top.{}"
+                     .format( x.name, x.cpp_name[4:] ) )
 
   # pretty printing
-  indent_four = '\n    '
-  indent_six  = '\n      '
+  indent_four  = '\n    '
+  indent_six   = '\n      '
+  indent_eight = '\n        '
 
   # create source
   with open( template_filename, 'r' ) as template, \
@@ -196,9 +239,15 @@ def create_cpp_py_wrapper( model, cdef, lib_file, wrapper_filename ):
         model_name  = model.class_name,
         cdef        = cdef,
         lib_file    = lib_file,
-        port_defs   = indent_four.join( port_defs ),
-        set_inputs  = indent_four.join( set_inputs ),
-        set_outputs = indent_six .join( set_outputs ),
+        port_defs   = indent_four .join( port_defs ),
+        input_cbs   = indent_four .join( input_cbs ),
+        set_inputs  = indent_eight.join( set_inputs ) or 'pass',
+        set_comb    = indent_six  .join( set_comb ),
+        set_next    = indent_six  .join( set_next ),
+        set_outputs = indent_four .join( set_comb ),
+        cycle_n_inports  = ', '.join( 's.' + x.name for x in cycle_n_inports ),
+        cycle_n_outports = ', '.join( 's.' + x.name
+                                      for x in model.get_outports() ),
     )
 
     output.write( py_src )
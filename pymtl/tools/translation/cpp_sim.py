@@ -2,74 +2,101 @@
 # cpp_sim.py
 #=======================================================================
 
-from cpp         import CLogicTransl as translate
-from cpp         import compiler
-from cpp_helpers import gen_cppsim, create_cpp_py_wrapper
-from subprocess  import check_output, STDOUT, CalledProcessError
-
 import os
 import sys
-import filecmp
+import imp
+
+from cpp            import CLogicTransl as translate
+from cpp            import compiler
+from cpp_helpers    import gen_cppsim, create_cpp_py_wrapper
+from cStringIO      import StringIO
+from subprocess     import check_output, STDOUT, CalledProcessError
+from build_cache    import BuildCache, hash_key
+from verilator_cffi import get_tool_versions
 
 #-----------------------------------------------------------------------
 # get_cpp
 #-----------------------------------------------------------------------
 def get_cpp( model_inst ):
+  """Translates a PyMTL model into a natively compiled C++ simulator
+  wrapped as a PyMTL model.
+
+  The simulator is built in the shared build cache (see build_cache.py)
+  under a hash of the generated C++ and the compiler configuration, so
+  it is only recompiled when the design or the tools change, and nothing
+  is written to the current working directory.
+  """
 
   model_inst.elaborate()
 
-  # Translate the PyMTL module to cpp, if we've already done
-  # translation check if there's been any changes to the source
   model_name   = model_inst.class_name
   source_file  = model_name + '.cpp'
-  temp_file    = model_name + '.cpp.tmp'
   wrapper_file = model_name + '_cpp.py'
   lib_file     = 'lib{}_cpp.so'.format( model_name )
 
-  # Write the output to a temporary file
-  cdef = None
-  with open( temp_file, 'w+' ) as fd:
-    cdef, _ = translate( model_inst, fd )
+  # Translate the PyMTL module to cpp
+
+  output  = StringIO()
+  cdef, _ = translate( model_inst, output )
+  cpp_src = output.getvalue()
+
+  # The cache key covers everything that affects the build products
 
-  def do_work():
-    cmd  = compiler.format( libname = lib_file,
-                            csource = source_file )
+  key = hash_key( cpp_src, model_name, compiler, get_tool_versions(),
+                  _generator_source() )
+
+  # Compile the module only if it is not already in the cache
+
+  def build( build_dir ):
+    path = lambda x: os.path.join( build_dir, x )
+    with open( path( source_file ), 'w' ) as fd:
+      fd.write( cpp_src )
+    cmd = compiler.format( libname = path( lib_file ),
+                           csource = path( source_file ) )
     try:
-      result = check_output( cmd.split() , stderr=STDOUT )
+      check_output( cmd.split(), stderr=STDOUT )
     except CalledProcessError as e:
       raise Exception( 'Module did not compile!\n\n'
                        'Command:\n' + ' '.join(e.cmd) + '\n\n'
                        'Error:\n' + e.output + '\n'
                       )
-    #csim, ffi = gen_cppsim ( lib_file, cdef )
-    #sim       = CSimWrapper( csim, ffi )
-    create_cpp_py_wrapper( model_inst, cdef, lib_file, wrapper_file )
-
-  # Check if the temporary file matches an existing file (caching)
-  cached = False
-  # TODO: fix caching
-  #if os.path.exists( source_file ):
-  #  cached = filecmp.cmp( temp_file, source_file )
-  #  if not cached:
-  #    os.system( ' diff -y %s %s'%( temp_file, source_file ))
-
-  # Rename temp to actual output
-  os.rename( temp_file, source_file )
-
-  # Compile the module only if we've updated the verilog source
-  if not cached:
-    print "NOT CACHED", source_file
-    # verilog_to_pymtl( model_inst, source_file )
-    do_work()
-
-  # Use some trickery to import the verilated version of the model
-  sys.path.append( os.getcwd() )
-  __import__( wrapper_file[:-3] )
-  imported_module = sys.modules[ wrapper_file[:-3] ]
-
-  # Get the model class from the module, instantiate and elaborate it
-  model_class = imported_module.__dict__[ model_name ]
-  model_inst = model_class()
+    create_cpp_py_wrapper( model_inst, cdef, lib_file, path( wrapper_file ) )
+
+  with BuildCache().entry( key, build ) as build_dir:
+
+    # Import the wrapper from the cache entry. The module name includes
+    # the key so that different builds of the same model can coexist.
+
+    module_name = '{}_cpp_{}'.format( model_name, key[:16] )
+    if module_name not in sys.modules:
+      imp.load_source( module_name, os.path.join( build_dir, wrapper_file ) )
+    imported_module = sys.modules[ module_name ]
+
+    # Get the model class from the module, instantiate and elaborate it
+    model_class = imported_module.__dict__[ model_name ]
+    model_inst  = model_class()
 
   return model_inst
 
+#-----------------------------------------------------------------------
+# _generator_source
+#-----------------------------------------------------------------------
+# Source of the wrapper generator and its template, so that cached
+# builds are invalidated when they change (changes to the translation
+# itself show up in the generated C++).
+
+_generator_src = None
+
+def _generator_source():
+
+  global _generator_src
+
+  if _generator_src is None:
+    src_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    src     = []
+    for filename in [ 'cpp_helpers.py', 'cpp_wrapper.templ.py' ]:
+      with open( os.path.join( src_dir, filename ) ) as fp:
+        src.append( fp.read() )
+    _generator_src = '\n'.join( src )
+
+  return _generator_src
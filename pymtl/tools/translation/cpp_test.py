@@ -0,0 +1,327 @@
+#=======================================================================
+# cpp_test.py
+#=======================================================================
+
+import random
+import StringIO
+import pytest
+
+from distutils.spawn import find_executable
+
+from pymtl       import *
+from cpp         import CLogicTransl
+from cpp_helpers import gen_cppsim
+from cpp_sim     import get_cpp
+
+import cpp_sim
+
+requires_gxx = pytest.mark.skipif( not find_executable( 'g++' ),
+                                   reason='requires g++' )
+
+#-----------------------------------------------------------------------
+# compare
+#-----------------------------------------------------------------------
+# Simulate the model with SimulationTool and the native simulator side
+# by side on random inputs, checking all outputs every cycle.
+def compare( model_class, ncycles=100 ):
+
+  ref = model_class()
+  ref.elaborate()
+  ref_sim = SimulationTool( ref )
+
+  dut = get_cpp( model_class() )
+  dut.elaborate()
+  dut_sim = SimulationTool( dut )
+
+  inports  = [ x.name for x in ref.get_inports()
+               if x.name not in [ 'clk', 'reset' ] ]
+  outports = [ x.name for x in ref.get_outports() ]
+
+  ref_sim.reset()
+  dut_sim.reset()
+
+  rng = random.Random( 0x1234 )
+  for i in range( ncycles ):
+    for name in inports:
+      value = rng.getrandbits( eval( 'ref.' + name ).nbits )
+      exec 'ref.{0}.value = value; dut.{0}.value = value'.format( name )
+    ref_sim.eval_combinational()
+    dut_sim.eval_combinational()
+    for name in outports:
+      assert eval( 'dut.' + name ) == eval( 'ref.' + name ), name
+    ref_sim.cycle()
+    dut_sim.cycle()
+
+#-----------------------------------------------------------------------
+# Models
+#-----------------------------------------------------------------------
+
+class CppReg( Model ):
+  def __init__( s, nbits ):
+    s.in_ = InPort ( nbits )
+    s.out = OutPort( nbits )
+
+    @s.tick
+    def seq_logic():
+      if s.reset:
+        s.out.next = 0
+      else:
+        s.out.next = s.in_
+
+class CppComb( Model ):
+  def __init__( s ):
+    s.in_  = [ InPort( 8 ) for _ in range( 4 ) ]
+    s.sel  = InPort ( 2 )
+    s.wide = InPort ( 40 )
+    s.out  = OutPort( 8 )
+    s.sum  = OutPort( 40 )
+    s.lo   = OutPort( 4 )
+    s.hi   = OutPort( 4 )
+
+    s.sum_reg = CppReg( 40 )
+    s.picked  = Wire( 8 )
+    s.bits    = Wire( 8 )
+
+    s.connect( s.lo, s.bits[0:4] )
+    s.connect( s.hi, s.bits[4:8] )
+    s.connect( s.sum_reg.in_, s.sum )
+
+    # Blocks are declared in the opposite order to the one they have to
+    # be evaluated in
+
+    @s.combinational
+    def output_logic():
+      s.out.value = s.picked + s.sum_reg.out[0:8]
+      s.bits.value = 0
+      for i in range( 4 ):
+        s.bits[2*i:2*i+2].value = s.picked[i]
+
+    @s.combinational
+    def select_logic():
+      s.picked.value = s.in_[ s.sel ] + 0xff
+      s.sum.value    = s.wide + s.sum_reg.out
+
+class CppFalseLoop( Model ):
+  def __init__( s ):
+    s.in_ = InPort ( 4 )
+    s.out = OutPort( 4 )
+    s.tmp = Wire( 8 )
+
+    # Each block reads the half of tmp written by the other one, which
+    # looks like a loop at the granularity of whole signals
+
+    @s.combinational
+    def upper():
+      s.tmp[4:8].value = s.tmp[0:4] + 1
+
+    @s.combinational
+    def lower():
+      s.tmp[0:4].value = s.in_
+      s.out.value      = s.tmp[4:8]
+
+#-----------------------------------------------------------------------
+# test_eval_comb_order
+#-----------------------------------------------------------------------
+def test_eval_comb_order():
+
+  model = CppComb()
+  model.elaborate()
+
+  output = StringIO.StringIO()
+  CLogicTransl( model, output )
+  src = output.getvalue()
+
+  # Blocks are evaluated after the blocks and slices they depend on, and
+  # registers are only updated in cycle
+
+  eval_comb = src.split( 'void eval_comb() {' )[1].split( '}' )[0]
+  assert eval_comb.index( 'top_select_logic();' ) < \
+         eval_comb.index( 'top_output_logic();' ) < \
+         eval_comb.index( '>> 4 )' )
+  assert 'top__sum_reg_out = top__sum_reg_out__next;' in src
+
+#-----------------------------------------------------------------------
+# test_comb_logic
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_comb_logic( monkeypatch, tmpdir ):
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+  compare( CppComb )
+
+#-----------------------------------------------------------------------
+# test_false_loop
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_false_loop( monkeypatch, tmpdir ):
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+  compare( CppFalseLoop )
+
+#-----------------------------------------------------------------------
+# test_build_cache
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_build_cache( monkeypatch, tmpdir ):
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir.join( 'cache' ) ) )
+
+  compiled = []
+  def check_output( cmd, **kwargs ):
+    compiled.append( cmd )
+    return real_check_output( cmd, **kwargs )
+  real_check_output = cpp_sim.check_output
+  monkeypatch.setattr( cpp_sim, 'check_output', check_output )
+
+  # The same design is only compiled once, independent of the working
+  # directory, which is left untouched
+
+  for i in range( 2 ):
+    monkeypatch.chdir( tmpdir.mkdir( 'run{}'.format( i ) ) )
+    model = get_cpp( CppReg( 8 ) )
+    model.elaborate()
+    sim = SimulationTool( model )
+    sim.reset()
+    model.in_.value = 42
+    sim.cycle()
+    assert model.out == 42
+    assert tmpdir.join( 'run{}'.format( i ) ).listdir() == []
+
+  assert len( compiled ) == 1
+
+  # A different design gets its own build
+
+  get_cpp( CppReg( 16 ) )
+  assert len( compiled ) == 2
+
+#-----------------------------------------------------------------------
+# test_csim_wrapper
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_csim_wrapper( tmpdir ):
+
+  from subprocess import check_call
+  from cpp        import compiler
+
+  model = CppComb()
+  model.elaborate()
+
+  source = tmpdir.join( 'CppComb.cpp' )
+  with open( str( source ), 'w' ) as output:
+    cdef, CSimWrapper = CLogicTransl( model, output )
+
+  lib = str( tmpdir.join( 'libCppComb.so' ) )
+  check_call( compiler.format( libname=lib, csource=str( source ) ).split() )
+
+  sim = CSimWrapper( *gen_cppsim( lib, cdef ) )
+  sim.reset()
+
+  sim.in_[2] = 0x10
+  sim.sel    = 2
+  sim.wide   = 2**39
+  sim.eval()
+  assert sim.out  == 0x0f
+  assert sim.sum  == 2**39
+  assert sim.lo   == 0b0101
+
+  # The register now holds the sum, which wraps around to zero
+
+  sim.cycle()
+  assert sim.out  == 0x0f
+  assert sim.sum  == 0
+  assert sim.ncycles == 3
+
+#-----------------------------------------------------------------------
+# test_csim_cycle_n
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_csim_cycle_n( tmpdir ):
+
+  from array      import array
+  from subprocess import check_call
+  from cpp        import compiler
+
+  model = CppReg( 40 )
+  model.elaborate()
+
+  source = tmpdir.join( 'CppReg.cpp' )
+  with open( str( source ), 'w' ) as output:
+    cdef, CSimWrapper = CLogicTransl( model, output )
+
+  lib = str( tmpdir.join( 'libCppReg.so' ) )
+  check_call( compiler.format( libname=lib, csource=str( source ) ).split() )
+
+  sim = CSimWrapper( *gen_cppsim( lib, cdef ) )
+  assert sim.inports  == [ 'reset', 'in_' ]
+  assert sim.outports == [ 'out' ]
+
+  # Each row holds reset and the two words of in_, the outputs of a
+  # cycle are recorded before its clock edge
+
+  values  = [ 0, 1, 2**32, 2**40-1 ]
+  inputs  = array( 'I', [ 1, 0, 0 ] )
+  for value in values:
+    inputs.extend([ 0, value & 0xffffffff, value >> 32 ])
+  outputs = array( 'I', [0] ) * ( 2 * len( values ) + 2 )
+
+  sim.cycle_n( len( values ) + 1, inputs, outputs )
+  assert [ outputs[2*i] | outputs[2*i+1] << 32
+           for i in range( 1, len( values ) + 1 ) ] == [ 0 ] + values[:-1]
+  assert sim.out == values[-1]
+
+  # Without stimulus the current inputs are held
+
+  sim.in_ = 7
+  sim.cycle_n( 2 )
+  assert sim.out == 7
+  assert sim.ncycles == len( values ) + 3
+
+  # The port interface is exposed as a buffer
+
+  offset, size = sim.iface_layout['out']
+  assert size == 8
+  assert sim.iface[offset:offset+size] == '\x07' + '\x00' * 7
+
+#-----------------------------------------------------------------------
+# test_batch_simulation
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_batch_simulation( monkeypatch, tmpdir ):
+
+  from pymtl.tools.simulation.BatchSimulationTool import BatchSimulationTool
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+
+  ref = CppComb()
+  ref.elaborate()
+  ref_sim = SimulationTool( ref )
+  ref_sim.reset()
+
+  dut = get_cpp( CppComb() )
+  dut.elaborate()
+  inports = [ dut.in_[0], dut.in_[1], dut.in_[2], dut.in_[3], dut.sel,
+              dut.wide ]
+  dut_sim = BatchSimulationTool( dut, inports=inports )
+  dut_sim.reset()
+
+  rng    = random.Random( 0x4321 )
+  inputs = [ tuple( rng.getrandbits( x.nbits ) for x in inports )
+             for _ in range( 50 ) ]
+  ref_inports = [ ref.in_[0], ref.in_[1], ref.in_[2], ref.in_[3], ref.sel,
+                  ref.wide ]
+
+  outputs = []
+  for row in inputs:
+    for port, value in zip( ref_inports, row ):
+      port.value = value
+    ref_sim.eval_combinational()
+    outputs.append( tuple( int( getattr( ref, x.name ) )
+                           for x in dut_sim.outports ) )
+    ref_sim.cycle()
+
+  assert dut_sim.cycle_n( inputs[:20] ) + dut_sim.cycle_n( inputs[20:] ) \
+         == outputs
+
+  # The Python side ends up in the same state as the reference
+
+  ref_sim.eval_combinational()
+  for name in [ 'out', 'sum', 'lo', 'hi' ]:
+    assert getattr( dut, name ) == getattr( ref, name )
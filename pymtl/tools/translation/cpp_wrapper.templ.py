@@ -1,3 +1,5 @@
+import os
+
 from pymtl import *
 from cffi  import FFI
 
@@ -10,7 +12,10 @@ class {model_name}( Model ):
       {cdef}
     ''')
 
-    s._cmodule = ffi.dlopen('./{lib_file}')
+    # the shared library lives next to this wrapper
+    lib_dir    = os.path.dirname( os.path.abspath( __file__ ) )
+    s._cmodule = ffi.dlopen( os.path.join( lib_dir, '{lib_file}' ) )
+    s._ffi     = ffi
     s._top     = ffi.new("iface_t *")
 
     class BundleProxy( PortBundle ):
@@ -18,23 +23,58 @@ class {model_name}( Model ):
 
     {port_defs}
 
+    # ports in the order of the cycle_n stimulus and response buffers
+    s._cycle_n_inports  = [ {cycle_n_inports} ]
+    s._cycle_n_outports = [ {cycle_n_outports} ]
+
     # Set Input Callbacks
     s._cffi_update = {{}}
-    {set_inputs}
+    {input_cbs}
+
+    # The first evaluation copies every input
+    s._copy_all_inputs = True
 
   def elaborate_logic( s ):
 
-    #@s.combinational
-    #def logic():
+    @s.combinational
+    def logic():
+
+      # Set inputs, later changes are copied by the _cffi_update callbacks
+      # (this also makes the block sensitive to every input)
+      if s._copy_all_inputs:
+        {set_inputs}
+        s._copy_all_inputs = False
+
+      # Settle the combinational logic
+      s._cmodule.eval( int( s.clk ), int( s.reset ), s._top )
+
+      # Set outputs
+      {set_comb}
 
     @s.tick
     def seq_logic():
 
       # Cycle
-      s._cmodule.cycle( s.clk, s.reset, s._top )
+      s._cmodule.cycle( int( s.clk ), int( s.reset ), s._top )
 
       # Set outputs
-      {set_outputs}
+      {set_next}
+
+  def cycle_n( s, n, in_buf, out_buf ):
+    """Simulate n cycles natively, reading the inputs for every cycle
+    from in_buf and writing the outputs to out_buf (see cycle_n in the
+    generated C++ for the buffer layout). The buffers can be any objects
+    supporting the buffer protocol, such as array('I') or NumPy uint32
+    arrays, or None. The Python side is not updated for each cycle, use
+    BatchSimulationTool to run cycle_n as part of a simulation."""
+
+    as_ptr = lambda x: s._ffi.NULL if x is None else \
+                       s._ffi.cast( 'uint32_t *', s._ffi.from_buffer( x ) )
+
+    s._cmodule.cycle_n( n, as_ptr( in_buf ), as_ptr( out_buf ), s._top )
+
+    # bring the output ports up to date with the model
+    {set_outputs}
 
   @property
   def ncycles( s ):
@@ -14,6 +14,13 @@ from subprocess          import check_output, STDOUT, CalledProcessError
 from ...model.signals    import InPort, OutPort
 from ...model.PortBundle import PortBundle
 from exceptions          import VerilatorCompileError
+from build_cache         import BuildCache, hash_key, get_build_jobs
+
+from multiprocessing.pool import ThreadPool
+
+# Size of the line trace buffers, which has to match the size used by
+# the Verilog line_trace task (see vc/trace.v)
+TRACE_NCHARS = 512
 
 #-----------------------------------------------------------------------
 # verilog_to_pymtl
@@ -21,7 +28,8 @@ from exceptions          import VerilatorCompileError
 # Create a PyMTL compatible interface for Verilog HDL.
 
 def verilog_to_pymtl( model, verilog_file, c_wrapper_file,
-                      lib_file, py_wrapper_file, vcd_en, lint, verilator_xinit ):
+                      lib_file, py_wrapper_file, vcd_en, lint, verilator_xinit,
+                      profile='default', api_mode=False, threads=1 ):
 
   model_name = model.class_name
 
@@ -31,7 +39,7 @@ def verilog_to_pymtl( model, verilog_file, c_wrapper_file,
     vlinetrace = False
 
   # Verilate the model  # TODO: clean this up
-  verilate_model( verilog_file, model_name, vcd_en, lint )
+  verilate_model( verilog_file, model_name, vcd_en, lint, profile, threads )
 
   # Add names to ports of module
   for port in model.get_ports():
@@ -43,11 +51,18 @@ def verilog_to_pymtl( model, verilog_file, c_wrapper_file,
 
   # Create Shared C Library
   create_shared_lib( model_name, c_wrapper_file, lib_file,
-                     vcd_en, vlinetrace )
+                     vcd_en, vlinetrace, profile, threads )
+
+  # Create the CFFI interface declarations
+  ffi_cdefs = create_ffi_cdefs( model_name, cdefs, vlinetrace )
+
+  # Create compiled CFFI extension module
+  if api_mode:
+    create_cffi_extension( ffi_module_name( model_name ), ffi_cdefs, lib_file )
 
   # Create PyMTL wrapper for CFFI interface to Verilated model
   create_verilator_py_wrapper( model, py_wrapper_file, lib_file,
-                               cdefs, vlinetrace )
+                               ffi_cdefs, vlinetrace, api_mode, threads )
 
 #-----------------------------------------------------------------------
 # verilate_model
@@ -55,7 +70,8 @@ def verilog_to_pymtl( model, verilog_file, c_wrapper_file,
 # Convert Verilog HDL into a C++ simulator using Verilator.
 # http://www.veripool.org/wiki/verilator
 
-def verilate_model( filename, model_name, vcd_en, lint ):
+def verilate_model( filename, model_name, vcd_en, lint, profile='default',
+                    threads=1 ):
 
   # verilator commandline template
 
@@ -65,15 +81,8 @@ def verilate_model( filename, model_name, vcd_en, lint ):
   # verilator commandline options
 
   source  = filename
-  obj_dir = 'obj_dir_' + model_name
-  flags   = ' '.join([
-              '-Wno-lint' if not lint else '',
-              '-Wno-UNOPTFLAT',
-              '--unroll-count 1000000',
-              '--unroll-stmts 1000000',
-              '--assert',
-              '--trace' if vcd_en else '',
-            ])
+  obj_dir = os.path.join( os.path.dirname( filename ), 'obj_dir_' + model_name )
+  flags   = verilator_flags( vcd_en, lint, profile, threads )
 
   # remove the obj_dir because issues with staleness
 
@@ -125,6 +134,96 @@ for more details on various Verilator warnings and error messages.
       error   = error
     ))
 
+#-----------------------------------------------------------------------
+# Build profiles
+#-----------------------------------------------------------------------
+# Each build profile selects the Verilator optimization flags and the C++
+# compiler flags used to build a verilated model, as a tuple of
+# ( verilator flags, C++ flags ). See the comment above create_shared_lib
+# for the recommendations these are based on.
+#
+#  - debug:   keep assertions, no C++ optimization, debug symbols
+#  - default: keep assertions, cheap C++ optimization (OPT_FAST)
+#  - fast:    drop assertions, X assignments resolved for speed, -O2
+#  - max:     as fast, with full Verilator and C++ optimization
+#
+# Note that fast and max may hide reset bugs, since X assignments are no
+# longer randomized. The profile is selected per TranslationTool call or
+# with the PYMTL_VERILATOR_PROFILE environment variable.
+
+BUILD_PROFILES = {
+  'debug'   : ( '--assert',
+                '-O0 -g' ),
+  'default' : ( '--assert',
+                '-O1 -fstrict-aliasing' ),
+  'fast'    : ( '--x-assign fast --noassert',
+                '-O2 -fstrict-aliasing' ),
+  'max'     : ( '-O3 --x-assign fast --noassert',
+                '-O3 -fstrict-aliasing' ),
+}
+
+def get_build_profile( profile=None ):
+
+  if profile is None:
+    profile = os.environ.get( 'PYMTL_VERILATOR_PROFILE', 'default' )
+
+  if profile not in BUILD_PROFILES:
+    raise ValueError( "Unknown Verilator build profile '{}', expected one "
+                      "of: {}".format( profile,
+                                       ', '.join( sorted( BUILD_PROFILES ) ) ) )
+
+  return profile
+
+#-----------------------------------------------------------------------
+# get_threads
+#-----------------------------------------------------------------------
+# Number of threads a verilated model is built for. With more than one
+# thread, Verilator partitions the design into tasks which are evaluated
+# in parallel by a thread pool owned by the model. This only pays off
+# for large designs. The thread count is selected per TranslationTool
+# call or with the PYMTL_VERILATOR_THREADS environment variable.
+
+def get_threads( threads=None ):
+
+  if threads is None:
+    threads = os.environ.get( 'PYMTL_VERILATOR_THREADS', 1 )
+
+  try:
+    threads = int( threads )
+  except ValueError:
+    threads = 0
+
+  if threads < 1:
+    raise ValueError( "Verilator thread count must be a positive integer" )
+
+  return threads
+
+#-----------------------------------------------------------------------
+# verilator_flags
+#-----------------------------------------------------------------------
+# Verilator commandline options for the given build configuration.
+
+def verilator_flags( vcd_en, lint, profile='default', threads=1 ):
+  return ' '.join([
+    '-Wno-lint' if not lint else '',
+    '-Wno-UNOPTFLAT',
+    '--unroll-count 1000000',
+    '--unroll-stmts 1000000',
+    BUILD_PROFILES[ profile ][0],
+    '--trace' if vcd_en else '',
+    '--threads {}'.format( threads ) if threads > 1 else '',
+  ])
+
+#-----------------------------------------------------------------------
+# cxx_flags
+#-----------------------------------------------------------------------
+# C++ compiler options for the given build configuration. Multithreaded
+# models need the threaded Verilator runtime (see create_shared_lib).
+
+def cxx_flags( profile='default', threads=1 ):
+  return BUILD_PROFILES[ profile ][1] + ' -fPIC' + \
+         ( ' -DVL_THREADED -pthread' if threads > 1 else '' )
+
 #-----------------------------------------------------------------------
 # create_c_wrapper
 #-----------------------------------------------------------------------
@@ -171,6 +270,14 @@ def create_c_wrapper( model, c_wrapper_file, vcd_en, vlinetrace, verilator_xinit
   port_decls   = indent_zero.join( [ port_to_decl( x ) for x in ports ] )
   port_inits   = indent_two .join( [ port_to_init( x ) for x in ports ] )
 
+  # Create the statements copying ports from/to the cycle_n buffers
+  inports, outports = get_cycle_n_ports( model )
+  cycle_inputs  = indent_six.join( cycle_n_copy_stmts( inports,  'in'  ) )
+  cycle_outputs = indent_six.join( cycle_n_copy_stmts( outports, 'out' ) )
+
+  # Create the statements detecting changed outputs
+  changed_outputs = indent_two.join( changed_output_stmts( outports ) )
+
   # Convert verilator_xinit to number
   if   ( verilator_xinit == "zeros" ) : verilator_xinit_num = 0
   elif ( verilator_xinit == "ones"  ) : verilator_xinit_num = 1
@@ -191,13 +298,21 @@ def create_c_wrapper( model, c_wrapper_file, vcd_en, vlinetrace, verilator_xinit
                           vcd_timescale = get_vcd_timescale( model ),
                           dump_vcd      = '1' if vcd_en else '0',
                           vlinetrace    = '1' if vlinetrace else '0',
+                          trace_nchars  = TRACE_NCHARS,
 
                           verilator_xinit_num = verilator_xinit_num,
+
+                          changed_outputs = changed_outputs,
+
+                          cycle_inputs  = cycle_inputs,
+                          cycle_outputs = cycle_outputs,
+                          nin_words     = sum( map( num_words, inports  ) ),
+                          nout_words    = sum( map( num_words, outports ) ),
                         )
 
     output.write( c_src )
 
-  return port_decls.replace( indent_zero, indent_six )
+  return port_decls
 
 #-----------------------------------------------------------------------
 # create_shared_lib
@@ -244,9 +359,10 @@ def create_c_wrapper( model, c_wrapper_file, vcd_en, vlinetrace, verilator_xinit
 #
 # http://www.veripool.org/projects/verilator/wiki/Manual-verilator
 
-# I have added a new feature which compiles all of the standard Verilator
-# code into a static library and then simply links this in. This reduces
-# compile times.
+# Every source file (including the standard Verilator code) is compiled
+# into its own object file in parallel, and the objects are cached so
+# that only changed files are recompiled. The objects are then linked
+# into the shared library.
 
 def try_cmd( name, cmd ):
 
@@ -276,9 +392,12 @@ def try_cmd( name, cmd ):
 
 def compile( flags, include_dirs, output_file, input_files ):
 
-  compile_cmd = 'g++ {flags} {idirs} -o {ofile} {ifiles}'
+  compile_cmd = '{cxx} {flags} {idirs} -o {ofile} {ifiles}'
+
+  # Setting PYMTL_CCACHE runs the compiler through ccache
 
   compile_cmd = compile_cmd.format(
+    cxx    = 'ccache g++' if os.environ.get( 'PYMTL_CCACHE' ) else 'g++',
     flags  = flags,
     idirs  = ' '.join( [ '-I'+s for s in include_dirs ] ),
     ofile  = output_file,
@@ -310,8 +429,7 @@ def make_lib( output_file, input_files ):
 
   try_cmd( "Make library", ranlib_cmd )
 
-def create_shared_lib( model_name, c_wrapper_file, lib_file,
-                       vcd_en, vlinetrace ):
+def get_verilator_include_dir():
 
   # We need to find out where the verilator include directories are
   # globally installed. We first check the PYMTL_VERILATOR_INCLUDE_DIR
@@ -373,50 +491,21 @@ Error:
         error   = e.output,
       ))
 
+  return verilator_include_dir
+
+def create_shared_lib( model_name, c_wrapper_file, lib_file,
+                       vcd_en, vlinetrace, profile='default', threads=1 ):
+
+  verilator_include_dir = get_verilator_include_dir()
+
   include_dirs = [
     verilator_include_dir,
     verilator_include_dir+"/vltstd",
   ]
 
-  # Compile standard Verilator code if libverilator.a does not exist.
-  # Originally, I was also including verilated_dpi.cpp in this library,
-  # but for some reason that screws up line tracing. Somehow there is
-  # some kind of global state or something that is shared across the
-  # shared libraries or something. I was able to fix it by recompiling
-  # verilated_dpi if linetracing is enabled. Actually, the line tracing
-  # doesn't work -- if you use this line tracing approach, so we are back
-  # to always recomping everyting every time for now.
-
-  # if not os.path.exists( "libverilator.a" ):
-  #
-  #   compile(
-  #     flags        = "-O3 -c",
-  #     include_dirs = include_dirs,
-  #     output_file  = "verilator.o",
-  #     input_files  = [ verilator_include_dir+"/verilated.cpp" ]
-  #   )
-  #
-  #   compile(
-  #     flags        = "-O3 -c",
-  #     include_dirs = include_dirs,
-  #     output_file  = "verilator_vcd_c.o",
-  #     input_files  = [ verilator_include_dir+"/verilated_vcd_c.cpp" ]
-  #   )
-  #
-  #   # compile(
-  #   #   flags        = "-O3 -c",
-  #   #   include_dirs = include_dirs,
-  #   #   output_file  = "verilator_dpi.o",
-  #   #   input_files  = [ verilator_include_dir+"/verilated_dpi.cpp" ]
-  #   # )
-  #
-  #   make_lib(
-  #     output_file  = "libverilator.a",
-  #     # input_files  = [ "verilator.o", "verilator_vcd_c.o", "verilator_dpi.o" ]
-  #     input_files  = [ "verilator.o", "verilator_vcd_c.o" ]
-  #    )
-
-  obj_dir_prefix = "obj_dir_{m}/V{m}".format( m=model_name )
+  obj_dir        = os.path.join( os.path.dirname( c_wrapper_file ),
+                                 'obj_dir_' + model_name )
+  obj_dir_prefix = os.path.join( obj_dir, 'V' + model_name )
 
   # We need to find a list of all the generated classes. We look in the
   # Verilator makefile for that.
@@ -433,65 +522,262 @@ Error:
           found = False
         else:
           filename = line.strip()[:-2]
-          cpp_file = "obj_dir_{m}/{f}.cpp".format( m=model_name, f=filename )
+          cpp_file = os.path.join( obj_dir, filename+".cpp" )
           cpp_sources_list.append( cpp_file )
 
-  # Compile this module
-
   cpp_sources_list += [
     obj_dir_prefix+"__Syms.cpp",
-    verilator_include_dir+"/verilated.cpp",
-    verilator_include_dir+"/verilated_dpi.cpp",
     c_wrapper_file,
   ]
 
   if vcd_en:
     cpp_sources_list += [
-      verilator_include_dir+"/verilated_vcd_c.cpp",
       obj_dir_prefix+"__Trace.cpp",
       obj_dir_prefix+"__Trace__Slow.cpp",
     ]
 
+  # Standard Verilator code. We used to try to prebuild this into a
+  # libverilator.a, but line tracing broke because verilated_dpi.cpp
+  # keeps the DPI scope in global state. Now the objects are compiled
+  # once and cached like any other object, but still linked into every
+  # shared library so each library gets its own copy of that state.
+
+  runtime_sources_list = [
+    verilator_include_dir+"/verilated.cpp",
+    verilator_include_dir+"/verilated_dpi.cpp",
+  ]
+
+  if vcd_en:
+    runtime_sources_list += [
+      verilator_include_dir+"/verilated_vcd_c.cpp",
+    ]
+
+  if threads > 1:
+    runtime_sources_list += [
+      verilator_include_dir+"/verilated_threads.cpp",
+    ]
+
+  # The generated sources all include the generated headers, so those
+  # are part of the key of every cached model object.
+
+  headers = []
+  for filename in sorted( os.listdir( obj_dir ) ):
+    if filename.endswith( '.h' ):
+      with open( os.path.join( obj_dir, filename ) ) as fp:
+        headers.append( fp.read() )
+
+  # Compile every file into an object in parallel, then link
+
+  flags = cxx_flags( profile, threads )
+  objs  = compile_objects( runtime_sources_list, flags, include_dirs,
+                           obj_dir )
+  objs += compile_objects( cpp_sources_list, flags, include_dirs,
+                           obj_dir, deps=headers )
+
   compile(
-    # flags        = "-O1 -fstrict-aliasing -fPIC -shared -L. -lverilator",
-    flags        = "-O1 -fstrict-aliasing -fPIC -shared",
-    include_dirs = include_dirs,
+    flags        = flags + " -shared",
+    include_dirs = [],
     output_file  = lib_file,
-    input_files  = cpp_sources_list,
+    input_files  = objs,
   )
 
+#-----------------------------------------------------------------------
+# compile_objects
+#-----------------------------------------------------------------------
+# Compile each of the given sources into an object file in obj_dir and
+# return the list of object files. Objects are kept in the build cache,
+# keyed by the source, any other dependencies (e.g., headers), the flags
+# and the compiler version, so only sources which changed since the last
+# build are recompiled. Compilation runs in parallel using up to
+# PYMTL_BUILD_JOBS jobs, by default one per core.
+
+def compile_objects( sources, flags, include_dirs, obj_dir, deps=() ):
+
+  cache = BuildCache()
+
+  def compile_object( source ):
+
+    with open( source ) as fp:
+      key = hash_key( 'object', fp.read(), flags, include_dirs,
+                      get_tool_versions(), *deps )
+
+    def build( build_dir ):
+      compile(
+        flags        = flags + " -c",
+        include_dirs = include_dirs,
+        output_file  = os.path.join( build_dir, 'obj.o' ),
+        input_files  = [ source ],
+      )
+
+    obj_file = os.path.join( obj_dir,
+                 os.path.splitext( os.path.basename( source ) )[0] + '.o' )
+
+    with cache.entry( key, build ) as entry_dir:
+      shutil.copyfile( os.path.join( entry_dir, 'obj.o' ), obj_file )
+
+    return obj_file
+
+  if not sources:
+    return []
+
+  pool = ThreadPool( min( get_build_jobs(), len( sources ) ) )
+  try:
+    return pool.map( compile_object, sources )
+  finally:
+    pool.close()
+    pool.join()
+
+#-----------------------------------------------------------------------
+# get_tool_versions
+#-----------------------------------------------------------------------
+# Returns a string identifying the installed Verilator and C++ compiler,
+# used as part of the key of cached builds. The tools are only queried
+# once per process.
+
+_tool_versions = None
+
+def get_tool_versions():
+
+  global _tool_versions
+
+  if _tool_versions is None:
+    versions = []
+    for cmd in [ 'verilator --version', 'g++ --version' ]:
+      try:
+        versions.append( check_output( cmd.split(), stderr=STDOUT ) )
+      except ( OSError, CalledProcessError ):
+        versions.append( cmd + ': unknown' )
+    _tool_versions = '\n'.join( versions )
+
+  return _tool_versions
+
+#-----------------------------------------------------------------------
+# create_ffi_cdefs
+#-----------------------------------------------------------------------
+# Declarations of the model struct and functions exposed by the C
+# wrapper. Only the exposed part of the struct is declared, which is all
+# the Python side ever accesses.
+
+def create_ffi_cdefs( model_name, cdefs, vlinetrace ):
+
+  ffi_cdefs = '''
+typedef struct {{
+
+  // Exposed port interface
+  {port_decls}
+
+  // Verilator model
+  void * model;
+
+  // VCD state
+  int _vcd_en;
+
+}} V{model_name}_t;
+
+V{model_name}_t * create_model( const char * );
+void destroy_model( V{model_name}_t *);
+void eval( V{model_name}_t * );
+int  eval_changed( V{model_name}_t *, int * );
+void cycle_n( V{model_name}_t *, unsigned int,
+              const uint32_t *, uint32_t * );
+'''
+
+  if vlinetrace:
+    ffi_cdefs += 'int  trace( V{model_name}_t *, char * );\n'
+    ffi_cdefs += 'void trace_ring_enable( V{model_name}_t *, unsigned int );\n'
+    ffi_cdefs += 'int  trace_ring_drain( V{model_name}_t *, char * );\n'
+
+  return ffi_cdefs.format( model_name = model_name,
+                           port_decls = cdefs.replace( '\n', '\n  ' ) )
+
+#-----------------------------------------------------------------------
+# create_cffi_extension
+#-----------------------------------------------------------------------
+# Compile an API-mode CFFI extension module for the shared library next
+# to it. The extension calls the wrapper functions and accesses the
+# struct fields directly from C, and the declarations are only parsed
+# when it is built instead of every time a model is constructed.
+
+def ffi_module_name( model_name ):
+  return '_V{}_ffi'.format( model_name )
+
+def create_cffi_extension( module_name, ffi_cdefs, lib_file ):
+
+  from cffi import FFI
+
+  lib_dir  = os.path.dirname( os.path.abspath( lib_file ) )
+  lib_name = os.path.basename( lib_file )[3:-3] # strip lib and .so
+
+  ffi = FFI()
+  ffi.cdef( ffi_cdefs )
+  ffi.set_source( module_name, '#include <stdint.h>\n' + ffi_cdefs,
+                  libraries       = [ lib_name ],
+                  library_dirs    = [ lib_dir ],
+                  extra_link_args = [ '-Wl,-rpath,$ORIGIN' ] )
+
+  # Build in a private directory so that only the extension itself ends
+  # up next to the library
+
+  build_dir = os.path.join( lib_dir, 'build_' + module_name )
+
+  try:
+    ext_file = ffi.compile( tmpdir=build_dir )
+  except Exception as e:
+    raise VerilatorCompileError(
+      'Building CFFI extension {} failed:\n{}'.format( module_name, e ) )
+
+  dest_file = os.path.join( lib_dir, os.path.basename( ext_file ) )
+  shutil.move( ext_file, dest_file )
+  shutil.rmtree( build_dir, ignore_errors=True )
+
+  return dest_file
+
 #-----------------------------------------------------------------------
 # create_verilator_py_wrapper
 #-----------------------------------------------------------------------
 
 def create_verilator_py_wrapper( model, wrapper_filename, lib_file,
-                                 cdefs, vlinetrace ):
+                                 ffi_cdefs, vlinetrace, api_mode=False,
+                                 threads=1 ):
 
   template_dir      = os.path.dirname( os.path.abspath( __file__ ) )
   template_filename = template_dir + os.path.sep + 'verilator_wrapper.templ.py'
 
   port_defs  = []
   set_inputs = []
-  set_comb   = []
-  set_next   = []
+  input_cbs  = []
+  set_output = []
 
   from cpp_helpers import recurse_port_hierarchy
   for x in model.get_ports( preserve_hierarchy=True ):
     recurse_port_hierarchy( x, port_defs )
 
-  for port in model.get_inports():
-    if port.name == 'clk': continue
+  inports, outports = get_cycle_n_ports( model )
+
+  # Each input gets a callback which copies it into the model when its
+  # net changes, outputs get functions which copy them out of the model
+  # when the model reports they changed
+
+  for i, port in enumerate( inports ):
     input_ = set_input_stmt( port )
-    set_inputs.extend( input_ )
+    set_inputs.append( input_ )
+    input_cbs .append( 'def set_input_{}(): {}'.format( i, input_ ) )
+    input_cbs .append( 's._cffi_update[ s.{} ] = set_input_{}'
+                       .format( port.name, i ) )
 
-  for port in model.get_outports():
+  for i, port in enumerate( outports ):
     comb, next_ = set_output_stmt( port )
-    set_comb.extend( comb  )
-    set_next.extend( next_ )
+    set_output.append( 'def set_comb_{}(): {}'.format( i, comb  ) )
+    set_output.append( 'def set_next_{}(): {}'.format( i, next_ ) )
+
+  for sigtype in [ 'comb', 'next' ]:
+    set_output.append( 's._set_{} = [ {} ]'.format( sigtype, ', '.join(
+      [ 'set_{}_{}'.format( sigtype, i ) for i in range( len( outports ) ) ]
+    )))
 
   # pretty printing
-  indent_four = '\n    '
-  indent_six  = '\n      '
+  indent_four  = '\n    '
+  indent_eight = '\n        '
 
   # create source
   with open( template_filename , 'r' ) as template, \
@@ -500,13 +786,21 @@ def create_verilator_py_wrapper( model, wrapper_filename, lib_file,
     py_src = template.read()
     py_src = py_src.format(
         model_name  = model.class_name,
-        port_decls  = cdefs,
-        lib_file    = lib_file,
+        ffi_cdefs   = ffi_cdefs,
+        lib_file    = os.path.basename( lib_file ),
+        api_mode    = '1' if api_mode else '0',
+        ffi_module  = ffi_module_name( model.class_name ),
         port_defs   = indent_four.join( port_defs ),
-        set_inputs  = indent_six .join( set_inputs ),
-        set_comb    = indent_six .join( set_comb ),
-        set_next    = indent_six .join( set_next ),
+        set_inputs  = indent_eight.join( set_inputs ),
+        input_cbs   = indent_four .join( input_cbs ),
+        set_output  = indent_four .join( set_output ),
+        num_outputs = len( outports ),
         vlinetrace  = '1' if vlinetrace else '0',
+        trace_nchars = TRACE_NCHARS,
+        threads     = threads,
+
+        cycle_n_inports  = ', '.join( 's.' + x.name for x in inports  ),
+        cycle_n_outports = ', '.join( 's.' + x.name for x in outports ),
     )
 
     #py_src += 'XTraceEverOn()' # TODO: add for tracing?
@@ -515,48 +809,134 @@ def create_verilator_py_wrapper( model, wrapper_filename, lib_file,
     #print( py_src )
 
 #-----------------------------------------------------------------------
-# get_indices
+# get_cycle_n_ports
+#-----------------------------------------------------------------------
+# Returns the lists of input and output ports, in the order in which they
+# are laid out in the cycle_n stimulus and response buffers.
+def get_cycle_n_ports( model ):
+  inports = [ x for x in model.get_inports() if x.name != 'clk' ]
+  return inports, model.get_outports()
+
+#-----------------------------------------------------------------------
+# num_words
 #-----------------------------------------------------------------------
-# Utility function for determining assignment of wide ports
-def get_indices( port ):
-  num_assigns = 1 if port.nbits <= 64 else (port.nbits-1)/32 + 1
-  if num_assigns == 1:
-    return [(0, "")]
-  return [ ( i, '[{}:{}]'.format( i*32, min( i*32+32, port.nbits) ) )
-           for i in range(num_assigns) ]
+# Number of 32-bit words a port takes in the cycle_n buffers.
+def num_words( port ):
+  return ( port.nbits - 1 ) / 32 + 1
+
+#-----------------------------------------------------------------------
+# cycle_n_copy_stmts
+#-----------------------------------------------------------------------
+# C statements copying ports from (direction 'in') or to (direction
+# 'out') a cycle_n buffer. Ports up to 64 bits are stored as integers by
+# Verilator, wider ports as arrays of 32-bit words.
+def cycle_n_copy_stmts( ports, direction ):
+
+  stmts = []
+  idx   = 0
+
+  for port in ports:
+    name = port.verilator_name
+
+    if port.nbits <= 32:
+      words = [ ( '*m->{}'.format( name ), idx ) ]
+
+    elif port.nbits <= 64 and direction == 'in':
+      stmts.append( '*m->{0} = ( (uint64_t) in[{1}] ) | '
+                    '( ( (uint64_t) in[{2}] ) << 32 );'
+                    .format( name, idx, idx+1 ) )
+      words = []
+
+    elif port.nbits <= 64:
+      stmts.append( 'out[{1}] = *m->{0}; out[{2}] = *m->{0} >> 32;'
+                    .format( name, idx, idx+1 ) )
+      words = []
+
+    else:
+      words = [ ( 'm->{}[{}]'.format( name, i ), idx+i )
+                for i in range( num_words( port ) ) ]
+
+    for field, i in words:
+      if direction == 'in':
+        stmts.append( '{} = in[{}];'.format( field, i ) )
+      else:
+        stmts.append( 'out[{}] = {};'.format( i, field ) )
+
+    idx += num_words( port )
+
+  return stmts
+
+#-----------------------------------------------------------------------
+# changed_output_stmts
+#-----------------------------------------------------------------------
+# C statements comparing every output port with the copy of its value
+# last returned to Python (the shadow buffer, laid out like a cycle_n
+# response buffer). Changed outputs are copied to the shadow buffer and
+# their index is appended to the list of changed outputs.
+def changed_output_stmts( ports ):
+
+  stmts = []
+  idx   = 0
+
+  for i, port in enumerate( ports ):
+    name = port.verilator_name
+
+    if port.nbits <= 32:
+      stmts.append( 'if ( m->_shadow[{1}] != *m->{0} ) {{ '
+                    'm->_shadow[{1}] = *m->{0}; changed[n++] = {2}; }}'
+                    .format( name, idx, i ) )
+
+    elif port.nbits <= 64:
+      stmts.append( 'if ( memcmp( &m->_shadow[{1}], m->{0}, 8 ) ) {{ '
+                    'memcpy( &m->_shadow[{1}], m->{0}, 8 ); '
+                    'changed[n++] = {2}; }}'
+                    .format( name, idx, i ) )
+
+    else:
+      stmts.append( 'if ( memcmp( &m->_shadow[{1}], m->{0}, {3} ) ) {{ '
+                    'memcpy( &m->_shadow[{1}], m->{0}, {3} ); '
+                    'changed[n++] = {2}; }}'
+                    .format( name, idx, i, 4*num_words( port ) ) )
+
+    idx += num_words( port )
+
+  return stmts
 
 #-----------------------------------------------------------------------
 # set_input_stmt
 #-----------------------------------------------------------------------
+# Statement copying an input port into the model. Ports wider than 64
+# bits are moved with a single copy into Verilator's array of words.
 def set_input_stmt( port ):
-  inputs = []
-  for idx, offset in get_indices( port ):
-    inputs.append( 's._m.{v_name}[{idx}] = s.{py_name}{offset}' \
-                    .format( v_name  = port.verilator_name,
-                             py_name = port.name,
-                             idx     = idx,
-                             offset  = offset )
-                   )
-  return inputs
+  if port.nbits <= 64:
+    return 's._m.{v_name}[0] = s.{py_name}' \
+           .format( v_name  = port.verilator_name,
+                    py_name = port.name )
+  else:
+    return 's.ffi.buffer( s._m.{v_name}, {nbytes} )[:] = ' \
+           '_to_bytes( int( s.{py_name} ), {nbytes} )' \
+           .format( v_name  = port.verilator_name,
+                    py_name = port.name,
+                    nbytes  = 4*num_words( port ) )
 
 #-----------------------------------------------------------------------
 # set_output_stmt
 #-----------------------------------------------------------------------
-# TODO: no way to distinguish between combinational and sequential
-#       outputs, so we set outputs both ways...
-#       This seems broken, but I can't think of a better way.
+# Statements copying an output port out of the model, for combinational
+# (.value) and sequential (.next) updates.
 def set_output_stmt( port ):
-  comb, next_ = [], []
-  for idx, offset in get_indices( port ):
-    assign = 's.{py_name}{offset}.{sigtype} = s._m.{v_name}[{idx}]' \
-             .format( v_name  = port.verilator_name,
-                      py_name = port.name,
-                      idx     = idx,
-                      offset  = offset,
-                      sigtype = '{sigtype}' )
-    comb .append( assign.format( sigtype = 'value' ) )
-    next_.append( assign.format( sigtype = 'next'  ) )
-  return comb, next_
+  if port.nbits <= 64:
+    assign = 's.{py_name}.{sigtype} = s._m.{v_name}[0]'
+  else:
+    assign = 's.{py_name}.{sigtype} = ' \
+             '_from_bytes( s.ffi.buffer( s._m.{v_name}, {nbytes} )[:] )'
+
+  assign = assign.format( v_name  = port.verilator_name,
+                          py_name = port.name,
+                          nbytes  = 4*num_words( port ),
+                          sigtype = '{sigtype}' )
+
+  return assign.format( sigtype = 'value' ), assign.format( sigtype = 'next' )
 
 #-----------------------------------------------------------------------
 # verilator_mangle
@@ -0,0 +1,236 @@
+#=======================================================================
+# verilator_cffi_test.py
+#=======================================================================
+
+import os
+import pytest
+
+from distutils.spawn import find_executable
+
+import verilator_cffi
+
+requires_gxx = pytest.mark.skipif( not find_executable( 'g++' ),
+                                   reason='requires g++' )
+
+#-----------------------------------------------------------------------
+# test_compile_objects
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_compile_objects( monkeypatch, tmpdir ):
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR',  str( tmpdir.join( 'cache' ) ) )
+  monkeypatch.setenv( 'PYMTL_BUILD_JOBS', '2' )
+
+  compiled = []
+  def compile( **kwargs ):
+    compiled.extend( kwargs['input_files'] )
+    real_compile( **kwargs )
+  real_compile = verilator_cffi.compile
+  monkeypatch.setattr( verilator_cffi, 'compile', compile )
+
+  src_dir = tmpdir.mkdir( 'src' )
+  sources = []
+  for i in range( 4 ):
+    src_dir.join( 'f{}.cpp'.format( i ) ).write(
+      'int f{0}( int x ) {{ return x + {0}; }}\n'.format( i ) )
+    sources.append( str( src_dir.join( 'f{}.cpp'.format( i ) ) ) )
+
+  def build():
+    obj_dir = tmpdir.mkdir( 'obj{}'.format( len( tmpdir.listdir() ) ) )
+    objs    = verilator_cffi.compile_objects( sources, '-O1 -fPIC', [],
+                                              str( obj_dir ) )
+    assert objs == [ str( obj_dir.join( 'f{}.o'.format( i ) ) )
+                     for i in range( 4 ) ]
+    assert all( os.path.exists( x ) for x in objs )
+
+  # First build compiles everything, an identical build nothing
+
+  build()
+  assert sorted( compiled ) == sources
+  del compiled[:]
+  build()
+  assert compiled == []
+
+  # Only changed sources are recompiled
+
+  src_dir.join( 'f2.cpp' ).write( 'int f2( int x ) { return x; }\n' )
+  build()
+  assert compiled == [ sources[2] ]
+
+#-----------------------------------------------------------------------
+# test_build_profiles
+#-----------------------------------------------------------------------
+def test_build_profiles( monkeypatch ):
+
+  monkeypatch.delenv( 'PYMTL_VERILATOR_PROFILE', raising=False )
+  assert verilator_cffi.get_build_profile()       == 'default'
+  assert verilator_cffi.get_build_profile( 'max' ) == 'max'
+
+  monkeypatch.setenv( 'PYMTL_VERILATOR_PROFILE', 'fast' )
+  assert verilator_cffi.get_build_profile()          == 'fast'
+  assert verilator_cffi.get_build_profile( 'debug' ) == 'debug'
+
+  with pytest.raises( ValueError ):
+    verilator_cffi.get_build_profile( 'fastest' )
+
+  assert '--assert'   in verilator_cffi.verilator_flags( False, False )
+  assert '--noassert' in verilator_cffi.verilator_flags( False, False, 'fast' )
+  assert '-O1'        in verilator_cffi.cxx_flags()
+  assert '-O3'        in verilator_cffi.cxx_flags( 'max' )
+  assert '-fPIC'      in verilator_cffi.cxx_flags( 'debug' )
+
+#-----------------------------------------------------------------------
+# test_threads
+#-----------------------------------------------------------------------
+def test_threads( monkeypatch ):
+
+  monkeypatch.delenv( 'PYMTL_VERILATOR_THREADS', raising=False )
+  assert verilator_cffi.get_threads()    == 1
+  assert verilator_cffi.get_threads( 4 ) == 4
+
+  monkeypatch.setenv( 'PYMTL_VERILATOR_THREADS', '8' )
+  assert verilator_cffi.get_threads()    == 8
+  assert verilator_cffi.get_threads( 2 ) == 2
+
+  for threads in [ 0, -1, 'many' ]:
+    with pytest.raises( ValueError ):
+      verilator_cffi.get_threads( threads )
+
+  assert '--threads' not in verilator_cffi.verilator_flags( False, False )
+  assert '--threads 4' in verilator_cffi.verilator_flags( False, False,
+                                                          'default', 4 )
+  assert '-pthread' not in verilator_cffi.cxx_flags()
+  assert '-pthread' in verilator_cffi.cxx_flags( 'default', 4 )
+
+#-----------------------------------------------------------------------
+# test_py_wrapper
+#-----------------------------------------------------------------------
+def test_py_wrapper( tmpdir ):
+
+  from pymtl              import InPort, OutPort, Model
+  from verilog_structural import mangle_name
+
+  class Wide( Model ):
+    def __init__( s ):
+      s.in_ = [ InPort( 100 ) for _ in range( 2 ) ]
+      s.out = OutPort( 40 )
+
+  model = Wide()
+  model.elaborate()
+  for port in model.get_ports():
+    port.verilog_name   = mangle_name( port.name )
+    port.verilator_name = verilator_cffi.verilator_mangle( port.verilog_name )
+
+  wrapper = str( tmpdir.join( 'Wide_v.py' ) )
+  cdefs   = verilator_cffi.create_c_wrapper( model, str( tmpdir.join( 'Wide_v.cpp' ) ),
+                                             False, False, 'zeros' )
+  ffi_cdefs = verilator_cffi.create_ffi_cdefs( model.class_name, cdefs, False )
+  verilator_cffi.create_verilator_py_wrapper( model, wrapper, 'libWide_v.so',
+                                              ffi_cdefs, False )
+
+  # Every input gets a change callback, every output a copy function
+
+  src = open( wrapper ).read()
+  assert "s._cffi_update[ s.in_[1] ] = set_input_2" in src
+  assert "s._set_comb = [ set_comb_0 ]" in src
+  assert "int  eval_changed(" in src
+  assert "changed[n++] = 0;" in tmpdir.join( 'Wide_v.cpp' ).read()
+
+  # Wide ports are converted to and from little-endian words
+
+  namespace = {}
+  exec compile( src, wrapper, 'exec' ) in namespace
+  to_bytes, from_bytes = namespace['_to_bytes'], namespace['_from_bytes']
+  for value in [ 0, 1, 0xdeadbeef, 2**100-1, 0x123456789abcdef0123456789 ]:
+    assert len( to_bytes( value, 16 ) ) == 16
+    assert from_bytes( to_bytes( value, 16 ) ) == value
+  assert to_bytes( 0x0102, 4 ) == '\x02\x01\x00\x00'
+
+#-----------------------------------------------------------------------
+# test_line_trace_wrapper
+#-----------------------------------------------------------------------
+def test_line_trace_wrapper( tmpdir ):
+
+  from pymtl              import InPort, OutPort, Model
+  from verilog_structural import mangle_name
+
+  class Traced( Model ):
+    def __init__( s ):
+      s.in_ = InPort ( 8 )
+      s.out = OutPort( 8 )
+
+  model = Traced()
+  model.elaborate()
+  for port in model.get_ports():
+    port.verilog_name   = mangle_name( port.name )
+    port.verilator_name = verilator_cffi.verilator_mangle( port.verilog_name )
+
+  wrapper   = str( tmpdir.join( 'Traced_v.py' ) )
+  cdefs     = verilator_cffi.create_c_wrapper( model,
+                str( tmpdir.join( 'Traced_v.cpp' ) ), False, True, 'zeros' )
+  ffi_cdefs = verilator_cffi.create_ffi_cdefs( model.class_name, cdefs, True )
+  verilator_cffi.create_verilator_py_wrapper( model, wrapper, 'libTraced_v.so',
+                                              ffi_cdefs, True )
+
+  # The trace size is only set in one place, and a long trace no longer
+  # aborts the simulation
+
+  c_src = tmpdir.join( 'Traced_v.cpp' ).read()
+  assert '#define TRACE_NCHARS {}'.format( verilator_cffi.TRACE_NCHARS ) in c_src
+  assert 'assert' not in c_src
+  assert 'int  trace_ring_drain(' in ffi_cdefs
+
+  # Line tracing can be turned off and uses the length returned by trace
+
+  py_src = open( wrapper ).read()
+  assert 'if 1 and s.line_trace_en:' in py_src
+  assert 's.ffi.buffer( s._line_trace_str, n )[:]' in py_src
+  assert "s.ffi.new( 'char[]', nentries * 512 )" in py_src
+
+#-----------------------------------------------------------------------
+# test_cffi_extension
+#-----------------------------------------------------------------------
+@requires_gxx
+def test_cffi_extension( tmpdir ):
+
+  # A shared library with the same kind of interface as a C wrapper
+
+  tmpdir.join( 'model_v.cpp' ).write( """
+    #include <stdint.h>
+    extern "C" {
+      typedef struct { uint32_t * in_; uint32_t * out; } V_t;
+      V_t * create_model() {
+        V_t * m = new V_t; m->in_ = new uint32_t; m->out = new uint32_t;
+        return m;
+      }
+      void eval( V_t * m ) { *m->out = *m->in_ + 1; }
+    }
+  """ )
+
+  lib_file = str( tmpdir.join( 'libmodel_v.so' ) )
+  verilator_cffi.compile( flags='-fPIC -shared', include_dirs=[],
+                          output_file=lib_file,
+                          input_files=[ str( tmpdir.join( 'model_v.cpp' ) ) ] )
+
+  ffi_cdefs = """
+    typedef struct { uint32_t * in_; uint32_t * out; } V_t;
+    V_t * create_model();
+    void eval( V_t * );
+  """
+
+  ext_file = verilator_cffi.create_cffi_extension( '_Vmodel_ffi', ffi_cdefs,
+                                                   lib_file )
+
+  # Only the extension is left next to the library, and it finds the
+  # library through its rpath
+
+  assert os.path.dirname( ext_file ) == str( tmpdir )
+  assert sorted( os.listdir( str( tmpdir ) ) ) == \
+         sorted([ 'model_v.cpp', 'libmodel_v.so', os.path.basename( ext_file ) ])
+
+  import imp
+  ext = imp.load_dynamic( '_Vmodel_ffi', ext_file )
+  m   = ext.lib.create_model()
+  m.in_[0] = 41
+  ext.lib.eval( m )
+  assert m.out[0] == 42
@@ -6,35 +6,59 @@ from __future__ import print_function
 
 import os
 import sys
-import filecmp
+import imp
 import verilog
 
-from os.path        import exists
-from verilator_cffi import verilog_to_pymtl
+from cStringIO      import StringIO
+from verilator_cffi import verilog_to_pymtl, verilator_flags, cxx_flags
+from verilator_cffi import get_tool_versions, get_build_profile, get_threads
+from build_cache    import BuildCache, hash_key, write_file_atomic
+from ..simulation.vcd import get_vcd_timescale
 
 #-----------------------------------------------------------------------
 # TranslationTool
 #-----------------------------------------------------------------------
-def TranslationTool( model_inst, lint=False, enable_blackbox=False, verilator_xinit="zeros" ):
+def TranslationTool( model_inst, lint=False, enable_blackbox=False, verilator_xinit="zeros",
+                     profile=None, api_mode=None, threads=None ):
   """Translates a PyMTL model into Python-wrapped Verilog.
 
   model_inst:      an un-elaborated Model instance
   lint:            run verilator linter, warnings are fatal
                    (disables -Wno-lint flag)
   enable_blackbox: also generate a .v file with black boxes
+  profile:         build profile, one of 'debug', 'default', 'fast' or
+                   'max' (defaults to $PYMTL_VERILATOR_PROFILE or
+                   'default', see verilator_cffi.BUILD_PROFILES)
+  api_mode:        access the model through a compiled (API-mode) CFFI
+                   extension module instead of opening the shared
+                   library at run time (ABI mode), which makes both
+                   model construction and port accesses cheaper but
+                   needs a C compiler able to build Python extensions
+                   (defaults to $PYMTL_VERILATOR_CFFI_API)
+  threads:         number of threads to evaluate the model on, only
+                   worth it for large designs (defaults to
+                   $PYMTL_VERILATOR_THREADS or 1)
+
+  The verilated model is built in a shared build cache (see
+  build_cache.py) so it is only rebuilt when the translated Verilog or
+  the build configuration changes, independent of the current working
+  directory. A copy of the translated Verilog is still written to the
+  current working directory.
   """
 
   model_inst.elaborate()
 
-  # Translate the PyMTL module to Verilog, if we've already done
-  # translation check if there's been any changes to the source
+  profile = get_build_profile( profile )
+  threads = get_threads( threads )
+
+  if api_mode is None:
+    api_mode = bool( os.environ.get( 'PYMTL_VERILATOR_CFFI_API' ) )
+
   model_name      = model_inst.class_name
   verilog_file    = model_name + '.v'
-  temp_file       = model_name + '.v.tmp'
   c_wrapper_file  = model_name + '_v.cpp'
   py_wrapper_file = model_name + '_v.py'
   lib_file        = 'lib{}_v.so'.format( model_name )
-  obj_dir         = 'obj_dir_' + model_name
   blackbox_file   = model_name + '_blackbox' + '.v'
 
   vcd_en   = True
@@ -45,50 +69,94 @@ def TranslationTool( model_inst, lint=False, enable_blackbox=False, verilator_xi
   except AttributeError:
     vcd_en = False
 
-  # Write the output to a temporary file
-  with open( temp_file, 'w+' ) as fd:
-    verilog.translate( model_inst, fd, verilator_xinit=verilator_xinit )
-
-  # write Verilog with black boxes
-  if enable_blackbox:
-    with open( blackbox_file, 'w+' ) as fd:
-      verilog.translate( model_inst, fd, enable_blackbox=True, verilator_xinit=verilator_xinit )
-
-  # Check if the temporary file matches an existing file (caching)
-
-  cached = False
-  if (     exists(verilog_file)
-       and exists(py_wrapper_file)
-       and exists(lib_file)
-       and exists(obj_dir) ):
+  try:
+    vlinetrace = model_inst.vlinetrace
+  except AttributeError:
+    vlinetrace = False
 
-    cached = filecmp.cmp( temp_file, verilog_file )
+  # Translate the PyMTL module to Verilog
 
-    # if not cached:
-    #   os.system( ' diff %s %s'%( temp_file, verilog_file ))
+  output = StringIO()
+  verilog.translate( model_inst, output, verilator_xinit=verilator_xinit )
+  verilog_src = output.getvalue()
 
-  # Rename temp to actual output
-  os.rename( temp_file, verilog_file )
+  # Only rewrite the Verilog if it changed, to leave its timestamp alone
 
-  # Verilate the module only if we've updated the verilog source
-  if not cached:
-    #print( "NOT CACHED", verilog_file )
-    verilog_to_pymtl( model_inst, verilog_file, c_wrapper_file,
-                      lib_file, py_wrapper_file, vcd_en, lint,
-                      verilator_xinit )
-  #else:
-  #  print( "CACHED", verilog_file )
+  try:
+    with open( verilog_file ) as fp:
+      changed = fp.read() != verilog_src
+  except IOError:
+    changed = True
 
-  # Use some trickery to import the verilated version of the model
-  sys.path.append( os.getcwd() )
-  __import__( py_wrapper_file[:-3] )
-  imported_module = sys.modules[ py_wrapper_file[:-3] ]
+  if changed:
+    write_file_atomic( verilog_file, verilog_src )
 
-  # Get the model class from the module, instantiate and elaborate it
-  model_class = imported_module.__dict__[ model_name ]
-  model_inst  = model_class()
+  # write Verilog with black boxes
+  if enable_blackbox:
+    output = StringIO()
+    verilog.translate( model_inst, output, enable_blackbox=True, verilator_xinit=verilator_xinit )
+    write_file_atomic( blackbox_file, output.getvalue() )
+
+  # The cache key covers everything that affects the build products
+
+  key = hash_key( verilog_src, model_name, profile, threads,
+                  verilator_flags( vcd_en, lint, profile, threads ),
+                  cxx_flags( profile, threads ),
+                  vcd_en, lint, verilator_xinit, vlinetrace, api_mode,
+                  get_vcd_timescale( model_inst ), get_tool_versions(),
+                  os.environ.get( 'PYMTL_VERILATOR_INCLUDE_DIR' ),
+                  sys.version if api_mode else '',
+                  _generator_source() )
+
+  # Verilate the module only if it is not already in the cache
+
+  def build( build_dir ):
+    path = lambda x: os.path.join( build_dir, x )
+    with open( path( verilog_file ), 'w' ) as fd:
+      fd.write( verilog_src )
+    verilog_to_pymtl( model_inst, path( verilog_file ),
+                      path( c_wrapper_file ), path( lib_file ),
+                      path( py_wrapper_file ), vcd_en, lint,
+                      verilator_xinit, profile, api_mode, threads )
+
+  with BuildCache().entry( key, build ) as build_dir:
+
+    # Import the wrapper from the cache entry. The module name includes
+    # the key so that different builds of the same model can coexist.
+
+    module_name = '{}_v_{}'.format( model_name, key[:16] )
+    if module_name not in sys.modules:
+      imp.load_source( module_name, os.path.join( build_dir, py_wrapper_file ) )
+    imported_module = sys.modules[ module_name ]
+
+    # Get the model class from the module, instantiate and elaborate it
+    model_class = imported_module.__dict__[ model_name ]
+    model_inst  = model_class()
 
   if vcd_en:
     model_inst.vcd_file = vcd_file
 
   return model_inst
+
+#-----------------------------------------------------------------------
+# _generator_source
+#-----------------------------------------------------------------------
+# Source of the wrapper generator and its templates, so that cached
+# builds are invalidated when the generator itself changes.
+
+_generator_src = None
+
+def _generator_source():
+
+  global _generator_src
+
+  if _generator_src is None:
+    src_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    src     = []
+    for filename in [ 'verilator_cffi.py', 'verilator_wrapper.templ.c',
+                      'verilator_wrapper.templ.py' ]:
+      with open( os.path.join( src_dir, filename ) ) as fp:
+        src.append( fp.read() )
+    _generator_src = '\n'.join( src )
+
+  return _generator_src
@@ -2,6 +2,8 @@
 # verilator_sim_test.py
 #=======================================================================
 
+import pytest
+
 from pymtl          import SimulationTool
 from verilator_sim  import TranslationTool
 from pymtl          import requires_verilator
@@ -18,9 +20,10 @@ pytestmark = requires_verilator
 # Test Function
 #-----------------------------------------------------------------------
 
-def reg_test( model ):
+def reg_test( model, profile=None, api_mode=None, threads=None ):
 
-  vmodel = TranslationTool( model )
+  vmodel = TranslationTool( model, profile=profile, api_mode=api_mode,
+                            threads=threads )
   vmodel.elaborate()
 
   sim = SimulationTool( vmodel )
@@ -46,3 +49,17 @@ def test_reg8():
 
 def test_reg16():
   reg_test( Reg(16) )
+
+@pytest.mark.parametrize( 'profile', [ 'debug', 'default', 'fast', 'max' ] )
+def test_reg8_profiles( profile ):
+  reg_test( Reg(8), profile )
+
+def test_reg8_api_mode():
+  reg_test( Reg(8), api_mode=True )
+
+def test_reg100_api_mode():
+  reg_test( Reg(100), api_mode=True )
+
+@pytest.mark.parametrize( 'threads', [ 2, 4 ] )
+def test_reg8_threads( threads ):
+  reg_test( Reg(8), threads=threads )
@@ -8,6 +8,7 @@
 #include "obj_dir_{model_name}/V{model_name}.h"
 #include "stdio.h"
 #include "stdint.h"
+#include "string.h"
 #include "verilated.h"
 #include "verilated_vcd_c.h"
 
@@ -22,6 +23,10 @@
 #include "svdpi.h"
 #endif
 
+// size of the line trace written by the Verilog line_trace task, which
+// is fixed by the Verilog vc/trace.v code
+#define TRACE_NCHARS {trace_nchars}
+
 //----------------------------------------------------------------------
 // CFFI Interface
 //----------------------------------------------------------------------
@@ -46,15 +51,32 @@ extern "C" {{
     unsigned char prev_clk;
     #endif
 
+    // Output values last returned to Python, see eval_changed()
+    uint32_t * _shadow;
+
+    // Line trace ring buffer, see trace_ring_enable()
+    #if VLINETRACE
+    char *        _ring;
+    unsigned int  _ring_size;
+    unsigned int  _ring_head;
+    unsigned int  _ring_count;
+    unsigned char _ring_prev_clk;
+    #endif
+
   }} V{model_name}_t;
 
   // Exposed methods
   V{model_name}_t * create_model( const char * );
   void destroy_model( V{model_name}_t *);
   void eval( V{model_name}_t * );
+  int  eval_changed( V{model_name}_t *, int * );
+  void cycle_n( V{model_name}_t *, unsigned int,
+                const uint32_t *, uint32_t * );
 
   #if VLINETRACE
-  void trace( V{model_name}_t *, char * );
+  int  trace( V{model_name}_t *, char * );
+  void trace_ring_enable( V{model_name}_t *, unsigned int );
+  int  trace_ring_drain( V{model_name}_t *, char * );
   #endif
 }}
 
@@ -90,6 +112,9 @@ V{model_name}_t * create_model( const char *vcd_filename ) {{
 
   m->model = (void *) model;
 
+  // The Python side starts with all outputs zero
+  m->_shadow = (uint32_t *) calloc( {nout_words} + 1, sizeof(uint32_t) );
+
   // Enable tracing. We have added a feature where if the vcd_filename is
   // '' then we don't do any VCD dumping even if DUMP_VCD is true.
 
@@ -110,6 +135,14 @@ V{model_name}_t * create_model( const char *vcd_filename ) {{
   }}
   #endif
 
+  #if VLINETRACE
+  m->_ring          = NULL;
+  m->_ring_size     = 0;
+  m->_ring_head     = 0;
+  m->_ring_count    = 0;
+  m->_ring_prev_clk = 0;
+  #endif
+
   // initialize exposed model interface pointers
   {port_inits}
 
@@ -136,6 +169,12 @@ void destroy_model( V{model_name}_t * m ) {{
   }}
   #endif
 
+  free( m->_shadow );
+
+  #if VLINETRACE
+  free( m->_ring );
+  #endif
+
   // TODO: this is probably a memory leak!
   //       But pypy segfaults if uncommented...
   //delete model;
@@ -151,6 +190,19 @@ void eval( V{model_name}_t * m ) {{
 
   V{model_name} * model = (V{model_name} *) m->model;
 
+  // record the line trace of the cycle that ends on a rising clock edge,
+  // like the harness does when it prints the line trace before cycling
+
+  #if VLINETRACE
+  if ( m->_ring_size && model->clk && !m->_ring_prev_clk ) {{
+    trace( m, m->_ring + m->_ring_head * TRACE_NCHARS );
+    m->_ring_head = ( m->_ring_head + 1 ) % m->_ring_size;
+    if ( m->_ring_count < m->_ring_size )
+      m->_ring_count++;
+  }}
+  m->_ring_prev_clk = model->clk;
+  #endif
+
   // evaluate one time step
   model->eval();
 
@@ -174,20 +226,79 @@ void eval( V{model_name}_t * m ) {{
 
 }}
 
+//----------------------------------------------------------------------
+// eval_changed()
+//----------------------------------------------------------------------
+// Simulate one time-step, then compare every output with the value last
+// returned to Python. The indices of the outputs which changed are
+// written to changed (which must have room for every output), and the
+// number of changed outputs is returned, so that Python only has to copy
+// those.
+
+int eval_changed( V{model_name}_t * m, int * changed ) {{
+
+  int n = 0;
+
+  eval( m );
+
+  {changed_outputs}
+
+  return n;
+
+}}
+
+//----------------------------------------------------------------------
+// cycle_n()
+//----------------------------------------------------------------------
+// Simulate n clock cycles without returning to Python. Each cycle, the
+// inputs are read from the stimulus buffer, the combinational logic is
+// evaluated, the outputs are written to the response buffer, and then
+// the clock is toggled. Every port takes (nbits-1)/32+1 consecutive
+// 32-bit words in the buffers, with ports in the order given by
+// get_cycle_n_ports in verilator_cffi.py. Either buffer may be NULL.
+
+void cycle_n( V{model_name}_t * m, unsigned int n,
+              const uint32_t * in, uint32_t * out ) {{
+
+  V{model_name} * model = (V{model_name} *) m->model;
+
+  for ( unsigned int i = 0; i < n; i++ ) {{
+
+    if ( in ) {{
+      {cycle_inputs}
+      in += {nin_words};
+    }}
+
+    eval( m );
+
+    if ( out ) {{
+      {cycle_outputs}
+      out += {nout_words};
+    }}
+
+    model->clk = 0;
+    eval( m );
+    model->clk = 1;
+    eval( m );
+
+  }}
+
+}}
+
 //----------------------------------------------------------------------
 // trace()
 //----------------------------------------------------------------------
-// Note that we assume a trace string buffer of 512 characters. This is
-// assumed in a couple of places, including the Python wrapper template
-// and the Verilog vc/trace.v code. So if we change it, we need to change
-// it everywhere.
+// Writes the line trace into str, which must have room for TRACE_NCHARS
+// characters, and returns its length. TRACE_NCHARS comes from
+// verilator_cffi.py, which also sizes the buffers of the Python wrapper,
+// and has to match the Verilog vc/trace.v code.
 
 #if VLINETRACE
-void trace( V{model_name}_t * m, char* str ) {{
+int trace( V{model_name}_t * m, char* str ) {{
 
   V{model_name} * model = (V{model_name} *) m->model;
 
-  const int nchars = 512;
+  const int nchars = TRACE_NCHARS;
   const int nwords = nchars/4;
 
   uint32_t words[nwords];
@@ -214,13 +325,14 @@ void trace( V{model_name}_t * m, char* str ) {{
   // the line trace starting from the most-signicant character due to the
   // way that Verilog handles strings.
 
-  int nchar_last  = words[0];
-  int nchars_used = ( nchars - 1 - nchar_last );
-
   // We subtract since one of the words (i.e., 4 characters) is for
-  // storing the nchars_used.
+  // storing the nchars_used. A trace which does not fit is cut short
+  // and marked with "..." instead of aborting the simulation.
 
-  assert ( nchars_used < (nchars - 4) );
+  int nchar_last = words[0];
+  int truncated  = ( nchar_last < 4 );
+  if ( truncated )
+    nchar_last = 3;
 
   // Now we need to iterate from the most-significant character to the
   // last character written by the line tracing functions and copy these
@@ -234,8 +346,53 @@ void trace( V{model_name}_t * m, char* str ) {{
     str[j] = c;
     j++;
   }}
+  if ( truncated && j >= 3 )
+    memcpy( str + j - 3, "...", 3 );
   str[j] = '\0';
 
+  return j;
+
+}}
+
+//----------------------------------------------------------------------
+// trace_ring_enable()
+//----------------------------------------------------------------------
+// Record the line traces of the last nentries cycles in a ring buffer
+// inside the model, so that they only have to be copied to Python when
+// they are needed (see trace_ring_drain). Zero disables the ring buffer.
+
+void trace_ring_enable( V{model_name}_t * m, unsigned int nentries ) {{
+
+  free( m->_ring );
+
+  m->_ring       = nentries ? (char *) malloc( nentries * TRACE_NCHARS ) : NULL;
+  m->_ring_size  = nentries;
+  m->_ring_head  = 0;
+  m->_ring_count = 0;
+
+}}
+
+//----------------------------------------------------------------------
+// trace_ring_drain()
+//----------------------------------------------------------------------
+// Copies the recorded line traces into buf, oldest first, with each
+// trace taking TRACE_NCHARS characters, and empties the ring buffer.
+// Returns the number of traces copied. buf must have room for as many
+// traces as the ring buffer.
+
+int trace_ring_drain( V{model_name}_t * m, char * buf ) {{
+
+  unsigned int n = m->_ring_count;
+
+  for ( unsigned int i = 0; i < n; i++ ) {{
+    unsigned int k = ( m->_ring_head + m->_ring_size - n + i ) % m->_ring_size;
+    memcpy( buf + i * TRACE_NCHARS, m->_ring + k * TRACE_NCHARS, TRACE_NCHARS );
+  }}
+
+  m->_ring_count = 0;
+
+  return n;
+
 }}
 #endif
 
@@ -5,46 +5,64 @@
 # were a normal PyMTL model.
 
 import os
+import imp
 
-from pymtl import *
-from cffi  import FFI
+from binascii import hexlify, unhexlify
+from pymtl    import *
+from cffi     import FFI
+
+# Conversion between integers and the little-endian word arrays used by
+# Verilator for ports wider than 64 bits (assumes a little-endian host)
+
+def _to_bytes( value, nbytes ):
+  return unhexlify( '%0*x' % ( 2*nbytes, value ) )[::-1]
+
+def _from_bytes( data ):
+  return int( hexlify( data[::-1] ), 16 )
 
 #-----------------------------------------------------------------------
-# {model_name}
+# _load_ffi
 #-----------------------------------------------------------------------
-class {model_name}( Model ):
-  id_ = 0
+# Returns the FFI and the library exposing the model. In API mode this
+# imports the compiled CFFI extension module, otherwise the interface
+# declarations are parsed and the shared library is opened (ABI mode).
+# Both live next to this wrapper.
 
-  def __init__( s ):
+_ffi_cdefs = '''{ffi_cdefs}'''
 
-    # initialize FFI, define the exposed interface
-    s.ffi = FFI()
-    s.ffi.cdef('''
-      typedef struct {{
+def _load_ffi():
 
-        // Exposed port interface
-        {port_decls}
+  lib_dir = os.path.dirname( os.path.abspath( __file__ ) )
 
-        // Verilator model
-        void * model;
+  if {api_mode}:
+    fp, path, desc = imp.find_module( '{ffi_module}', [ lib_dir ] )
+    try:
+      ext = imp.load_module( '{ffi_module}', fp, path, desc )
+    finally:
+      fp.close()
+    return ext.ffi, ext.lib
 
-        // VCD state
-        int _vcd_en;
+  ffi = FFI()
+  ffi.cdef( _ffi_cdefs )
+  return ffi, ffi.dlopen( os.path.join( lib_dir, '{lib_file}' ) )
 
-      }} V{model_name}_t;
+#-----------------------------------------------------------------------
+# {model_name}
+#-----------------------------------------------------------------------
+class {model_name}( Model ):
+  id_  = 0
+  ffi_ = None
 
-      V{model_name}_t * create_model( const char * );
-      void destroy_model( V{model_name}_t *);
-      void eval( V{model_name}_t * );
-      void trace( V{model_name}_t *, char * );
+  def __init__( s ):
 
-    ''')
+    # Import the shared library containing the model, once for all
+    # instances. We defer construction to the elaborate_logic function
+    # to allow the user to set the vcd_file.
 
-    # Import the shared library containing the model. We defer
-    # construction to the elaborate_logic function to allow the user to
-    # set the vcd_file.
+    if {model_name}.ffi_ is None:
+      {model_name}.ffi_ = _load_ffi()
 
-    s._ffi = s.ffi.dlopen('./{lib_file}')
+    s.ffi, s._ffi = {model_name}.ffi_
 
     # dummy class to emulate PortBundles
     class BundleProxy( PortBundle ):
@@ -53,15 +71,40 @@ class {model_name}( Model ):
     # define the port interface
     {port_defs}
 
+    # ports in the order of the cycle_n stimulus and response buffers
+    s._cycle_n_inports  = [ {cycle_n_inports} ]
+    s._cycle_n_outports = [ {cycle_n_outports} ]
+
+    # Inputs are only copied into the model when their value changes: the
+    # simulator calls the function registered in _cffi_update for a port
+    # whenever it is written with a new value
+    s._cffi_update = {{}}
+    {input_cbs}
+
+    # Outputs are only copied out of the model when eval_changed reports
+    # they changed, using the function with the same index
+    # FIXME: outputs are written both ways, not just comb or registered
+    {set_output}
+
+    # The first evaluation copies every input
+    s._copy_all_inputs = True
+    s._changed         = s.ffi.new( 'int[]', {num_outputs} + 1 )
+
+    # number of threads the model evaluates on
+    s.threads = {threads}
+
     # increment instance count
     {model_name}.id_ += 1
 
     # Defer vcd dumping until later
     s.vcd_file = None
 
-    # Buffer for line tracing
-    s._line_trace_str = s.ffi.new("char[512]")
-    s._convert_string = s.ffi.string
+    # Line tracing only calls into the model while line_trace_en is set,
+    # so that harnesses printing the line trace every cycle can turn it
+    # off at runtime (see also enable_trace_ring)
+    s.line_trace_en   = bool( {vlinetrace} )
+    s._line_trace_str = s.ffi.new( 'char[]', {trace_nchars} )
+    s._trace_ring_buf = None
 
   def __del__( s ):
     s._ffi.destroy_model( s._m )
@@ -83,15 +126,15 @@ class {model_name}( Model ):
     @s.combinational
     def logic():
 
-      # set inputs
-      {set_inputs}
-
-      # execute combinational logic
-      s._ffi.eval( s._m )
+      # set inputs, later changes are copied by the _cffi_update callbacks
+      # (this also makes the block sensitive to every input)
+      if s._copy_all_inputs:
+        {set_inputs}
+        s._copy_all_inputs = False
 
-      # set outputs
-      # FIXME: currently write all outputs, not just combinational outs
-      {set_comb}
+      # execute combinational logic, set changed outputs
+      for i in xrange( s._ffi.eval_changed( s._m, s._changed ) ):
+        s._set_comb[ s._changed[i] ]()
 
     @s.posedge_clk
     def tick():
@@ -99,16 +142,53 @@ class {model_name}( Model ):
       s._m.clk[0] = 0
       s._ffi.eval( s._m )
       s._m.clk[0] = 1
-      s._ffi.eval( s._m )
 
-      # double buffer register outputs
-      # FIXME: currently write all outputs, not just registered outs
-      {set_next}
+      # double buffer changed register outputs
+      for i in xrange( s._ffi.eval_changed( s._m, s._changed ) ):
+        s._set_next[ s._changed[i] ]()
+
+  def cycle_n( s, n, in_buf, out_buf ):
+    """Simulate n cycles natively, reading the inputs for every cycle
+    from in_buf and writing the outputs to out_buf (see cycle_n in the
+    C wrapper for the buffer layout). The buffers can be any objects
+    supporting the buffer protocol, such as array('I') or NumPy uint32
+    arrays, or None. The Python side is not updated for each cycle, use
+    BatchSimulationTool to run cycle_n as part of a simulation."""
+
+    as_ptr = lambda x: s.ffi.NULL if x is None else \
+                       s.ffi.cast( 'uint32_t *', s.ffi.from_buffer( x ) )
+
+    s._ffi.cycle_n( s._m, n, as_ptr( in_buf ), as_ptr( out_buf ) )
+
+    # bring the output ports up to date with the model
+    for i in xrange( s._ffi.eval_changed( s._m, s._changed ) ):
+      s._set_comb[ s._changed[i] ]()
 
   def line_trace( s ):
-    if {vlinetrace}:
-      s._ffi.trace( s._m, s._line_trace_str )
-      return s._convert_string( s._line_trace_str )
+    if {vlinetrace} and s.line_trace_en:
+      n = s._ffi.trace( s._m, s._line_trace_str )
+      return s.ffi.buffer( s._line_trace_str, n )[:]
     else:
       return ""
 
+  def enable_trace_ring( s, nentries ):
+    """Record the line traces of the last nentries cycles inside the
+    model, without copying them to Python every cycle. The traces are
+    retrieved with drain_trace_ring, zero disables the recording."""
+
+    if {vlinetrace}:
+      s._ffi.trace_ring_enable( s._m, nentries )
+      s._trace_ring_buf = s.ffi.new( 'char[]', nentries * {trace_nchars} ) \
+                          if nentries else None
+
+  def drain_trace_ring( s ):
+    """Returns the line traces recorded since the last call, oldest
+    first, and empties the ring buffer."""
+
+    if s._trace_ring_buf is None:
+      return []
+
+    n = s._ffi.trace_ring_drain( s._m, s._trace_ring_buf )
+    return [ s.ffi.string( s._trace_ring_buf + i * {trace_nchars} )
+             for i in xrange( n ) ]
+
@@ -5,22 +5,40 @@
 
 from __future__ import print_function
 
+import os
+import re
 import sys
+import types
+import marshal
 import collections
 import tempfile
+import threading
+import multiprocessing
 
 from subprocess         import check_output, STDOUT, CalledProcessError
 from verilog_structural import *
 from verilog_behavioral import translate_logic_blocks
 from exceptions         import IVerilogCompileError
+from build_cache        import BuildCache, hash_key, get_cache_dir
+from build_cache        import get_build_jobs
+from cStringIO          import StringIO
 
+from ...datatypes.Bits  import Bits
 from ..integration      import verilog
 
 #-----------------------------------------------------------------------
 # translate
 #-----------------------------------------------------------------------
-# Generates Verilog source from a PyMTL model.
-def translate( model, o=sys.stdout, enable_blackbox=False, verilator_xinit='zeros' ):
+# Generates Verilog source from a PyMTL model. Unless cache is False (or
+# the PYMTL_TRANSLATION_CACHE environment variable is set to 0), modules
+# which were translated before are emitted from the translation cache.
+# The other modules are translated by up to jobs processes in parallel
+# (see translate_modules).
+def translate( model, o=sys.stdout, enable_blackbox=False, verilator_xinit='zeros',
+               cache=None, jobs=None ):
+
+  if cache is None:
+    cache = os.environ.get( 'PYMTL_TRANSLATION_CACHE', '1' ) != '0'
 
   # List of models to translate
   translation_queue = collections.OrderedDict()
@@ -38,13 +56,18 @@ def translate( model, o=sys.stdout, enable_blackbox=False, verilator_xinit='zero
 
   # Collect all submodels in design and translate them
   collect_all_models( model )
+
+  texts = translate_modules( [ v for v in translation_queue.values()
+                               if not isinstance( v, verilog.VerilogModel ) ],
+                             enable_blackbox, verilator_xinit, cache, jobs )
+
   for k, v in translation_queue.items():
     if isinstance( v, verilog.VerilogModel ):
       x = verilog.import_module( v, o )
       if x not in append_queue:
         append_queue.append( x )
     else:
-      translate_module( v, o, enable_blackbox, verilator_xinit )
+      o.write( texts[ k ] )
 
   # Append source code for imported modules and dependecies
   verilog.import_sources( append_queue, o )
@@ -84,6 +107,275 @@ def translate_module( model, o, enable_blackbox=False, verilator_xinit='zeros' )
 
   print( file=o )
 
+#-----------------------------------------------------------------------
+# translate_modules
+#-----------------------------------------------------------------------
+# Translates each of the given models and returns a dictionary mapping
+# each class_name to its Verilog text.
+#
+# If cache is True, the text of a previous translation of the same module
+# is reused if neither the module nor the translator changed since (see
+# module_key). Translations are memoized in memory, and on disk in a
+# build cache of their own so that they survive across runs.
+#
+# If enough modules are left to translate, they are fanned out to a pool
+# of jobs processes (by default $PYMTL_BUILD_JOBS or one per core). Live
+# models cannot be pickled, so the pool is forked once the models have
+# been collected and each task only passes the position of its model in
+# the list. Workers return the module text. A module whose translation
+# fails in a worker is translated again in this process, so that errors
+# are raised exactly as in a serial translation. Forking is only safe from
+# the main thread (e.g., not from the translation threads of the
+# SubtreeOffloader, which run while the main thread keeps simulating), so
+# other threads always translate serially.
+
+_module_texts = {}
+
+PARALLEL_MIN_MODULES = 8
+
+def translate_modules( models, enable_blackbox=False, verilator_xinit='zeros',
+                       cache=True, jobs=None ):
+
+  texts = {}
+  keys  = {}
+
+  if cache:
+    disk_cache = BuildCache( os.path.join( get_cache_dir(), '_verilog' ) )
+    for model in models:
+      key  = module_key( model, enable_blackbox, verilator_xinit )
+      text = _module_texts.get( key )
+      if text is None:
+        entry_dir = disk_cache.lookup( key )
+        if entry_dir:
+          with open( os.path.join( entry_dir, 'module.v' ) ) as fp:
+            text = fp.read()
+          _module_texts[ key ] = text
+      if text is not None:
+        texts[ model.class_name ] = text
+      keys[ model.class_name ] = key
+
+  # Translate the remaining modules
+
+  misses = [ m for m in models if m.class_name not in texts ]
+  jobs   = min( jobs or get_build_jobs(), len( misses ) )
+
+  if jobs > 1 and len( misses ) >= PARALLEL_MIN_MODULES \
+     and hasattr( os, 'fork' ) \
+     and isinstance( threading.current_thread(), threading._MainThread ):
+    results = _translate_parallel( misses, enable_blackbox, verilator_xinit,
+                                   jobs )
+  else:
+    results = [ None ] * len( misses )
+
+  for model, text in zip( misses, results ):
+    if text is None:
+      output = StringIO()
+      translate_module( model, output, enable_blackbox, verilator_xinit )
+      text = output.getvalue()
+    texts[ model.class_name ] = text
+
+  # Store the new translations
+
+  if cache:
+    for model in misses:
+      key  = keys[ model.class_name ]
+      text = texts[ model.class_name ]
+      def build( build_dir ):
+        with open( os.path.join( build_dir, 'module.v' ), 'w' ) as fp:
+          fp.write( text )
+      with disk_cache.entry( key, build ):
+        _module_texts[ key ] = text
+
+  return texts
+
+#-----------------------------------------------------------------------
+# _translate_parallel
+#-----------------------------------------------------------------------
+# Translates the models in a forked pool of processes. Returns the list
+# of module texts, with None for the modules which failed to translate.
+
+_pool_models = None
+
+def _translate_in_worker( args ):
+
+  index, enable_blackbox, verilator_xinit = args
+
+  try:
+    output = StringIO()
+    translate_module( _pool_models[ index ], output, enable_blackbox,
+                      verilator_xinit )
+    return output.getvalue()
+  except Exception:
+    return None
+
+def _translate_parallel( models, enable_blackbox, verilator_xinit, jobs ):
+
+  global _pool_models
+
+  _pool_models = models
+  try:
+    pool = multiprocessing.Pool( jobs )
+    try:
+      return pool.map( _translate_in_worker,
+                       [ ( i, enable_blackbox, verilator_xinit )
+                         for i in range( len( models ) ) ], chunksize=1 )
+    finally:
+      pool.close()
+      pool.join()
+  finally:
+    _pool_models = None
+
+#-----------------------------------------------------------------------
+# module_key
+#-----------------------------------------------------------------------
+# Cache key of the translation of a single module. It covers the module
+# name (which includes a hash of its parameters), the parameters and
+# options printed in the module header, the code and source files of
+# the model class (and its bases) and of its logic blocks, the values of
+# the globals, closure variables and integer attributes the logic blocks
+# read (which the translator inlines as localparams), the structure the
+# constructor built (the interfaces of the model, its connections as
+# they are printed, and the interfaces and parameters of its
+# submodules), and the translator itself.
+
+def module_key( model, enable_blackbox=False, verilator_xinit='zeros' ):
+
+  parts = [ model.class_name, enable_blackbox, verilator_xinit,
+            _translator_hash() ]
+
+  # Options and parameters, without object addresses
+
+  parts.extend([ hasattr( model, 'vcd_file' ) and model.vcd_file != '',
+                 model.vblackbox, model.vbb_modulename,
+                 sorted( model.vannotate_arrays.items() ),
+                 model.vmark_as_bram ])
+  parts.append( _args_key( model ) )
+
+  # Code of the model class and its bases, and of its logic blocks
+
+  for cls in type( model ).__mro__[:-1]:
+    module = sys.modules.get( cls.__module__ )
+    parts.append( _file_hash( getattr( module, '__file__', '' ) ) )
+    for name, value in sorted( vars( cls ).items() ):
+      if isinstance( value, types.FunctionType ):
+        parts.append( marshal.dumps( value.__code__ ) )
+
+  for func in ( model.get_posedge_clk_blocks()
+              + model.get_combinational_blocks() ):
+    parts.append( _file_hash( func.__code__.co_filename ) )
+    parts.append( marshal.dumps( func.__code__ ) )
+    parts.append( _free_values( func ) )
+
+  parts.extend( ( name, _value_key( value ) )
+                for name, value in sorted( vars( model ).items() )
+                if not name.startswith( '_' ) and _is_param( value ) )
+
+  # Structure of the model and interfaces of its submodules. The
+  # connections are keyed by their Verilog text, which covers the names
+  # and slices of both ends and the values of constants.
+
+  signature = lambda m: [ ( x.name, x.nbits, type( x ).__name__ )
+                          for x in m.get_ports() ]
+
+  parts.append( signature( model ) )
+  parts.append( [ ( x.name, x.nbits ) for x in model.get_wires() ] )
+  parts.append( signal_assignments( model, None ) )
+  for subm in model.get_submodules():
+    parts.append( ( subm.name, subm.class_name, _args_key( subm ),
+                    signature( subm ) ) )
+
+  return hash_key( *parts )
+
+# Parameters of a model, without object addresses
+
+def _args_key( model ):
+  return [ re.sub( ' at 0x[0-9a-fA-F]+', '', '{}={}'.format( k, v ) )
+           for k, v in sorted( model._args.items() ) ]
+
+# Attributes the translator can inline as localparams (or arrays of
+# localparams)
+
+def _is_param( value ):
+  if isinstance( value, ( list, tuple ) ):
+    return bool( value ) and all( _is_param( x ) for x in value )
+  return isinstance( value, ( int, long, Bits ) )
+
+#-----------------------------------------------------------------------
+# _free_values
+#-----------------------------------------------------------------------
+# Values of the globals (including those used by nested code, such as
+# generator expressions) and closure variables a logic block reads.
+
+def _free_values( func ):
+
+  values = []
+
+  codes = [ func.__code__ ]
+  while codes:
+    code = codes.pop()
+    for name in code.co_names:
+      if name in func.__globals__:
+        values.append( ( name, _value_key( func.__globals__[ name ] ) ) )
+    codes.extend( x for x in code.co_consts if isinstance( x, types.CodeType ) )
+
+  for name, cell in zip( func.__code__.co_freevars, func.__closure__ or () ):
+    try:
+      values.append( ( name, _value_key( cell.cell_contents ) ) )
+    except ValueError: # empty cell
+      pass
+
+  return values
+
+# Modules are identified by their source, functions by their code, and
+# everything else by its repr without object addresses
+
+def _value_key( value ):
+
+  if isinstance( value, types.ModuleType ):
+    return value.__name__, _file_hash( getattr( value, '__file__', '' ) )
+  if isinstance( value, types.FunctionType ):
+    return value.__name__, marshal.dumps( value.__code__ )
+  return re.sub( ' at 0x[0-9a-fA-F]+', '', repr( value ) )
+
+#-----------------------------------------------------------------------
+# _file_hash
+#-----------------------------------------------------------------------
+# Hash of the contents of a (Python source) file, memoized as long as
+# the file is not modified.
+
+_file_hashes = {}
+
+def _file_hash( filename ):
+
+  if filename.endswith( ( '.pyc', '.pyo' ) ):
+    filename = filename[:-1]
+
+  try:
+    stat = os.stat( filename )
+  except OSError:
+    return filename
+
+  key = ( filename, stat.st_mtime, stat.st_size )
+  if key not in _file_hashes:
+    with open( filename ) as fp:
+      _file_hashes[ key ] = hash_key( fp.read() )
+
+  return _file_hashes[ key ]
+
+#-----------------------------------------------------------------------
+# _translator_hash
+#-----------------------------------------------------------------------
+# Hash of the source of the translator modules.
+
+def _translator_hash():
+
+  import verilog_structural, verilog_behavioral, visitors
+  from .. import ast_helpers
+
+  return hash_key( *[ _file_hash( m.__file__ ) for m in
+                      [ sys.modules[ __name__ ], verilog_structural,
+                        verilog_behavioral, visitors, ast_helpers ] ] )
+
 #-----------------------------------------------------------------------
 # check_compile
 #-----------------------------------------------------------------------
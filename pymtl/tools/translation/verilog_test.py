@@ -0,0 +1,255 @@
+#=======================================================================
+# verilog_test.py
+#=======================================================================
+
+import pytest
+
+from cStringIO import StringIO
+
+from pymtl      import *
+from exceptions import VerilogTranslationError
+import verilog
+
+#-----------------------------------------------------------------------
+# Test Models
+#-----------------------------------------------------------------------
+
+class Leaf( Model ):
+  def __init__( s, nbits ):
+    s.in_ = InPort ( nbits )
+    s.out = OutPort( nbits )
+    @s.combinational
+    def comb():
+      s.out.value = s.in_ + 1
+
+class Bad( Model ):
+  def __init__( s ):
+    s.out = OutPort( 8 )
+    s.vals = [ 0, 1 ]
+    @s.combinational
+    def comb():
+      for i in s.vals:
+        s.out.value = i
+
+class Top( Model ):
+  def __init__( s, nbits ):
+    s.in_  = InPort ( nbits )
+    s.out  = OutPort( nbits )
+    s.leaf = [ Leaf( nbits ) for _ in range( 2 ) ]
+    s.connect( s.in_,          s.leaf[0].in_ )
+    s.connect( s.leaf[0].out,  s.leaf[1].in_ )
+    s.connect( s.leaf[1].out,  s.out         )
+
+class Many( Model ):
+  def __init__( s, bad=False ):
+    s.leaves = [ Leaf( nbits ) for nbits in range( 1, 11 ) ]
+    if bad:
+      s.bad = Bad()
+
+#-----------------------------------------------------------------------
+# Helpers
+#-----------------------------------------------------------------------
+
+@pytest.fixture
+def translated( monkeypatch, tmpdir ):
+
+  monkeypatch.setenv( 'PYMTL_CACHE_DIR', str( tmpdir ) )
+  monkeypatch.setattr( verilog, '_module_texts', {} )
+
+  log = []
+  def translate_module( model, *args ):
+    log.append( model.class_name )
+    real_translate_module( model, *args )
+  real_translate_module = verilog.translate_module
+  monkeypatch.setattr( verilog, 'translate_module', translate_module )
+
+  return log
+
+def translate( model, cache=True, jobs=None ):
+  model.elaborate()
+  output = StringIO()
+  verilog.translate( model, output, cache=cache, jobs=jobs )
+  return output.getvalue()
+
+#-----------------------------------------------------------------------
+# test_translation_cache
+#-----------------------------------------------------------------------
+def test_translation_cache( translated, monkeypatch ):
+
+  uncached = translate( Top( 8 ), cache=False )
+  del translated[:]
+
+  # Each module is translated once, the text is identical
+
+  assert translate( Top( 8 ) ) == uncached
+  assert len( translated ) == 2
+
+  # Reused from memory, then from disk
+
+  del translated[:]
+  assert translate( Top( 8 ) ) == uncached
+  monkeypatch.setattr( verilog, '_module_texts', {} )
+  assert translate( Top( 8 ) ) == uncached
+  assert translated == []
+
+  # Different parameters are different modules
+
+  assert translate( Top( 16 ) ) == translate( Top( 16 ), cache=False )
+  assert len( translated ) == 4
+
+#-----------------------------------------------------------------------
+# test_module_key
+#-----------------------------------------------------------------------
+def test_module_key():
+
+  def key( model, **kwargs ):
+    model.elaborate()
+    return verilog.module_key( model, **kwargs )
+
+  assert key( Leaf( 8 ) ) == key( Leaf( 8 ) )
+  assert key( Leaf( 8 ) ) != key( Leaf( 8 ), verilator_xinit='ones' )
+  assert key( Leaf( 8 ) ) != key( Leaf( 16 ) )
+
+  model = Leaf( 8 )
+  model.vcd_file = 'leaf.vcd'
+  assert key( model ) != key( Leaf( 8 ) )
+
+  # A class with the same name but a different definition
+
+  class Leaf_( Model ):
+    def __init__( s, nbits ):
+      s.in_ = InPort ( nbits )
+      s.out = OutPort( nbits )
+      @s.combinational
+      def comb():
+        s.out.value = s.in_ + 2
+
+  model, leaf = Leaf_( 8 ), Leaf( 8 )
+  model.elaborate()
+  leaf .elaborate()
+  model.class_name = leaf.class_name
+  assert verilog.module_key( model ) != verilog.module_key( leaf )
+
+#-----------------------------------------------------------------------
+# test_module_key_constants
+#-----------------------------------------------------------------------
+# Globals and closure variables read by logic blocks are inlined into the
+# Verilog, so their values are part of the key
+
+K = 3
+
+class Const( Model ):
+  def __init__( s, incr ):
+    s.in_ = InPort ( 8 )
+    s.out = OutPort( 8 )
+    @s.combinational
+    def comb():
+      s.out.value = s.in_ + K + incr
+
+def test_module_key_constants( monkeypatch ):
+
+  import sys
+
+  def key( incr ):
+    model = Const( incr )
+    model.elaborate()
+    return verilog.module_key( model )
+
+  base = key( 1 )
+  assert key( 1 ) == base
+
+  monkeypatch.setattr( sys.modules[ __name__ ], 'K', 5 )
+  assert key( 1 ) != base
+
+  # Closure variables
+
+  model = Const( 2 )
+  model.elaborate()
+  values = verilog._free_values( model.get_combinational_blocks()[0] )
+  assert ( 'K', '5' ) in values and ( 'incr', '2' ) in values
+
+#-----------------------------------------------------------------------
+# test_module_key_structure
+#-----------------------------------------------------------------------
+# The constructor can pick the structure of a model from constants which
+# are neither parameters nor read by logic blocks
+
+class Wiring( Model ):
+  def __init__( s ):
+    s.in_ = InPort ( 8 )
+    s.out = OutPort( 8 )
+    s.connect( s.out, s.in_ if K == 3 else 0 )
+
+class Attr( Model ):
+  def __init__( s ):
+    s.in_  = InPort ( 8 )
+    s.out  = OutPort( 8 )
+    s.incr = K
+    @s.combinational
+    def comb():
+      s.out.value = s.in_ + s.incr
+
+def test_module_key_structure( translated, monkeypatch ):
+
+  import sys
+
+  wiring = translate( Wiring() )
+  attr   = translate( Attr() )
+  assert 'assign out = in_;' in wiring
+
+  monkeypatch.setattr( sys.modules[ __name__ ], 'K', 5 )
+
+  assert translate( Wiring() ) == translate( Wiring(), cache=False )
+  assert "assign out = 8'd0;" in translate( Wiring() )
+  assert translate( Attr() ) == translate( Attr(), cache=False ) != attr
+
+#-----------------------------------------------------------------------
+# test_parallel_translation
+#-----------------------------------------------------------------------
+def test_parallel_translation( translated ):
+
+  serial = translate( Many(), cache=False, jobs=1 )
+  assert len( translated ) == 11
+
+  # Modules are translated in workers, but emitted in the same order
+
+  del translated[:]
+  assert translate( Many(), cache=False, jobs=4 ) == serial
+  assert translated == []
+
+  # Translation errors are raised as usual
+
+  with pytest.raises( VerilogTranslationError ):
+    translate( Many( bad=True ), cache=False, jobs=4 )
+  # ... only the failed module is translated again in this process
+
+  assert len( translated ) == 1 and translated[0].startswith( 'Bad' )
+
+#-----------------------------------------------------------------------
+# test_translate_modules_thread
+#-----------------------------------------------------------------------
+# Other threads than the main thread never fork, whatever their name
+
+def test_translate_modules_thread( translated, monkeypatch ):
+
+  import threading
+
+  models = Many().leaves
+  for model in models:
+    model.elaborate()
+
+  serial = verilog.translate_modules( models, cache=False, jobs=1 )
+
+  def translate_parallel( *args ):
+    raise AssertionError( 'forked outside of the main thread' )
+  monkeypatch.setattr( verilog, '_translate_parallel', translate_parallel )
+
+  del translated[:]
+  results = []
+  thread  = threading.Thread( name='MainThread', target=lambda:
+              results.append( verilog.translate_modules( models, cache=False,
+                                                         jobs=4 ) ) )
+  thread.start()
+  thread.join()
+  assert results == [ serial ]
+  assert len( translated ) == 10